@@ -2,7 +2,7 @@
 # -*- encoding: utf-8 -*-
 {
     'name': 'Asterisk Plus',
-    'version': '1.1',
+    'version': '1.2',
     'author': 'Odooist',
     'price': 0,
     'currency': 'EUR',
@@ -43,12 +43,14 @@
         'views/res_partner.xml',
         'views/call.xml',
         'views/channel.xml',
+        'views/live_channel.xml',
         'views/channel_message.xml',
         'views/templates.xml',
         'views/tag.xml',
         'views/conf.xml',
         'views/security.xml',
         'views/debug.xml',
+        'views/salt_job.xml',
         # Cron
         'views/ir_cron.xml',
         # Wizards
@@ -62,6 +64,9 @@
         'views/web_phone_settings.xml',
     ],
     'qweb': ['static/src/xml/*.xml'],
+    'pre_init_hook': 'pre_init_hook',
+    'post_init_hook': 'post_init_hook',
+    'uninstall_hook': 'uninstall_hook',
     'installable': True,
     'application': True,
     'auto_install': False,
@@ -70,6 +75,7 @@
         'web.assets_backend': [
             '/asterisk_plus/static/src/js/support.js',
             '/asterisk_plus/static/src/js/actions.js',
+            '/asterisk_plus/static/src/js/live_view.js',
             '/asterisk_plus/static/src/js/originate.js',
             '/asterisk_plus/static/src/js/web_phone.js',
             '/asterisk_plus/static/src/js/asterisk_conf.js',
@@ -1,32 +1,41 @@
 # ©️ OdooPBX by Odooist, Odoo Proprietary License v1.0, 2020
+import hashlib
+import json
 import logging
 import uuid
 from odoo import http, SUPERUSER_ID, registry, tools
 from odoo.api import Environment
-from werkzeug.exceptions import BadRequest
+from werkzeug.exceptions import BadRequest, NotFound
+from ..models.ip_access import ip_permitted
+from ..models.salt_job import poll_salt_job
 
 logger = logging.getLogger(__name__)
 
+#: Max numbers resolved by one caller_profiles request.
+CALLER_PROFILES_MAX = 1000
+#: Seconds Asterisk may reuse a caller_profile answer.
+CALLER_PROFILE_MAX_AGE = 30
+#: Fields of the compact caller_profile answer, separated by |.
+CALLER_PROFILE_FIELDS = ('id', 'name', 'manager_exten', 'manager_channels',
+                         'tags')
+
 
 class AsteriskPlusController(http.Controller):
 
     def check_ip(self, db=None):
         if db:
             with registry(db).cursor() as cr:
-                env = Environment(cr, SUPERUSER_ID, {})
-                allowed_ips = env[
-                    'asterisk_plus.settings'].sudo().get_param(
-                    'permit_ip_addresses')
-        else:
-            allowed_ips = http.request.env[
-                'asterisk_plus.settings'].sudo().get_param(
-                'permit_ip_addresses')
-        if allowed_ips:
-            remote_ip = http.request.httprequest.remote_addr
-            if remote_ip not in [
-                    k.strip(' ') for k in allowed_ips.split(',')]:
-                return BadRequest(
-                    'Your IP address {} is not allowed!'.format(remote_ip))
+                return self._check_ip(Environment(cr, SUPERUSER_ID, {}))
+        return self._check_ip(http.request.env)
+
+    def _check_ip(self, env):
+        # Compiled once and cached until the settings are changed.
+        settings = env['asterisk_plus.settings'].sudo()
+        networks = settings.get_permit_ip_networks()
+        remote_ip = http.request.httprequest.remote_addr
+        if not ip_permitted(networks, remote_ip):
+            return BadRequest(
+                'Your IP address {} is not allowed!'.format(remote_ip))
 
     def _get_partner_by_number(self, db, number, country_code):
         # If db is passed init env for this db
@@ -146,31 +155,161 @@ class AsteriskPlusController(http.Controller):
             else:
                 return 'Error'
 
+    def _caller_profiles(self, env, numbers, country_code):
+        checked = self._check_ip(env)
+        if checked is not None:
+            return {'error': checked.description}
+        return {'profiles': env['res.partner'].sudo().get_caller_profiles(
+            numbers, country_code)}
+
+    @http.route('/asterisk_plus/caller_profiles', type='json', auth='none')
+    def caller_profiles(self, db=None, numbers=None, country=None, **kw):
+        """Resolve many numbers at once with one cursor.
+
+        Returns:
+            {'profiles': {number: {'id', 'name', 'manager_exten',
+            'manager_channels', 'tags'}}} or {'error': message}.
+        """
+        numbers = [str(k).replace(' ', '') for k in numbers or [] if k]
+        if not numbers:
+            return {'error': 'Numbers not specified in request'}
+        if len(numbers) > CALLER_PROFILES_MAX:
+            return {'error': 'Too many numbers, max {}'.format(
+                CALLER_PROFILES_MAX)}
+        try:
+            if db:
+                with registry(db).cursor() as cr:
+                    return self._caller_profiles(
+                        Environment(cr, SUPERUSER_ID, {}), numbers,
+                        country or False)
+            return self._caller_profiles(
+                http.request.env, numbers, country or False)
+        except Exception as e:
+            logger.exception('Error:')
+            if 'request not bound to a database' in str(e):
+                return {'error': 'db_not_specified'}
+            elif 'database' in str(e) and 'does not exist' in str(e):
+                return {'error': 'db_not_exists'}
+            return {'error': 'Error'}
+
+    @http.route('/asterisk_plus/caller_profile', type='http', auth='none')
+    def caller_profile(self, **kw):
+        """Name, manager and tags of the caller in one line.
+
+        Fields are CALLER_PROFILE_FIELDS separated by | so the dialplan can
+        split them with CUT, id and name are empty if the partner is not
+        found.
+        Answers carry an ETag and may be cached for CALLER_PROFILE_MAX_AGE.
+        """
+        db = kw.get('db')
+        try:
+            number = kw.get('number', '').replace(' ', '')  # Strip spaces
+            country_code = kw.get('country') or False
+            if not number:
+                return BadRequest('Number not specified in request')
+            if db:
+                with registry(db).cursor() as cr:
+                    res = self._caller_profiles(
+                        Environment(cr, SUPERUSER_ID, {}), [number],
+                        country_code)
+            else:
+                res = self._caller_profiles(
+                    http.request.env, [number], country_code)
+            if 'error' in res:
+                return BadRequest(res['error'])
+            profile = res['profiles'][number]
+            if not profile['id']:
+                # Same as get_caller_name for unknown callers.
+                profile.update(id='', name='')
+            body = '|'.join(str(profile[k]).replace('|', ' ')
+                            for k in CALLER_PROFILE_FIELDS)
+            response = http.Response(body, content_type='text/plain')
+            response.set_etag(hashlib.sha1(body.encode()).hexdigest())
+            response.headers['Cache-Control'] = 'private, max-age={}'.format(
+                CALLER_PROFILE_MAX_AGE)
+            # 304 Not Modified if the caller sent the same ETag.
+            return response.make_conditional(http.request.httprequest)
+        except Exception as e:
+            logger.exception('Error:')
+            if 'request not bound to a database' in str(e):
+                return 'db_not_specified'
+            elif 'database' in str(e) and 'does not exist' in str(e):
+                return 'db_not_exists'
+            else:
+                return 'Error'
+
+    def _submit_job(self, dbname, uid, method, *args, **kwargs):
+        """Submit an awaitable job and return its handle.
+        The job is sent to Salt when the cursor is committed.
+        """
+        with registry(dbname).cursor() as cr:
+            env = Environment(cr, uid, {})
+            job = getattr(env['asterisk_plus.server'].browse(1), method)(
+                *args, awaitable=True, **kwargs)
+            return job.handle
+
+    def _job_response(self, dbname, handle, wait):
+        """Return the job result or 202 with its handle to poll if it is not
+        ready.
+        """
+        res = poll_salt_job(dbname, handle, wait=wait)
+        if res is None:
+            return NotFound()
+        status = 200
+        if res['state'] in ('queued', 'pending'):
+            status = 202
+            res = {
+                'state': res['state'],
+                'handle': handle,
+                'poll': '/asterisk_plus/job/{}?dbname={}'.format(
+                    handle, dbname),
+            }
+        return http.Response(json.dumps(res, default=str), status=status,
+                             content_type='application/json')
+
+    @http.route('/asterisk_plus/job/<string:handle>', type='http', auth='none')
+    def job_result(self, handle, **kwargs):
+        """Poll the job result. Waits up to wait seconds for the result,
+        no longer than JOB_POLL_MAX_WAIT.
+        """
+        dbname = kwargs.get('dbname', 'odoopbx_15')
+        try:
+            checked = self.check_ip(dbname)
+            if checked is not None:
+                return checked
+            return self._job_response(dbname, handle, kwargs.get('wait', 0))
+        except Exception as e:
+            logger.exception('Error:')
+            return '{}'.format(e)
+
     @http.route('/asterisk_plus/ping', type='http', auth='none')
     def asterisk_ping(self, **kwargs):
         dbname = kwargs.get('dbname', 'odoopbx_15')
-        with registry(dbname).cursor() as cr:
-            env = Environment(cr, SUPERUSER_ID, {})
-            try:
-                res = env['asterisk_plus.server'].browse(1).local_job(
-                    fun='test.ping', sync=True)
-                return http.Response('{}'.format(res))
-            except Exception as e:
-                logger.exception('Error:')
-                return '{}'.format(e)
+        try:
+            checked = self.check_ip(dbname)
+            if checked is not None:
+                return checked
+            handle = self._submit_job(dbname, SUPERUSER_ID, 'local_job',
+                                      fun='test.ping')
+            return self._job_response(dbname, handle, kwargs.get('wait', 0))
+        except Exception as e:
+            logger.exception('Error:')
+            return '{}'.format(e)
 
     @http.route('/asterisk_plus/asterisk_ping', type='http', auth='none')
     def ping(self, **kwargs):
         dbname = kwargs.get('dbname', 'demo_15.0')
-        with registry(dbname).cursor() as cr:
-            env = Environment(cr, http.request.env.ref('base.user_admin').id, {})
-            try:
-                res = env['asterisk_plus.server'].browse(1).ami_action(
-                    {'Action': 'Ping'}, sync=True)
-                return http.Response('{}'.format(res))
-            except Exception as e:
-                logger.exception('Error:')
-                return '{}'.format(e)
+        try:
+            checked = self.check_ip(dbname)
+            if checked is not None:
+                return checked
+            handle = self._submit_job(
+                dbname, http.request.env.ref('base.user_admin').id,
+                'ami_action', {'Action': 'Ping'})
+            return self._job_response(dbname, handle, kwargs.get('wait', 0))
+        except Exception as e:
+            logger.exception('Error:')
+            return '{}'.format(e)
 
     @http.route('/asterisk_plus/signup', auth='user')
     def signup(self):
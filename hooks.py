@@ -0,0 +1,60 @@
+# ©️ OdooPBX by Odooist, Odoo Proprietary License v1.0, 2020
+import logging
+from odoo import api, SUPERUSER_ID
+from odoo.tools.sql import column_exists, create_column, table_exists
+from .models.res_partner import RENORMALIZE_PARAM
+
+logger = logging.getLogger(__name__)
+
+#: Columns of stored computed fields filled by jobs after install / upgrade:
+#: (table, [(column, type)], parameter starting the job). Columns are
+#: added on install to tables of other modules and on upgrade from
+#: releases without them.
+BACKFILL_COLUMNS = [
+    ('res_partner', [('phone_normalized', 'varchar'),
+                     ('mobile_normalized', 'varchar')], RENORMALIZE_PARAM),
+]
+
+
+def add_backfill_columns(cr):
+    """Add missing columns empty so Odoo does not compute them in the
+    install / upgrade transaction and start their backfill jobs.
+    """
+    for table, columns, param in BACKFILL_COLUMNS:
+        if not table_exists(cr, table) or all(
+                column_exists(cr, table, k) for k, _ in columns):
+            continue
+        for column, column_type in columns:
+            if not column_exists(cr, table, column):
+                create_column(cr, table, column, column_type)
+        cr.execute("""
+            INSERT INTO ir_config_parameter (key, value) VALUES (%s, '0')
+            ON CONFLICT (key) DO UPDATE SET value = '0'
+        """, (param,))
+        logger.info('%s columns added empty, backfill job %s started.',
+                    table, param)
+
+
+def start_backfill_jobs(env):
+    """Start backfill jobs of the added columns in their crons."""
+    params = env['ir.config_parameter'].sudo()
+    if params.get_param(RENORMALIZE_PARAM):
+        env['res.partner'].renormalize_phones_later(restart=True)
+        params.set_param(RENORMALIZE_PARAM, False)
+
+
+def pre_init_hook(cr):
+    add_backfill_columns(cr)
+
+
+def post_init_hook(cr, registry):
+    start_backfill_jobs(api.Environment(cr, SUPERUSER_ID, {}))
+
+
+def uninstall_hook(cr, registry):
+    """Drop the SQL objects not declared as models."""
+    cr.execute("""
+        DROP TABLE IF EXISTS asterisk_plus_callerid_invalidation;
+        DROP TRIGGER IF EXISTS asterisk_plus_callerid_update ON res_partner;
+        DROP FUNCTION IF EXISTS asterisk_plus_callerid_notify() CASCADE;
+    """)
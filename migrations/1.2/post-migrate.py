@@ -0,0 +1,55 @@
+import json
+import zlib
+from psycopg2 import Binary
+from psycopg2.extras import execute_values
+from odoo import api, SUPERUSER_ID
+from odoo.tools.sql import column_exists
+from odoo.addons.asterisk_plus.hooks import start_backfill_jobs
+
+#: Channel messages converted per statement.
+MESSAGE_CHUNK = 1000
+
+
+def compress_channel_messages(cr):
+    """Move the text messages of the AMI trace to compressed payloads and
+    drop the old column.
+    """
+    if not column_exists(cr, 'asterisk_plus_channel_message', 'message'):
+        return
+    last_id = 0
+    while True:
+        cr.execute("""
+            SELECT id, message FROM asterisk_plus_channel_message
+            WHERE id > %s AND message IS NOT NULL AND payload IS NULL
+            ORDER BY id LIMIT %s
+        """, (last_id, MESSAGE_CHUNK))
+        rows = cr.fetchall()
+        if not rows:
+            break
+        values = []
+        for message_id, message in rows:
+            try:
+                message = json.dumps(json.loads(message),
+                                     separators=(',', ':'))
+            except ValueError:
+                message = json.dumps({'message': message})
+            values.append((message_id,
+                           Binary(zlib.compress(message.encode()))))
+        execute_values(cr, """
+            UPDATE asterisk_plus_channel_message m SET payload = v.payload
+            FROM (VALUES %s) AS v (id, payload) WHERE m.id = v.id
+        """, values, template='(%s, %s::bytea)')
+        last_id = rows[-1][0]
+    cr.execute('ALTER TABLE asterisk_plus_channel_message DROP COLUMN message')
+
+
+def migrate(cr, version):
+    # Jobs from before the queue were sent already but got the queued
+    # default of the new state column, do not send them again.
+    cr.execute("""
+        UPDATE asterisk_plus_salt_job
+        SET state = CASE WHEN success IS NULL THEN 'expired' ELSE 'done' END
+        WHERE jid IS NOT NULL AND state = 'queued'
+    """)
+    compress_channel_messages(cr)
+    start_backfill_jobs(api.Environment(cr, SUPERUSER_ID, {}))
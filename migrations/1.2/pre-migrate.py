@@ -0,0 +1,6 @@
+from odoo.addons.asterisk_plus.hooks import add_backfill_columns
+
+
+def migrate(cr, version):
+    # Releases before the normalized partner numbers were stored.
+    add_backfill_columns(cr)
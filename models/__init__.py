@@ -1,7 +1,11 @@
+from . import backfill
 from . import event
+from . import view_update
+from . import live_view
 from . import call
 from . import call_event
 from . import channel
+from . import live_channel
 from . import channel_message
 from . import recording
 from . import res_users
@@ -10,6 +14,7 @@ from . import settings
 from . import salt_job
 from . import user_channel
 from . import user
+from . import phone_directory
 from . import res_partner
 from . import tag
 from . import web_phone_settings
@@ -0,0 +1,187 @@
+# ©️ OdooPBX by Odooist, Odoo Proprietary License v1.0, 2020
+import logging
+import select
+import socket
+import threading
+import uuid
+
+logger = logging.getLogger(__name__)
+
+#: Idle connections kept per server.
+AMI_POOL_SIZE = 4
+AMI_CONNECT_TIMEOUT = 3
+#: Actions that can be sent through the direct connection.
+AMI_DIRECT_ACTIONS = ('Originate', 'Ping', 'Reload', 'ReloadEvents')
+
+AMI_POOLS = {}
+AMI_POOLS_LOCK = threading.Lock()
+
+
+class AmiError(Exception):
+    pass
+
+
+class AmiNotSentError(AmiError):
+    """Nothing was written, the actions can be sent another way."""
+
+
+class AmiConnection:
+    """A logged in AMI connection. Events are turned off."""
+
+    def __init__(self, host, port, login, password):
+        self.broken = False
+        self.sock = socket.create_connection(
+            (host, port), timeout=AMI_CONNECT_TIMEOUT)
+        self.file = self.sock.makefile('rb')
+        banner = self.file.readline()
+        if not banner.startswith(b'Asterisk Call Manager'):
+            self.close()
+            raise AmiError('Not an AMI banner: {!r}'.format(banner))
+        res = self.send({'Action': 'Login', 'Username': login,
+                         'Secret': password, 'Events': 'off'})
+        if res.get('Response') != 'Success':
+            self.close()
+            raise AmiError('AMI login failed: {}'.format(res.get('Message')))
+
+    def is_alive(self):
+        """Check the idle connection was not closed by Asterisk.
+        An idle connection has nothing to read unless it is closed.
+        """
+        try:
+            return not select.select([self.sock], [], [], 0)[0]
+        except (OSError, ValueError):
+            return False
+
+    def close(self):
+        try:
+            self.file.close()
+            self.sock.close()
+        except OSError:
+            pass
+
+    def send(self, action, timeout=5):
+        """Send the action and return its response message.
+        """
+        return self.send_many([action], timeout=timeout)[0]
+
+    def send_many(self, actions, timeout=5):
+        """Send the actions at once and return their responses in order.
+
+        Actions without response because of a write error, a timeout or a
+        closed connection get an error response. Actions are never resent as
+        they could be executed already.
+        """
+        action_ids, data = [], []
+        for action in actions:
+            action_id = action.get('ActionID') or uuid.uuid4().hex
+            action_ids.append(action_id)
+            for key, value in dict(action, ActionID=action_id).items():
+                # Repeated keys like Variable are passed as lists.
+                for val in value if isinstance(value, (list, tuple)) \
+                        else [value]:
+                    data.append('{}: {}\r\n'.format(key, val))
+            data.append('\r\n')
+        responses = {}
+        try:
+            self.sock.settimeout(timeout)
+            self.sock.sendall(''.join(data).encode())
+            while len(responses) < len(action_ids):
+                message = self.read_message()
+                if message.get('ActionID') in action_ids and \
+                        'Response' in message:
+                    responses[message['ActionID']] = message
+        except (OSError, AmiError) as e:
+            self.broken = True
+            return [responses.get(k) or {
+                'Response': 'Error', 'ActionID': k, 'Message': str(e)}
+                for k in action_ids]
+        return [responses[k] for k in action_ids]
+
+    def read_message(self):
+        message = {}
+        while True:
+            line = self.file.readline()
+            if not line:
+                raise AmiError('AMI connection closed.')
+            line = line.decode(errors='replace').rstrip('\r\n')
+            if not line:
+                if message:
+                    return message
+                continue
+            key, _, value = line.partition(':')
+            message[key.strip()] = value.strip()
+
+
+class AmiPool:
+    """Logged in AMI connections to one Asterisk server.
+
+    Used as a fast path for short actions instead of going through Salt API,
+    master and minion to AMI.
+    """
+
+    def __init__(self, host, port, login, password):
+        self.params = (host, port, login, password)
+        self.idle = []
+        self.lock = threading.Lock()
+
+    def send(self, action, timeout=5):
+        """Send the action over a pooled connection.
+
+        Returns:
+            A list with the response as returned by asterisk.manager_action.
+        """
+        return self.send_many([action], timeout=timeout)[0]
+
+    def send_many(self, actions, timeout=5):
+        """Send the actions pipelined over one pooled connection.
+
+        AmiNotSentError is raised when no connection can be made, nothing is
+        written then. Failures after the actions are written are returned as
+        error responses.
+
+        Returns:
+            A list of results, one per action.
+        """
+        conn = self._pop_idle()
+        if not conn:
+            try:
+                conn = AmiConnection(*self.params)
+            except (OSError, AmiError) as e:
+                raise AmiNotSentError(str(e))
+        res = conn.send_many(actions, timeout=timeout)
+        with self.lock:
+            if len(self.idle) < AMI_POOL_SIZE and not conn.broken:
+                self.idle.append(conn)
+                conn = None
+        if conn:
+            conn.close()
+        for k in res:
+            k.setdefault('content', '')
+        return [[k] for k in res]
+
+    def _pop_idle(self):
+        """Get an idle connection not closed by Asterisk."""
+        while True:
+            with self.lock:
+                if not self.idle:
+                    return None
+                conn = self.idle.pop()
+            if conn.is_alive():
+                return conn
+            conn.close()
+
+    def close(self):
+        with self.lock:
+            for conn in self.idle:
+                conn.close()
+            self.idle = []
+
+
+def get_ami_pool(key, host, port, login, password):
+    """Get the pool of the server, key must identify the server settings.
+    """
+    with AMI_POOLS_LOCK:
+        pool = AMI_POOLS.get(key)
+        if not pool:
+            pool = AMI_POOLS[key] = AmiPool(host, port, login, password)
+        return pool
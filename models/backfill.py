@@ -0,0 +1,123 @@
+# ©️ OdooPBX by Odooist, Odoo Proprietary License v1.0, 2020
+import logging
+import time
+from odoo import models, fields, api
+
+logger = logging.getLogger(__name__)
+
+#: First key of the advisory locks held on slices being processed.
+BACKFILL_LOCK = 4152
+
+
+class Backfill(models.Model):
+    """Progress of jobs filling columns in committed chunks.
+
+    A job is split in ID ranges processed in parallel by its crons. A cron
+    holds a session advisory lock on its slice so progress is committed
+    after every chunk and the slice is free again if the process dies.
+    Progress is kept here and not in ir.config_parameter as writing a
+    parameter clears the registry caches of all workers.
+    """
+    _name = 'asterisk_plus.backfill'
+    _description = 'Backfill Job Slice'
+    _order = 'id'
+    _log_access = False
+
+    #: Name of the job.
+    job = fields.Char(required=True, index=True)
+    #: Last ID done.
+    last_id = fields.Integer()
+    #: Last ID of the slice.
+    end_id = fields.Integer()
+
+    @api.model
+    def start(self, job, table, slices=1):
+        """Start the job over the IDs of table split in slices.
+        """
+        self.env.cr.execute('SELECT max(id) FROM "{}"'.format(table))
+        max_id = self.env.cr.fetchone()[0] or 0
+        self.search([('job', '=', job)]).unlink()
+        size = -(-max_id // slices)
+        self.create([{
+            'job': job,
+            'last_id': k * size,
+            'end_id': min((k + 1) * size, max_id),
+        } for k in range(slices) if k * size < max_id])
+
+    @api.model
+    def pending_ranges(self, job):
+        """Returns (last_id, end_id) ranges of IDs not done by the job.
+        """
+        self.env.cr.execute("""
+            SELECT last_id, end_id FROM asterisk_plus_backfill
+            WHERE job = %s AND end_id > last_id ORDER BY last_id
+        """, (job,))
+        return self.env.cr.fetchall()
+
+    @api.model
+    def run(self, job, process, chunk_size, time_limit=None):
+        """Process free slices of the job in committed chunks.
+
+        Args:
+            process: Function of (last_id, end_id, chunk_size) processing
+                the next chunk after last_id. Returns the last ID processed
+                or None if the slice is done.
+            time_limit (int): Stop after this number of seconds.
+
+        Returns:
+            False if stopped by the time limit with the slice not done.
+        """
+        cr = self.env.cr
+        started = time.monotonic()
+        while True:
+            slice_id = self._lock_free_slice(job)
+            if not slice_id:
+                return True
+            try:
+                # Read the progress committed before the lock was taken.
+                cr.commit()
+                while True:
+                    cr.execute("""
+                        SELECT last_id, end_id FROM asterisk_plus_backfill
+                        WHERE id = %s
+                    """, (slice_id,))
+                    row = cr.fetchone()
+                    if not row:
+                        # The job was restarted.
+                        break
+                    last_id = process(row[0], row[1], chunk_size)
+                    if last_id is None:
+                        cr.execute(
+                            'DELETE FROM asterisk_plus_backfill WHERE id = %s',
+                            (slice_id,))
+                        cr.commit()
+                        logger.info('%s: IDs up to %s done.', job, row[1])
+                        break
+                    cr.execute("""
+                        UPDATE asterisk_plus_backfill SET last_id = %s
+                        WHERE id = %s
+                    """, (last_id, slice_id))
+                    cr.commit()
+                    logger.info('%s: IDs up to %s of %s done.',
+                                job, last_id, row[1])
+                    if time_limit and time.monotonic() - started > time_limit:
+                        return False
+            except Exception:
+                cr.rollback()
+                raise
+            finally:
+                cr.execute('SELECT pg_advisory_unlock(%s, %s)',
+                           (BACKFILL_LOCK, slice_id))
+
+    @api.model
+    def _lock_free_slice(self, job):
+        """Returns the ID of a slice of the job locked for this session.
+        """
+        self.env.cr.execute(
+            'SELECT id FROM asterisk_plus_backfill WHERE job = %s ORDER BY id',
+            (job,))
+        for slice_id, in self.env.cr.fetchall():
+            self.env.cr.execute('SELECT pg_try_advisory_lock(%s, %s)',
+                                (BACKFILL_LOCK, slice_id))
+            if self.env.cr.fetchone()[0]:
+                return slice_id
@@ -13,11 +13,13 @@ logger = logging.getLogger(__name__)
 
 class Call(models.Model):
     _name = 'asterisk_plus.call'
-    _inherit = ['mail.thread', 'mail.activity.mixin']
+    _inherit = ['mail.thread', 'mail.activity.mixin', 'asterisk_plus.live_view']
     _description = 'Call Detail Record'
     _order = 'id desc'
     _log_access = False
     _rec_name = 'id'
+    _live_view_param = 'auto_reload_calls'
+    _live_view_computed = ('live_state',)
 
     uniqueid = fields.Char(size=64, index=True)
     server = fields.Many2one('asterisk_plus.server', ondelete='cascade')
@@ -38,6 +40,10 @@ class Call(models.Model):
     # Boolean index for split all calls on this flag. Calls are by default in active state.
     is_active = fields.Boolean(index=True, default=True)
     channels = fields.One2many('asterisk_plus.channel', inverse_name='call', readonly=True)
+    #: Channels of the active call with their current state.
+    live_channels = fields.One2many('asterisk_plus.live_channel',
+                                    inverse_name='call', readonly=True)
+    live_state = fields.Char(compute='_get_live_state', string=_('State'))
     recordings = fields.One2many('asterisk_plus.recording', inverse_name='call', readonly=True)
     recording_icon = fields.Char(compute='_get_recording_icon', string='R')
     partner = fields.Many2one('res.partner', ondelete='set null')
@@ -68,12 +74,17 @@ class Call(models.Model):
         string=_('Call Duration'),
         compute='_get_duration_human')
 
+    def init(self):
+        # Channel handlers look up active calls only.
+        self.env.cr.execute("""
+            CREATE INDEX IF NOT EXISTS asterisk_plus_call_active_idx
+            ON asterisk_plus_call (uniqueid) WHERE is_active
+        """)
+
     @api.model
     def create(self, vals):
-        # Reload after call is created
         call = super(Call, self.with_context(
             mail_create_nosubscribe=True, mail_create_nolog=True)).create(vals)
-        self.reload_calls()
         return call
 
     def _get_recording_icon(self):
@@ -88,14 +99,6 @@ class Call(models.Model):
         """
         self.ensure_one()
 
-    @api.constrains('is_active')
-    def reload_on_hangup(self):
-        """Reloads active calls list view after hangup.
-        """
-        for rec in self:
-            if not rec.is_active:
-                self.reload_calls()
-
     def notify_called_user(self, asterisk_user):
         """Notify user about incomming call.
         """
@@ -213,21 +216,8 @@ class Call(models.Model):
             'asterisk_plus.settings'].get_param('auto_reload_calls')
         if not auto_reload:
             return
-        if data is None:
-            data = {}
-        if tools.odoo.release.version_info[0] < 15:
-            msg = {
-                'action': 'reload_view',
-                'model': 'asterisk_plus.call'
-            }
-            self.env['bus.bus'].sendone('asterisk_plus_actions', json.dumps(msg))
-        else:
-            msg = {'model': 'asterisk_plus.call'}
-            self.env['bus.bus']._sendone(
-                'asterisk_plus_actions',
-                'reload_view',
-                json.dumps(msg)
-            )
+        self.env['asterisk_plus.server'].reload_view(
+            model='asterisk_plus.call')
 
     def move_to_history(self):
         self.is_active = False
@@ -261,6 +251,12 @@ class Call(models.Model):
             if rec.answered and rec.ended:
                 rec.duration = (rec.ended - rec.answered).total_seconds()
 
+    @api.depends('live_channels.state_desc')
+    def _get_live_state(self):
+        for rec in self:
+            rec.live_state = ', '.join(
+                k.state_desc for k in rec.live_channels if k.state_desc)
+
     def _get_duration_human(self):
         for rec in self:
             rec.duration_human = str(timedelta(seconds=rec.duration))
@@ -0,0 +1,313 @@
+# ©️ OdooPBX by Odooist, Odoo Proprietary License v1.0, 2020
+import http.server
+import logging
+import select
+import threading
+import time
+import urllib.parse
+import phonenumbers
+from phonenumbers import phonenumberutil
+from odoo.sql_db import db_connect
+from odoo.tools import config, str2bool
+from .ip_access import compile_ip_networks, ip_permitted
+from .phone_directory import CALLERID_CHANNEL, match_rank, phone_digits, \
+    phone_suffix, strip_number
+
+logger = logging.getLogger(__name__)
+
+#: Seconds between reloads of the permitted IP addresses and the daemon
+#: settings.
+CALLERID_DAEMON_POLL = 60
+#: Odoo config option of the process running the daemons.
+CALLERID_DAEMON_OPTION = 'asterisk_plus_callerid_daemon'
+
+CALLERID_DAEMONS = {}
+#: dbname: (host, port) the daemon was started with, None if disabled.
+CALLERID_DAEMONS_CONFIG = {}
+CALLERID_DAEMONS_LOCK = threading.Lock()
+
+
+class CallerIdMap:
+    """Partner numbers and names kept in memory."""
+
+    def __init__(self):
+        #: phone_suffix: {(digits, partner_id)}
+        self.suffixes = {}
+        #: partner_id: {digits}
+        self.numbers = {}
+        #: partner_id: parent_id
+        self.parents = {}
+        #: partner_id: display_name
+        self.names = {}
+
+    def remove(self, partner_ids):
+        for partner_id in partner_ids:
+            for digits in self.numbers.pop(partner_id, ()):
+                self.suffixes.get(phone_suffix(digits), set()).discard(
+                    (digits, partner_id))
+            self.parents.pop(partner_id, None)
+            self.names.pop(partner_id, None)
+
+    def add(self, rows, names):
+        """Add rows of (digits, partner_id, parent_id) and partner names.
+        """
+        for digits, partner_id, parent_id in rows:
+            self.numbers.setdefault(partner_id, set()).add(digits)
+            self.suffixes.setdefault(phone_suffix(digits), set()).add(
+                (digits, partner_id))
+            self.parents[partner_id] = parent_id
+        self.names.update(names)
+
+    def match(self, forms):
+        """Same as asterisk_plus.phone_directory match on partner ids.
+        """
+        shortest = min(forms, key=len)
+        longest = max(forms, key=len)
+        found, best = set(), None
+        for digits, partner_id in self.suffixes.get(phone_suffix(longest), ()):
+            if not (digits.endswith(shortest) or longest.endswith(digits)):
+                continue
+            rank = match_rank(digits, forms)
+            if best is None or rank < best:
+                found, best = set(), rank
+            if rank == best:
+                found.add(partner_id)
+        return found
+
+    def select(self, found):
+        """Same as res.partner _select_partner on partner ids.
+        """
+        found = sorted(found)
+        parents = {self.parents.get(k) for k in found} - {None}
+        if len(found) == 1 or not parents:
+            return found[0]
+        elif len(parents) > 1:
+            return
+        parent = parents.pop()
+        children = [k for k in found if self.parents.get(k) == parent]
+        if len(found) == 2 and len(children) == 1:
+            return children[0]
+        elif len(children) > 1:
+            return parent
+
+
+class CallerIdDaemon:
+    """Answer get_caller_name requests from memory.
+
+    Partner numbers of the phone directory are loaded at start and kept up
+    to date by CALLERID_CHANNEL notifications. Requests use neither the
+    database nor Odoo workers.
+    """
+
+    def __init__(self, dbname, host, port):
+        self.dbname = dbname
+        self.map = CallerIdMap()
+        self.lock = threading.Lock()
+        #: Compiled permit_ip_addresses.
+        self.networks = None
+        self.running = False
+        self.httpd = http.server.ThreadingHTTPServer(
+            (host, port), CallerIdHandler)
+        self.httpd.callerid = self
+
+    def start(self):
+        self.running = True
+        threading.Thread(target=self.listen, daemon=True,
+                         name='asterisk_plus callerid listen').start()
+        threading.Thread(target=self.httpd.serve_forever, daemon=True,
+                         name='asterisk_plus callerid http').start()
+        logger.info('Caller ID daemon for %s listening on %s:%s.',
+                    self.dbname, *self.httpd.server_address[:2])
+
+    def stop(self):
+        self.running = False
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def listen(self):
+        while self.running:
+            try:
+                with db_connect(self.dbname).cursor() as cr:
+                    # Listen before loading not to miss changes.
+                    cr.execute('LISTEN {}'.format(CALLERID_CHANNEL))
+                    cr.commit()
+                    self.load(cr)
+                    conn = cr._cnx
+                    while self.running:
+                        if not select.select(
+                                [conn], [], [], CALLERID_DAEMON_POLL)[0]:
+                            self.load_settings(cr)
+                            continue
+                        conn.poll()
+                        payloads = set()
+                        while conn.notifies:
+                            payloads.add(conn.notifies.pop().payload)
+                        if '*' in payloads:
+                            self.load(cr)
+                        else:
+                            self.load(cr, {int(k) for payload in payloads
+                                           for k in payload.split(',')})
+            except Exception:
+                logger.exception('Caller ID daemon error:')
+                time.sleep(CALLERID_DAEMON_POLL / 10)
+
+    def load_settings(self, cr):
+        cr.execute('SELECT permit_ip_addresses FROM asterisk_plus_settings '
+                   'ORDER BY id LIMIT 1')
+        row = cr.fetchone()
+        self.networks = compile_ip_networks(row and row[0])
+        # Do not keep the transaction open.
+        cr.rollback()
+
+    def load(self, cr, partner_ids=None):
+        """Load numbers of the partners, all numbers if partner_ids is None.
+        """
+        query = """
+            SELECT d.number_reversed, p.id, p.parent_id, p.display_name,
+                pp.display_name
+            FROM asterisk_plus_phone_directory d
+            JOIN res_partner p ON p.id = d.partner_id
+            LEFT JOIN res_partner pp ON pp.id = p.parent_id
+        """
+        if partner_ids is None:
+            cr.execute(query)
+        else:
+            cr.execute(query + ' WHERE p.id = ANY(%s)', (list(partner_ids),))
+        rows, names = [], {}
+        for number_reversed, partner_id, parent_id, name, parent_name in \
+                cr.fetchall():
+            rows.append((number_reversed[::-1], partner_id, parent_id))
+            names[partner_id] = name
+            if parent_id:
+                names[parent_id] = parent_name
+        if partner_ids is None:
+            callerid_map = CallerIdMap()
+            callerid_map.add(rows, names)
+            self.map = callerid_map
+            logger.info('Caller ID daemon for %s: %s numbers loaded.',
+                        self.dbname, len(rows))
+        else:
+            # Companies without numbers are selected by their name.
+            cr.execute('SELECT id, display_name FROM res_partner '
+                       'WHERE id = ANY(%s)', (list(partner_ids),))
+            names.update(cr.fetchall())
+            with self.lock:
+                self.map.remove(partner_ids)
+                self.map.add(rows, names)
+        self.load_settings(cr)
+
+    def lookup(self, number, country=None):
+        """Returns the partner name or None if it's not found.
+        """
+        number = strip_number(number)
+        if not number or 'unknown' in number or number == 's' or \
+                len(number) < 7:
+            return
+        forms = {phone_digits(number)}
+        if country:
+            try:
+                parsed = phonenumbers.parse(number, country)
+                if phonenumbers.is_possible_number(parsed):
+                    forms.add(phone_digits(phonenumbers.format_number(
+                        parsed, phonenumbers.PhoneNumberFormat.E164)))
+            except phonenumberutil.NumberParseException:
+                pass
+        forms.discard('')
+        if not forms:
+            return
+        with self.lock:
+            found = self.map.match(forms)
+            partner_id = self.map.select(found) if found else None
+            return self.map.names.get(partner_id)
+
+
+class CallerIdHandler(http.server.BaseHTTPRequestHandler):
+    """/asterisk_plus/get_caller_name compatible handler."""
+
+    def do_GET(self):
+        daemon = self.server.callerid
+        url = urllib.parse.urlsplit(self.path)
+        params = dict(urllib.parse.parse_qsl(url.query))
+        if url.path != '/asterisk_plus/get_caller_name':
+            return self.send_error(404)
+        if not ip_permitted(daemon.networks, self.client_address[0]):
+            return self.send_error(400, 'Your IP address {} is not '
+                                   'allowed!'.format(self.client_address[0]))
+        number = params.get('number', '').replace(' ', '')
+        if not number:
+            return self.send_error(400, 'Number not specified in request')
+        body = (daemon.lookup(number, params.get('country')) or '').encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug('Caller ID daemon: ' + format, *args)
+
+
+def callerid_daemon_process():
+    """True if this process runs the daemons. Set
+    asterisk_plus_callerid_daemon = True in the Odoo config of one process
+    only, e.g. a separate instance with --workers=0 and no crons.
+    """
+    return str2bool(str(config.get(CALLERID_DAEMON_OPTION, False)), False)
+
+
+def watch_callerid_daemon(dbname):
+    """Run the daemon of the database if this is the designated process.
+
+    A thread applies changes of the daemon settings. If the port is held by
+    another process it is not tried again until the settings change.
+    """
+    if not callerid_daemon_process():
+        return
+    with CALLERID_DAEMONS_LOCK:
+        if dbname in CALLERID_DAEMONS_CONFIG:
+            return
+        CALLERID_DAEMONS_CONFIG[dbname] = None
+    threading.Thread(target=_watch_callerid_daemon, daemon=True,
+                     args=(dbname,),
+                     name='asterisk_plus callerid watch').start()
+
+
+def _watch_callerid_daemon(dbname):
+    while True:
+        try:
+            with db_connect(dbname).cursor() as cr:
+                cr.execute("""
+                    SELECT callerid_daemon_host, callerid_daemon_port
+                    FROM asterisk_plus_settings ORDER BY id LIMIT 1
+                """)
+                row = cr.fetchone()
+        except Exception as e:
+            # The database or the module is gone.
+            logger.warning('Caller ID daemon for %s not watched: %s',
+                           dbname, e)
+            with CALLERID_DAEMONS_LOCK:
+                CALLERID_DAEMONS_CONFIG.pop(dbname, None)
+            return
+        daemon_config = tuple(row) if row and row[1] else None
+        if daemon_config != CALLERID_DAEMONS_CONFIG.get(dbname):
+            CALLERID_DAEMONS_CONFIG[dbname] = daemon_config
+            _start_callerid_daemon(dbname, daemon_config)
+        time.sleep(CALLERID_DAEMON_POLL)
+
+
+def _start_callerid_daemon(dbname, daemon_config):
+    """(Re)start the daemon of the database, None stops it."""
+    with CALLERID_DAEMONS_LOCK:
+        daemon = CALLERID_DAEMONS.pop(dbname, None)
+        if daemon:
+            daemon.stop()
+        if not daemon_config:
+            return
+        try:
+            daemon = CallerIdDaemon(dbname, *daemon_config)
+        except OSError as e:
+            logger.warning('Caller ID daemon for %s not started: %s',
+                           dbname, e)
+            return
+        daemon.start()
+        CALLERID_DAEMONS[dbname] = daemon
@@ -4,17 +4,28 @@ import json
 import logging
 from odoo import models, fields, api, tools, _
 from odoo.exceptions import ValidationError
+from odoo.osv import expression
 from .server import debug
 
 
 logger = logging.getLogger(__name__)
 
+#: AMI events accepted by process_events() and the methods handling them.
+AMI_EVENT_HANDLERS = {
+    'Newchannel': 'on_ami_new_channel',
+    'Newstate': 'on_ami_update_channel_state',
+    'Hangup': 'on_ami_hangup',
+    'VarSet': 'update_recording_filename',
+}
 
 class Channel(models.Model):
     _name = 'asterisk_plus.channel'
+    _inherit = 'asterisk_plus.live_view'
     _rec_name = 'uniqueid'
     _order = 'id desc'
     _description = 'Channel'
+    _live_view_param = 'auto_reload_channels'
+    _live_view_computed = ('live_state', 'live_state_desc')
 
     #: Call of the channel
     call = fields.Many2one('asterisk_plus.call', ondelete='cascade')
@@ -48,6 +59,11 @@ class Channel(models.Model):
     state = fields.Char(size=80, string='State code')
     #: Channel's current state description.
     state_desc = fields.Char(size=256, string=_('State'))
+    #: Live state of the active channel, Newstate events only update it.
+    live_channels = fields.One2many('asterisk_plus.live_channel',
+                                    inverse_name='channel_id', readonly=True)
+    live_state = fields.Char(compute='_get_live_state', string='State code')
+    live_state_desc = fields.Char(compute='_get_live_state', string=_('State'))
     #: Channel extension.
     exten = fields.Char(size=32)
     #: Caller ID number.
@@ -86,14 +102,25 @@ class Channel(models.Model):
             else:
                 rec.channel_short = False
 
+    @api.depends('state', 'state_desc', 'live_channels.state',
+                 'live_channels.state_desc')
+    def _get_live_state(self):
+        for rec in self:
+            live = rec.live_channels[:1]
+            rec.live_state = live.state or rec.state
+            rec.live_state_desc = live.state_desc or rec.state_desc
+
     def _get_parent_channel(self):
+        # Asterisk bound channels, parents of all records in one search.
+        linkedids = {rec.linkedid for rec in self
+                     if rec.linkedid and rec.uniqueid != rec.linkedid}
+        parents = {}
+        if linkedids:
+            for parent in self.search([('uniqueid', 'in', list(linkedids))]):
+                parents.setdefault(parent.uniqueid, parent)
         for rec in self:
-            if rec.uniqueid != rec.linkedid:
-                # Asterisk bound channels
-                rec.parent_channel = self.search(
-                    [('uniqueid', '=', rec.linkedid)], limit=1)
-            else:
-                rec.parent_channel = False
+            rec.parent_channel = parents.get(rec.linkedid) \
+                if rec.uniqueid != rec.linkedid else False
 
     def _get_linked_channels(self):
         for rec in self:
@@ -103,6 +130,51 @@ class Channel(models.Model):
             rec.linked_channels = self.search(
                 [('linkedid', '=', rec.uniqueid), ('id', '!=', rec.id)])
 
+    def init(self):
+        # Handlers look up active channels only, keep them in a small index.
+        self.env.cr.execute("""
+            CREATE INDEX IF NOT EXISTS asterisk_plus_channel_active_idx
+            ON asterisk_plus_channel (uniqueid) WHERE is_active
+        """)
+
+    def write(self, vals):
+        res = super(Channel, self).write(vals)
+        if 'is_active' in vals and not vals['is_active']:
+            # Uniqueids are unique per server only.
+            domain = [('channel_id', 'in', self.ids)]
+            for server in self.mapped('server'):
+                domain = expression.OR([domain, [
+                    ('server', '=', server.id),
+                    ('uniqueid', 'in', self.filtered(
+                        lambda r: r.server == server).mapped('uniqueid'))]])
+            self.env['asterisk_plus.live_channel'].search(domain).unlink()
+        return res
+
+    @api.model
+    def _get_active_channel(self, uniqueid):
+        """Get active channel(s) by uniqueid from the partial index of
+        active channels.
+        """
+        self.flush(['uniqueid', 'is_active'])
+        self.env.cr.execute("""
+            SELECT id FROM asterisk_plus_channel
+            WHERE uniqueid = %s AND is_active ORDER BY id DESC
+        """, (uniqueid,))
+        return self.browse([k[0] for k in self.env.cr.fetchall()])
+
+    @api.model
+    def _get_active_call(self, uniqueid):
+        """Get the active call with uniqueid from the partial index of
+        active calls.
+        """
+        calls = self.env['asterisk_plus.call']
+        calls.flush(['uniqueid', 'is_active'])
+        self.env.cr.execute("""
+            SELECT id FROM asterisk_plus_call
+            WHERE uniqueid = %s AND is_active ORDER BY id DESC LIMIT 1
+        """, (uniqueid,))
+        return calls.browse([k[0] for k in self.env.cr.fetchall()])
+
     def set_inactive(self):
         for rec in self:
             rec.is_active = False
@@ -115,22 +187,8 @@ class Channel(models.Model):
             'asterisk_plus.settings'].get_param('auto_reload_channels')
         if not auto_reload:
             return
-        if data is None:
-            data = {}
-        if tools.odoo.release.version_info[0] < 15:
-            msg = {
-                'action': 'reload_view',
-                'model': 'asterisk_plus.channel'
-            }
-            self.env['bus.bus'].sendone('asterisk_plus_actions', json.dumps(msg))
-        else:
-            msg = {
-                'model': 'asterisk_plus.channel'
-            }
-            self.env['bus.bus']._sendone(
-                'asterisk_plus_actions',
-                'reload_view',
-                json.dumps(msg))
+        self.env['asterisk_plus.server'].reload_view(
+            model='asterisk_plus.channel')
 
     def update_call_data(channel, country=None):
         """Updates call data to set: calling/called user,
@@ -185,9 +243,9 @@ class Channel(models.Model):
                         'name': channel.callerid_num,
                         'phone': channel.callerid_num,
                     }).id
-                    debug(channel, 'Call {} auto create partner id {}'.format(
+                    debug(channel, 'Call {} auto create partner id {}',
                         channel.call.id, call_data['partner']
-                    ))
+                    )
             if not channel.call.calling_name and channel.callerid_name:
                 call_data['calling_name'] = channel.callerid_name
         # Secondary channel not belonging to a user
@@ -195,9 +253,9 @@ class Channel(models.Model):
             if not channel.call.direction:
                 call_data['direction'] = 'out'
         # Update call call_data
-        debug(channel,'Call {} update: {}'.format(
+        debug(channel, 'Call {} update: {}',
             channel.call.id, call_data
-        ))
+        )
         channel.call.write(call_data)
         try:
             if channel.call and not channel.call.ref:
@@ -210,7 +268,7 @@ class Channel(models.Model):
     def on_ami_new_channel(self, event):
         """AMI NewChannel event is processed to create a new channel in Odoo.
         """
-        debug(self, json.dumps(event, indent=2))
+        debug(self, event)
         data = {
             'event': event['Event'],
             'server': self.env.user.asterisk_server.id,
@@ -232,9 +290,7 @@ class Channel(models.Model):
             'is_active': True,
         }
         # Search for an active channel with this Uniqueid
-        channel = self.env['asterisk_plus.channel'].search([
-            ('is_active', '=', True),
-            ('uniqueid', '=', event['Uniqueid'])])
+        channel = self._get_active_channel(event['Uniqueid'])
         # Match the channel to a user
         if not channel.user:
             asterisk_user = self.env[
@@ -254,16 +310,15 @@ class Channel(models.Model):
         country = (user.partner_id.country_id.code or
             self.env.user.partner_id.country_id.code or None
         )
-        debug(self, '{} id {} user {} country {}'.format(
+        debug(self, '{} id {} user {} country {}',
             event['Channel'], channel.mapped('id'), user.id, country
-        ))
+        )
         # Assign a call to the channel
         if not channel and not channel.no_call:
             # Create a new call for the primary channel.
             if event['Uniqueid'] == event['Linkedid']:
                 # Check if call already exists
-                call = self.env['asterisk_plus.call'].search(
-                    [('uniqueid', '=', event['Uniqueid'])], limit=1)
+                call = self._get_active_call(event['Uniqueid'])
                 if not call:
                     call = self.env['asterisk_plus.call'].create({
                         'uniqueid': event['Uniqueid'],
@@ -274,33 +329,33 @@ class Channel(models.Model):
                         'status': 'progress',
                         'server': self.env.user.asterisk_server.id,
                     })
-                    debug(self, '{} spawn a new call: {}'.format(
+                    debug(self, '{} spawn a new call: {}',
                         event['Channel'], call.id
-                    ))
+                    )
             # Assign a call to the secondary channel(s)
             else:
-                call = self.env['asterisk_plus.call'].search(
-                    [('uniqueid', '=', event['Linkedid'])], limit=1)
-                debug(self, '{} belongs to call: {}'.format(
+                call = self._get_active_call(event['Linkedid'])
+                debug(self, '{} belongs to call: {}',
                     event['Channel'], call.id
-                ))
+                )
             data['call'] = call.id
         # Create or update channel object
         if not channel:
             channel = self.create(data)
-            debug(self, '{} create id: {}'.format(
+            debug(self, '{} create id: {}',
                 event['Channel'], channel.id
-            ))
+            )
         else:
-            debug(self, '{} update: {}'.format(
+            debug(self, '{} update: {}',
                 event['Channel'], data
-            ))
+            )
             channel.write(data)
+        self.env['asterisk_plus.live_channel'].update_from_event(
+            channel[:1], event)
         # Update call based on channel.
         channel.update_call_data(country=country)
         if asterisk_user and channel.call.direction == 'in':
             channel.call.notify_called_user(asterisk_user)
-        self.reload_channels()
         if self.env['asterisk_plus.settings'].sudo().get_param('trace_ami'):
             self.env['asterisk_plus.channel_message'].create_from_event(
                 channel, event
@@ -313,7 +368,7 @@ class Channel(models.Model):
             create channel message and call event log records.
             Processed when channel's state changes.
         """
-        debug(self, json.dumps(event, indent=2))
+        debug(self, event)
         get = event.get
         data = {
             'server': self.env.user.asterisk_server.id,
@@ -336,13 +391,12 @@ class Channel(models.Model):
             'event': get('Event'),
             'is_active': True,
         }
-        channel = self.env['asterisk_plus.channel'].search([
-            ('is_active', '=', True),
-            ('uniqueid', '=', get('Uniqueid'))], limit=1)
+        channel = self._get_active_channel(get('Uniqueid'))[:1]
         if not channel:
             channel = self.create(data)
-        else:
-            channel.write(data)
+        # State changes are kept in the live channel until hangup.
+        self.env['asterisk_plus.live_channel'].update_from_event(
+            channel, event)
         if self.env['asterisk_plus.settings'].sudo().get_param('trace_ami'):
             data['channel_id'] = channel.id
             self.env['asterisk_plus.channel_message'].create_from_event(channel, event)
@@ -359,7 +413,7 @@ class Channel(models.Model):
         })
         # Update call when secondary channel gets new state Up
         if (channel.call.uniqueid != channel.uniqueid and
-                channel.state_desc == 'Up'):
+                get('ChannelStateDesc') == 'Up'):
             call_data = {
                     'status': 'answered',
                     'answered': datetime.now()}
@@ -368,7 +422,7 @@ class Channel(models.Model):
                     event['Channel'], event['SystemName']).user
             if user:
                 call_data['answered_user'] = user.id
-            debug(self,'Call {} update: {}'.format(channel.call.id, call_data))
+            debug(self, 'Call {} update: {}', channel.call.id, call_data)
             channel.call.write(call_data)
         return (channel.id, '{} Newstate ACK'.format(event['Channel']))
 
@@ -377,16 +431,14 @@ class Channel(models.Model):
         """AMI Hangup event.
         Returns tuple (channel.id, message)
         """
-        debug(self, json.dumps(event, indent=2))            
-        # TODO: Limit search domain by create_date less then one day.
-        channel = self.env['asterisk_plus.channel'].search([
-            ('is_active', '=', True),
-            ('uniqueid', '=', event['Uniqueid'])])
+        debug(self, event)            
+        channel = self._get_active_channel(event['Uniqueid'])
         if not channel:
-            debug(self, 'Channel {} not found for hangup.'.format(event['Channel']))
+            debug(self, 'Channel {} not found for hangup.', event['Channel'],
+                  level='warning')
             logger.warning('Channel {} not found for hangup.'.format(event['Channel']))
             return (None, '{} Hangup: not found'.format(event['Channel']))
-        debug(self, 'Found {} channel(s) {}'.format(len(channel), event['Channel']))
+        debug(self, 'Found {} channel(s) {}', len(channel), event['Channel'])
         data = {
             'event': event['Event'],
             'channel': event['Channel'],
@@ -422,8 +474,8 @@ class Channel(models.Model):
                     call_data['status'] = 'noanswer'
                 else:
                     call_data['status'] = 'failed'
-            debug(self, 'Call {} update: {}'.format(
-                channel.call.id, call_data))
+            debug(self, 'Call {} update: {}',
+                channel.call.id, call_data)
             channel.call.write(call_data)
         # Create hangup event
         if channel.call:
@@ -432,7 +484,6 @@ class Channel(models.Model):
                 'create_date': datetime.now(),
                 'event': 'Channel {} hangup'.format(channel.channel_short),
             })
-        self.reload_channels()
         if self.env['asterisk_plus.settings'].sudo().get_param('trace_ami'):
             # Remove and add fields according to the message
             data['channel_id'] = channel.id
@@ -442,6 +493,50 @@ class Channel(models.Model):
             self.env['asterisk_plus.recording'].save_call_recording(channel)
         return (channel.id, '{} Hangup ACK'.format(event['Channel']))
 
+    @api.model
+    def process_events(self, events):
+        """Process a batch of AMI events in one transaction.
+
+        Events are dispatched to their handlers in the order received. Every
+        event is processed in its own savepoint so that a failure does not
+        roll back the whole batch. When an event fails all the following
+        events with the same Linkedid are skipped as they depend on it.
+        Live views get one update for the whole batch after commit.
+
+        Args:
+            events (list): AMI events as sent by the Agent.
+
+        Returns:
+            A list of ACKs in the order of events. Every ACK is a tuple
+            (success, result) where result is the handler's return value
+            or the error message.
+        """
+        debug(self, 'Processing {} events', len(events))
+        failed_linkedids = set()
+        acks = []
+        for event in events:
+            name = event.get('Event')
+            linkedid = event.get('Linkedid') or event.get('Uniqueid')
+            method = AMI_EVENT_HANDLERS.get(name)
+            if not method:
+                acks.append((False, '{} event not supported'.format(name)))
+                continue
+            if linkedid and linkedid in failed_linkedids:
+                acks.append((False, '{} {} skipped after a failed event'.format(
+                    event.get('Channel'), name)))
+                continue
+            try:
+                with self.env.cr.savepoint():
+                    res = getattr(self, method)(event)
+                acks.append((True, res))
+            except Exception as e:
+                logger.exception('Event %s processing error:', name)
+                if linkedid:
+                    failed_linkedids.add(linkedid)
+                acks.append((False, '{} {} error: {}'.format(
+                    event.get('Channel'), name, e)))
+        return acks
+
     @api.model
     def on_ami_originate_response_failure(self, event):
         """AMI OriginateResponse event.
@@ -451,11 +546,10 @@ class Channel(models.Model):
         if event['Response'] != 'Failure':
             logger.error(self, 'Response', 'UNEXPECTED ORIGINATE RESPONSE FROM ASTERISK!')
             return False
-        channel = self.env['asterisk_plus.channel'].search(
-            [('is_active', '=', True),
-            ('uniqueid', '=', event['Uniqueid'])])
+        channel = self._get_active_channel(event['Uniqueid'])
         if not channel:
-            debug(self, 'CHANNEL NOT FOUND FOR ORIGINATE RESPONSE!')
+            debug(self, 'CHANNEL NOT FOUND FOR ORIGINATE RESPONSE!',
+                  level='warning')
             return False
         if self.env['asterisk_plus.settings'].sudo().get_param('trace_ami'):
             event['channel_id'] = channel.id
@@ -481,11 +575,12 @@ class Channel(models.Model):
     def update_recording_filename(self, event):
         """AMI VarSet event.
         """
-        debug(self, json.dumps(event, indent=2))
+        debug(self, event)
         if event.get('Variable') == 'MIXMONITOR_FILENAME':
             file_path = event['Value']
             uniqueid = event['Uniqueid']
-            channel = self.search([('uniqueid', '=', uniqueid)], limit=1)
+            channel = self._get_active_channel(uniqueid)[:1] or self.search(
+                [('uniqueid', '=', uniqueid)], limit=1)
             channel.recording_file_path = file_path
             return True
         return False
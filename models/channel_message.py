@@ -1,12 +1,29 @@
 from datetime import datetime, timedelta
 import json
 import logging
+import zlib
+from psycopg2 import Binary
+from psycopg2.extras import execute_values
 from odoo import models, fields, api, _
 from odoo.exceptions import ValidationError
 from .server import debug
 
 logger = logging.getLogger(__name__)
 
+#: Message fields and AMI event keys they are taken from.
+CHANNEL_MESSAGE_KEYS = [
+    ('event', 'Event'),
+    ('privilege', 'Privilege'),
+    ('channel', 'Channel'),
+    ('uniqueid', 'Uniqueid'),
+    ('linkedid', 'Linkedid'),
+    ('context', 'Context'),
+    ('exten', 'Exten'),
+    ('callerid_num', 'CallerIDNum'),
+    ('callerid_name', 'CallerIDName'),
+    ('system_name', 'SystemName'),
+]
+
 
 class ChannelMessage(models.Model):
     _name = 'asterisk_plus.channel_message'
@@ -26,32 +43,77 @@ class ChannelMessage(models.Model):
     callerid_num = fields.Char(size=32, string='CallerID number')
     callerid_name = fields.Char(size=32, string='CallerID name')
     system_name = fields.Char(size=128)
-    message = fields.Text()
+    #: zlib compressed JSON of the AMI message.
+    payload = fields.Binary(attachment=False, readonly=True)
+    message = fields.Text(compute='_get_message')
+
+    def _get_message(self):
+        for rec in self:
+            if rec.payload:
+                rec.message = json.dumps(
+                    json.loads(zlib.decompress(rec.payload)), indent=2)
+            else:
+                rec.message = False
 
     @api.model
     def create_from_event(self, channel, event):
-        data = {
-            'channel_id': channel.id,
-            'event': event.get('Event'),
-            'channel': event.get('Channel'),
-            'callerid_num': event.get('CallerIDNum'),
-            'callerid_name': event.get('CallerIDName'),
-            'context': event.get('Context'),
-            'exten': event.get('Exten'),
-            'uniqueid': event.get('Uniqueid'),
-            # All AMI events have linkedid? Better try to get...
-            'uniqueid': event.get('Uniqueid'),
-            'message': json.dumps(event, indent=2),
-
-        }
-        self.create(data)
+        """Queue the event to be saved on transaction commit.
+
+        Events are kept in the cursor's precommit data and saved by one
+        bulk insert instead of creating a record per event.
+        """
+        queue = self.env.cr.precommit.data.setdefault(
+            'asterisk_plus.channel_message', [])
+        if not queue:
+            self.env.cr.precommit.add(self._flush_events)
+        queue.append((channel.id, event))
+
+    def _flush_events(self):
+        queue = self.env.cr.precommit.data.pop(
+            'asterisk_plus.channel_message', [])
+        if not queue:
+            return
+        now = datetime.utcnow()
+        values = [(channel_id or None,) + tuple(
+            self._truncate(name, event.get(key))
+            for name, key in CHANNEL_MESSAGE_KEYS) + (
+            Binary(zlib.compress(json.dumps(
+                event, separators=(',', ':'), default=str).encode())),
+            self.env.uid, now,
+        ) for channel_id, event in queue]
+        # Channels rolled back after the event was queued are not referenced.
+        execute_values(self.env.cr, """
+            INSERT INTO asterisk_plus_channel_message
+                (channel_id, event, privilege, channel, uniqueid, linkedid,
+                 context, exten, callerid_num, callerid_name, system_name,
+                 payload, create_uid, create_date, write_uid, write_date)
+            SELECT c.id, v.event, v.privilege, v.channel, v.uniqueid,
+                   v.linkedid, v.context, v.exten, v.callerid_num,
+                   v.callerid_name, v.system_name, v.payload,
+                   v.uid, v.now, v.uid, v.now
+            FROM (VALUES %s) AS v (channel_id, event, privilege, channel,
+                uniqueid, linkedid, context, exten, callerid_num,
+                callerid_name, system_name, payload, uid, now)
+            LEFT JOIN asterisk_plus_channel c ON c.id = v.channel_id
+        """, values, template='(%s::integer, %s, %s, %s, %s, %s, %s, %s, '
+                              '%s, %s, %s, %s::bytea, %s::integer, '
+                              '%s::timestamp)')
+        debug(self, 'Saved {} channel messages', len(values))
+
+    @api.model
+    def _truncate(self, name, value):
+        """Cut the value to the field size as the ORM does."""
+        size = self._fields[name].size
+        if size and isinstance(value, str):
+            return value[:size]
+        return value
 
     @api.model
     def vacuum(self, hours):
         """Cron job to delete channel messages.
         """
         expire_date = datetime.utcnow() - timedelta(hours=hours)
-        channel_msgs = self.env['asterisk_plus.channel_message'].search([
-            ('create_date', '<=', expire_date.strftime('%Y-%m-%d %H:%M:%S'))
-        ])
-        channel_msgs.unlink()
+        self.env.cr.execute(
+            'DELETE FROM asterisk_plus_channel_message WHERE create_date <= %s',
+            (expire_date.strftime('%Y-%m-%d %H:%M:%S'),))
+        self.invalidate_cache()
@@ -117,15 +117,24 @@ class AsteriskConf(models.Model):
         """
         self.ensure_one()
         self.server.local_job(
-            fun='asterisk.put_config',
-            arg=[self.name, "'{}'".format(base64.b64encode(self.content.encode()).decode())],
-            res_model='asterisk_plus.conf',
-            res_method='upload_conf_response',
-            pass_back={
+            merge_key='asterisk.put_config {}'.format(self.name),
+            **self._get_upload_call())
+
+    def _get_upload_call(self):
+        """Salt call to upload the conf, see local_job / local_jobs.
+        """
+        self.ensure_one()
+        return {
+            'fun': 'asterisk.put_config',
+            'arg': [self.name, "'{}'".format(base64.b64encode(self.content.encode()).decode())],
+            'res_model': 'asterisk_plus.conf',
+            'res_method': 'upload_conf_response',
+            'pass_back': {
                 'res_id': self.id,
                 'uid': self.env.uid,
                 'name': self.name,
-            })
+            },
+        }
 
     @api.model
     def upload_conf_response(self, response, pass_back):
@@ -186,17 +195,6 @@ class AsteriskConf(models.Model):
                 pass_back['name']),
                 uid=pass_back['uid'])
         # Reload file form
-        if tools.odoo.release.version_info[0] < 15:
-            msg = {
-                'action': 'reload_view',
-                'model': 'asterisk_plus.conf'
-            }
-            self.env['bus.bus'].sendone('asterisk_plus_actions', json.dumps(msg))
-        else:
-            msg = {'model': 'asterisk_plus.conf'}
-            self.env['bus.bus']._sendone(
-                'asterisk_plus_actions',
-                'reload_view',
-                json.dumps(msg)
-            )
+        self.env['asterisk_plus.server'].reload_view(
+            model='asterisk_plus.conf')
         return True
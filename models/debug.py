@@ -2,10 +2,65 @@ from odoo import models, fields, api, _
 
 
 class Debug(models.Model):
+    """Debug messages kept in a ring buffer.
+
+    Every message takes the next slot of the buffer overwriting the oldest
+    message, so the table never grows beyond the debug_keep_messages setting.
+    """
     _name = 'asterisk_plus.debug'
     _description = 'Asterisk Debug'
-    _order = 'id desc'
+    _order = 'create_date desc, id desc'
     _rec_name = 'id'
 
     model = fields.Char()
+    level = fields.Selection(
+        [('debug', 'Debug'), ('info', 'Info'), ('warning', 'Warning'),
+         ('error', 'Error')], default='debug')
     message = fields.Text()
+    slot = fields.Integer(readonly=True)
+
+    _sql_constraints = [
+        ('slot_uniq', 'unique (slot)', _('The debug slot is already used!')),
+    ]
+
+    def init(self):
+        self.env.cr.execute(
+            'CREATE SEQUENCE IF NOT EXISTS asterisk_plus_debug_slot_seq')
+        # Drop messages saved before the ring buffer was introduced.
+        self.env.cr.execute(
+            'DELETE FROM asterisk_plus_debug WHERE slot IS NULL')
+
+    @api.model
+    def add_message(self, model, message, level='debug'):
+        """Put the message in the next slot of the ring buffer.
+        """
+        size = self.env['asterisk_plus.settings'].get_param(
+            'debug_keep_messages') or 10000
+        self.env.cr.execute("""
+            INSERT INTO asterisk_plus_debug
+                (slot, model, level, message, create_uid, write_uid,
+                 create_date, write_date)
+            VALUES (nextval('asterisk_plus_debug_slot_seq') %% %(size)s,
+                    %(model)s, %(level)s, %(message)s, %(uid)s, %(uid)s,
+                    clock_timestamp() AT TIME ZONE 'UTC',
+                    clock_timestamp() AT TIME ZONE 'UTC')
+            ON CONFLICT (slot) DO UPDATE SET
+                model = EXCLUDED.model,
+                level = EXCLUDED.level,
+                message = EXCLUDED.message,
+                create_uid = EXCLUDED.create_uid,
+                write_uid = EXCLUDED.write_uid,
+                create_date = EXCLUDED.create_date,
+                write_date = EXCLUDED.write_date
+        """, {'size': size, 'model': model, 'level': level,
+              'message': message,
+              'uid': self.env.uid})
+        return True
+
+    @api.model
+    def truncate_messages(self, size):
+        """Remove messages not fitting into the ring buffer of the new size.
+        """
+        self.env.cr.execute(
+            'DELETE FROM asterisk_plus_debug WHERE slot >= %s', (size,))
+        return True
@@ -0,0 +1,41 @@
+# ©️ OdooPBX by Odooist, Odoo Proprietary License v1.0, 2020
+import ipaddress
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def compile_ip_networks(value):
+    """Parse comma separated IP addresses and networks in CIDR notation.
+
+    Returns:
+        A tuple of networks or None if the value is empty and all addresses
+        are permitted. Invalid entries are skipped.
+    """
+    if not value or not value.strip(' ,'):
+        return None
+    networks = []
+    for item in value.split(','):
+        item = item.strip()
+        if not item:
+            continue
+        try:
+            networks.append(ipaddress.ip_network(item, strict=False))
+        except ValueError:
+            logger.warning('Invalid permit IP address %s skipped.', item)
+    return tuple(networks)
+
+
+def ip_permitted(networks, remote_ip):
+    """Check the address against networks of compile_ip_networks.
+    """
+    if networks is None:
+        return True
+    try:
+        address = ipaddress.ip_address(remote_ip)
+    except ValueError:
+        return False
+    # IPv4 clients of dual stack sockets.
+    if address.version == 6 and address.ipv4_mapped:
+        address = address.ipv4_mapped
+    return any(address in k for k in networks)
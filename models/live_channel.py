@@ -0,0 +1,172 @@
+# ©️ OdooPBX by Odooist, Odoo Proprietary License v1.0, 2020
+import logging
+from odoo import models, fields, api, _
+
+logger = logging.getLogger(__name__)
+
+#: Live channel fields and AMI event keys they are taken from.
+LIVE_CHANNEL_KEYS = {
+    'channel': 'Channel',
+    'uniqueid': 'Uniqueid',
+    'linkedid': 'Linkedid',
+    'state': 'ChannelState',
+    'state_desc': 'ChannelStateDesc',
+    'callerid_num': 'CallerIDNum',
+    'callerid_name': 'CallerIDName',
+    'connected_line_num': 'ConnectedLineNum',
+    'connected_line_name': 'ConnectedLineName',
+    'context': 'Context',
+    'exten': 'Exten',
+    'priority': 'Priority',
+    'app': 'Application',
+    'app_data': 'ApplicationData',
+}
+
+
+class LiveChannel(models.Model):
+    """State of active channels.
+
+    Newstate events only update this table. It is UNLOGGED with just the
+    index lookups need so updates do not produce WAL. PostgreSQL empties it
+    after a crash, the rebuild cron fills it again from Asterisk. Channels
+    are kept in asterisk_plus.channel written on Newchannel and Hangup.
+    """
+    _name = 'asterisk_plus.live_channel'
+    _inherit = 'asterisk_plus.live_view'
+    _description = 'Live Channel'
+    _rec_name = 'channel'
+    _order = 'id'
+    _log_access = False
+    _live_view_param = 'auto_reload_channels'
+
+    server = fields.Many2one('asterisk_plus.server', ondelete='cascade',
+                             required=True, readonly=True)
+    #: Channel history record.
+    channel_id = fields.Many2one('asterisk_plus.channel', ondelete='cascade',
+                                 readonly=True)
+    call = fields.Many2one('asterisk_plus.call', ondelete='cascade',
+                           readonly=True)
+    user = fields.Many2one('res.users', ondelete='set null', readonly=True)
+    channel = fields.Char(readonly=True)
+    uniqueid = fields.Char(required=True, readonly=True)
+    linkedid = fields.Char(readonly=True, string='Linked ID')
+    state = fields.Char(readonly=True, string='State code')
+    state_desc = fields.Char(readonly=True, string=_('State'))
+    callerid_num = fields.Char(readonly=True, string='CallerID number')
+    callerid_name = fields.Char(readonly=True, string='CallerID name')
+    connected_line_num = fields.Char(readonly=True)
+    connected_line_name = fields.Char(readonly=True)
+    context = fields.Char(readonly=True)
+    exten = fields.Char(readonly=True)
+    priority = fields.Char(readonly=True)
+    app = fields.Char(readonly=True, string='Application')
+    app_data = fields.Char(readonly=True, string='Application Data')
+    started = fields.Datetime(default=fields.Datetime.now, readonly=True)
+
+    _sql_constraints = [
+        ('uniqueid_uniq', 'unique (uniqueid, server)',
+         _('The channel is already live!')),
+    ]
+
+    def init(self):
+        self.env.cr.execute("""
+            SELECT relpersistence FROM pg_class
+            WHERE relname = 'asterisk_plus_live_channel'
+        """)
+        if self.env.cr.fetchone()[0] == 'p':
+            self.env.cr.execute(
+                'ALTER TABLE asterisk_plus_live_channel SET UNLOGGED')
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        records = super(LiveChannel, self).create(vals_list)
+        records._track_live_state()
+        return records
+
+    def write(self, vals):
+        res = super(LiveChannel, self).write(vals)
+        if {'state', 'state_desc'} & set(vals):
+            self._track_live_state()
+        return res
+
+    def unlink(self):
+        self._live_view_track('closed')
+        self._track_live_state()
+        return super(LiveChannel, self).unlink()
+
+    def _track_live_state(self):
+        """Send the live state to channel and call views."""
+        self.mapped('channel_id')._live_view_track(
+            'updated', ['live_state', 'live_state_desc'])
+        self.mapped('call')._live_view_track('updated', ['live_state'])
+
+    @api.model
+    def _event_values(self, event):
+        return {name: event[key] for name, key in LIVE_CHANNEL_KEYS.items()
+                if key in event}
+
+    @api.model
+    def update_from_event(self, channel, event):
+        """Create or update the live channel from the AMI event.
+        """
+        vals = self._event_values(event)
+        live = self.search([('server', '=', channel.server.id),
+                            ('uniqueid', '=', channel.uniqueid)], limit=1)
+        if live:
+            live.write(vals)
+        else:
+            vals.update({
+                'server': channel.server.id,
+                'uniqueid': channel.uniqueid,
+                'channel_id': channel.id,
+                'call': channel.call.id,
+                'user': channel.user.id,
+            })
+            live = self.create(vals)
+        return live
+
+    @api.model
+    def rebuild_all(self):
+        """Cron job to rebuild live channels from Asterisk.
+        """
+        for server in self.env['asterisk_plus.server'].search([]):
+            server.ami_action(
+                {'Action': 'CoreShowChannels'}, as_list=True,
+                res_model='asterisk_plus.live_channel', res_method='rebuild',
+                pass_back={'server_id': server.id,
+                           'sent': fields.Datetime.to_string(
+                               fields.Datetime.now())})
+
+    @api.model
+    def rebuild(self, data, pass_back):
+        """Replace live channels of the server with CoreShowChannels result.
+        Channels that went live after the action was sent are kept.
+        """
+        if not isinstance(data, list):
+            logger.warning('Live channels rebuild error: %s', data)
+            return False
+        server = self.env['asterisk_plus.server'].browse(pass_back['server_id'])
+        sent = fields.Datetime.to_datetime(pass_back['sent'])
+        events = {k['Uniqueid']: k for k in data if isinstance(k, dict) and
+                  k.get('Event') == 'CoreShowChannel'}
+        live = self.search([('server', '=', server.id)])
+        live.filtered(lambda r: r.uniqueid not in events and
+                      r.started < sent).unlink()
+        live = live.exists()
+        for rec in live.filtered(lambda r: r.uniqueid in events):
+            rec.write(self._event_values(events.pop(rec.uniqueid)))
+        channels = {k.uniqueid: k for k in self.env[
+            'asterisk_plus.channel'].search([
+                ('is_active', '=', True), ('server', '=', server.id),
+                ('uniqueid', 'in', list(events))])}
+        vals_list = []
+        for uniqueid, event in events.items():
+            channel = channels.get(uniqueid, self.env['asterisk_plus.channel'])
+            vals_list.append(dict(
+                self._event_values(event), server=server.id,
+                channel_id=channel.id, call=channel.call.id,
+                user=channel.user.id))
+        self.create(vals_list)
+        logger.info('Live channels of %s rebuilt: %s channels.',
+                    server.name, len(live) + len(vals_list))
+        return True
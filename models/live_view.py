@@ -0,0 +1,90 @@
+# ©️ OdooPBX by Odooist, Odoo Proprietary License v1.0, 2020
+import logging
+from odoo import models, api
+
+logger = logging.getLogger(__name__)
+
+#: Field types not sent in view updates.
+SKIP_FIELD_TYPES = ['binary', 'one2many']
+
+
+class LiveView(models.AbstractModel):
+    """Publish row level changes of live list views to actions.js.
+
+    Created, updated and closed (is_active unset) records are collected
+    during the transaction. Before commit the changed fields are read and
+    sent as one 'update_view' message per model instead of a full reload.
+    """
+    _name = 'asterisk_plus.live_view'
+    _description = 'Live View'
+
+    #: Settings parameter to enable view updates, set in inheriting models.
+    _live_view_param = None
+    #: Not stored fields sent in view updates, inheriting models track them.
+    _live_view_computed = ()
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        records = super(LiveView, self).create(vals_list)
+        records._live_view_track('created')
+        return records
+
+    def write(self, vals):
+        res = super(LiveView, self).write(vals)
+        self._live_view_track('updated', vals)
+        if 'is_active' in vals and not vals['is_active']:
+            self._live_view_track('closed')
+        return res
+
+    def _live_view_track(self, op, fnames=()):
+        if not self or not self._live_view_param or not self.env[
+                'asterisk_plus.settings'].sudo().get_param(
+                    self._live_view_param):
+            return
+        data = self.env.cr.precommit.data.setdefault(
+            'asterisk_plus.live_view', {})
+        if not data:
+            self.env.cr.precommit.add(
+                self.env['asterisk_plus.live_view'].sudo()._live_view_flush)
+        changes = data.setdefault(self._name, {
+            'created': set(), 'closed': set(), 'updated': {}})
+        if op == 'updated':
+            for rec_id in self.ids:
+                changes['updated'].setdefault(rec_id, set()).update(fnames)
+        else:
+            changes[op].update(self.ids)
+
+    def _live_view_fields(self, fnames):
+        """Changed fields to send including stored computed dependents."""
+        fnames = set(fnames)
+        fnames.update(name for name, field in self._fields.items()
+                      if field.store and field.compute and
+                      fnames.intersection(field.depends))
+        return [name for name in fnames if name in self._fields and
+                (self._fields[name].store or
+                 name in self._live_view_computed) and
+                self._fields[name].type not in SKIP_FIELD_TYPES]
+
+    @api.model
+    def _live_view_flush(self):
+        data = self.env.cr.precommit.data.pop('asterisk_plus.live_view', {})
+        for model, changes in data.items():
+            records = self.env[model]
+            fnames = records._live_view_fields(
+                set().union(*changes['updated'].values()))
+            updated = {}
+            if fnames:
+                for values in records.browse(
+                        list(changes['updated'])).exists().read(fnames):
+                    updated[values['id']] = {
+                        name: values[name] for name in
+                        records.browse(values['id'])._live_view_fields(
+                            changes['updated'][values['id']])}
+            try:
+                self.env['asterisk_plus.server'].update_view(model, {
+                    'created': changes['created'],
+                    'closed': changes['closed'],
+                    'updated': updated,
+                })
+            except Exception:
+                logger.exception('Live view %s update error:', model)
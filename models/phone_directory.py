@@ -0,0 +1,276 @@
+# ©️ OdooPBX by Odooist, Odoo Proprietary License v1.0, 2020
+import logging
+import re
+from psycopg2.extras import execute_values
+from odoo import models, fields, api, tools, _
+
+logger = logging.getLogger(__name__)
+
+#: Numbers are matched by at least this number of last digits.
+PHONE_SUFFIX_DIGITS = 7
+#: NOTIFY channel of changed partner ids, comma separated or * for all.
+CALLERID_CHANNEL = 'asterisk_plus_callerid'
+
+
+def strip_number(number):
+    """Strip number formating"""
+    pattern = r'[\s()-+]'
+    return re.sub(pattern, '', number).lstrip('0')
+
+
+def phone_digits(number):
+    return re.sub(r'\D', '', number or '')
+
+
+def phone_suffix(number):
+    """Last digits of the number, every match of the number shares them."""
+    return phone_digits(number)[-PHONE_SUFFIX_DIGITS:]
+
+
+def match_rank(digits, forms):
+    """Rank of the stored digits matching the number forms, lower is better:
+    same digits, then longer stored numbers, then the longest shorter ones.
+    """
+    if digits in forms:
+        return (0, 0)
+    elif digits.endswith(min(forms, key=len)):
+        return (1, 0)
+    return (2, -len(digits))
+
+
+class PhoneDirectory(models.Model):
+    """Normalized numbers of partners and other models.
+
+    There is one row per number and record. Digits are kept reversed with
+    a pattern index so a number is found by its last digits with a single
+    index probe.
+    """
+    _name = 'asterisk_plus.phone_directory'
+    _description = 'Phone Directory'
+    _log_access = False
+    _rec_name = 'number'
+
+    number = fields.Char(required=True, readonly=True)
+    number_reversed = fields.Char(required=True, readonly=True)
+    model = fields.Char(required=True, readonly=True)
+    res_id = fields.Integer(required=True, readonly=True)
+    partner_id = fields.Many2one('res.partner', ondelete='cascade',
+                                 index=True, readonly=True)
+
+    _sql_constraints = [
+        ('number_record_uniq', 'unique (number, model, res_id)',
+         _('The number is already in the directory!')),
+    ]
+
+    def init(self):
+        self.env.cr.execute("""
+            CREATE INDEX IF NOT EXISTS asterisk_plus_phone_directory_rev_idx
+            ON asterisk_plus_phone_directory (number_reversed text_pattern_ops)
+        """)
+        self.env.cr.execute("""
+            CREATE INDEX IF NOT EXISTS asterisk_plus_phone_directory_rec_idx
+            ON asterisk_plus_phone_directory (model, res_id)
+        """)
+        cr = self.env.cr
+        port = None
+        if tools.column_exists(cr, 'asterisk_plus_settings',
+                               'callerid_daemon_port'):
+            cr.execute('SELECT callerid_daemon_port FROM asterisk_plus_settings '
+                       'ORDER BY id LIMIT 1')
+            port = (cr.fetchone() or [None])[0]
+        self._update_notify_triggers(bool(port))
+
+    @api.model
+    def _update_notify_triggers(self, enabled):
+        """Notify CALLERID_CHANNEL about partners with changed numbers or
+        names when the caller ID daemon is enabled, drop the triggers when
+        it is not. Statement triggers send one notification per query.
+        """
+        if not enabled:
+            self.env.cr.execute("""
+                DROP TRIGGER IF EXISTS asterisk_plus_callerid_insert
+                    ON asterisk_plus_phone_directory;
+                DROP TRIGGER IF EXISTS asterisk_plus_callerid_delete
+                    ON asterisk_plus_phone_directory;
+                DROP TRIGGER IF EXISTS asterisk_plus_callerid_update
+                    ON res_partner;
+                DROP FUNCTION IF EXISTS asterisk_plus_callerid_notify();
+            """)
+            return
+        self.env.cr.execute("""
+            CREATE OR REPLACE FUNCTION asterisk_plus_callerid_notify()
+            RETURNS trigger AS $$
+            DECLARE ids text;
+            BEGIN
+                IF TG_TABLE_NAME = 'res_partner' THEN
+                    SELECT string_agg(n.id::text, ',') INTO ids
+                    FROM new_rows n JOIN old_rows o ON o.id = n.id
+                    WHERE n.display_name IS DISTINCT FROM o.display_name
+                        OR n.parent_id IS DISTINCT FROM o.parent_id;
+                ELSIF TG_OP = 'DELETE' THEN
+                    SELECT string_agg(DISTINCT partner_id::text, ',') INTO ids
+                    FROM old_rows;
+                ELSE
+                    SELECT string_agg(DISTINCT partner_id::text, ',') INTO ids
+                    FROM new_rows;
+                END IF;
+                IF ids IS NOT NULL THEN
+                    PERFORM pg_notify(%s, CASE WHEN length(ids) > 7000
+                        THEN '*' ELSE ids END);
+                END IF;
+                RETURN NULL;
+            END $$ LANGUAGE plpgsql;
+
+            DROP TRIGGER IF EXISTS asterisk_plus_callerid_insert
+                ON asterisk_plus_phone_directory;
+            CREATE TRIGGER asterisk_plus_callerid_insert
+                AFTER INSERT ON asterisk_plus_phone_directory
+                REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT
+                EXECUTE PROCEDURE asterisk_plus_callerid_notify();
+            DROP TRIGGER IF EXISTS asterisk_plus_callerid_delete
+                ON asterisk_plus_phone_directory;
+            CREATE TRIGGER asterisk_plus_callerid_delete
+                AFTER DELETE ON asterisk_plus_phone_directory
+                REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT
+                EXECUTE PROCEDURE asterisk_plus_callerid_notify();
+            DROP TRIGGER IF EXISTS asterisk_plus_callerid_update
+                ON res_partner;
+            CREATE TRIGGER asterisk_plus_callerid_update
+                AFTER UPDATE ON res_partner
+                REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+                FOR EACH STATEMENT
+                EXECUTE PROCEDURE asterisk_plus_callerid_notify();
+        """, (CALLERID_CHANNEL,))
+
+    @api.model
+    def match(self, number, *other_forms):
+        """Find the records by the number and its other forms.
+
+        Numbers ending with the number are matched as well as the number
+        ending with at least PHONE_SUFFIX_DIGITS of the stored numbers.
+
+        Returns:
+            Rows (partner_id, model, res_id) of the best match: same digits,
+            then longer stored numbers, then the longest shorter ones.
+        """
+        return self.match_many([(number,) + other_forms])[0]
+
+    @api.model
+    def match_many(self, numbers):
+        """Match many numbers in one query, see match.
+
+        Args:
+            numbers (list): tuples of the number and its other forms.
+
+        Returns:
+            A list of matched rows for every number.
+        """
+        positions, prefixes, suffixes = [], [], []
+        forms_list = []
+        for pos, number_forms in enumerate(numbers):
+            forms = {phone_digits(k) for k in number_forms} - {''}
+            forms_list.append(forms)
+            if not forms:
+                continue
+            shortest = min(forms, key=len)
+            longest = max(forms, key=len)
+            positions.append(pos)
+            prefixes.append(shortest[::-1])
+            suffixes.append(','.join(longest[-k:][::-1] for k in range(
+                PHONE_SUFFIX_DIGITS, len(longest))))
+        found = [[] for _ in numbers]
+        if not positions:
+            return found
+        # One index probe per number. Reversed digits starting with the
+        # prefix are a range as ':' follows '9', LIKE with a pattern from
+        # a column cannot use the index.
+        self.env.cr.execute("""
+            SELECT q.pos, d.partner_id, d.model, d.res_id, d.number_reversed
+            FROM unnest(%s::int[], %s::text[], %s::text[])
+                AS q (pos, prefix, suffixes),
+            LATERAL (
+                SELECT partner_id, model, res_id, number_reversed
+                FROM asterisk_plus_phone_directory
+                WHERE (number_reversed ~>=~ q.prefix AND
+                       number_reversed ~<~ (q.prefix || ':')) OR
+                    number_reversed = ANY(string_to_array(q.suffixes, ','))
+            ) AS d
+        """, (positions, prefixes, suffixes))
+        best = {}
+        for pos, partner_id, model, res_id, number_reversed in \
+                self.env.cr.fetchall():
+            rank = match_rank(number_reversed[::-1], forms_list[pos])
+            if pos not in best or rank < best[pos]:
+                best[pos], found[pos] = rank, []
+            if rank == best[pos]:
+                found[pos].append((partner_id, model, res_id))
+        return found
+
+
+class PhoneDirectoryMixin(models.AbstractModel):
+    """Keep numbers of the inheriting model in the phone directory.
+
+    Set _phone_directory_fields to the stored fields with normalized
+    numbers. The record's partner is taken from partner_id field, override
+    _phone_directory_partner to change it.
+    """
+    _name = 'asterisk_plus.phone_directory.mixin'
+    _description = 'Phone Directory Mixin'
+
+    _phone_directory_fields = []
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        records = super(PhoneDirectoryMixin, self).create(vals_list)
+        records._phone_directory_sync()
+        return records
+
+    def write(self, vals):
+        res = super(PhoneDirectoryMixin, self).write(vals)
+        if self._phone_directory_depends().intersection(vals):
+            self._phone_directory_sync()
+        return res
+
+    def unlink(self):
+        self._phone_directory_delete()
+        return super(PhoneDirectoryMixin, self).unlink()
+
+    def _phone_directory_depends(self):
+        fnames = {'active', 'partner_id'}
+        for fname in self._phone_directory_fields:
+            fnames.add(fname)
+            fnames.update(k.split('.')[0] for k in self._fields[fname].depends)
+        return fnames
+
+    def _phone_directory_partner(self):
+        self.ensure_one()
+        return self.partner_id.id if 'partner_id' in self._fields else False
+
+    def _phone_directory_delete(self):
+        if self.ids:
+            self.env.cr.execute("""
+                DELETE FROM asterisk_plus_phone_directory
+                WHERE model = %s AND res_id IN %s
+            """, (self._name, tuple(self.ids)))
+
+    def _phone_directory_sync(self):
+        """Replace directory rows of the records.
+        """
+        if not self._phone_directory_fields:
+            return
+        self._phone_directory_delete()
+        rows = set()
+        for rec in self:
+            if 'active' in rec._fields and not rec.active:
+                continue
+            for fname in self._phone_directory_fields:
+                number = rec[fname]
+                if number and phone_digits(number):
+                    rows.add((number, phone_digits(number)[::-1], self._name,
+                              rec.id, rec._phone_directory_partner() or None))
+        if rows:
+            execute_values(self.env.cr, """
+                INSERT INTO asterisk_plus_phone_directory
+                    (number, number_reversed, model, res_id, partner_id)
+                VALUES %s
+            """, list(rows))
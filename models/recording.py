@@ -99,14 +99,14 @@ class Recording(models.Model):
         """Save call recording."""
 
         if not channel.recording_file_path:
-            debug(self, 'File path not specified for channel {}'.format(channel.channel))
+            debug(self, 'File path not specified for channel {}', channel.channel)
             return False
         if channel.cause != '16':
             debug(self,
                 'Call Recording was activated but call was not answered'
-                ' on {}'.format(channel.channel))
+                ' on {}', channel.channel)
             return False
-        debug(self, 'Save call recording for channel {}.'.format(channel.channel))
+        debug(self, 'Save call recording for channel {}.', channel.channel)
         # Transfer the file.
         channel.server.local_job(
             fun='asterisk.get_file',
@@ -122,14 +122,14 @@ class Recording(models.Model):
         """Upload call recording to Odoo."""
 
         if not isinstance(data, dict):
-            debug(self, 'Upload recording error: {}'.format(data))
+            debug(self, 'Upload recording error: {}', data, level='error')
             return False
 
         channel_id = pass_back.get('channel_id')
         input_data = data.get('file_data')
         channel = self.env['asterisk_plus.channel'].browse(channel_id)
-        debug(self, 'Call recording upload for channel {}'.format(
-            channel.channel))
+        debug(self, 'Call recording upload for channel {}',
+            channel.channel)
         mp3_encode = self.env['asterisk_plus.settings'].get_param(
             'use_mp3_encoder')
         transcipt_recording = self.env['asterisk_plus.settings'].get_param(
@@ -137,8 +137,8 @@ class Recording(models.Model):
         # Transcript
         transcript = None
         if SR and transcipt_recording:
-            debug(self, 'Transcript call recording for channel {}'.format(
-                channel.channel))
+            debug(self, 'Transcript call recording for channel {}',
+                channel.channel)
             key = self.env['asterisk_plus.settings'].get_param(
                 'google_sr_api_key') or None
             lang = self.env['asterisk_plus.settings'].get_param(
@@ -193,7 +193,7 @@ class Recording(models.Model):
         })
         # Delete recording from the Asterisk server
         if self.env['asterisk_plus.settings'].get_param('delete_recordings'):
-            debug(self, 'DELETE RECORDING {}'.format(rec.file_path))
+            debug(self, 'DELETE RECORDING {}', rec.file_path)
             channel.server.local_job(
                 fun='asterisk.delete_file',
                 arg=rec.file_path)
@@ -210,8 +210,8 @@ class Recording(models.Model):
         pcm_data = wav_data.readframes(num_frames)
         debug(self,
               'Encoding Wave file. Number of channels: '
-              '{}. Sample rate: {}, Number of frames: {}'.format(
-                num_channels, sample_rate, num_frames))
+              '{}. Sample rate: {}, Number of frames: {}',
+              num_channels, sample_rate, num_frames)
         wav_data.close()
 
         encoder = lameenc.Encoder()
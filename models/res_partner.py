@@ -1,18 +1,91 @@
 # ©️ OdooPBX by Odooist, Odoo Proprietary License v1.0, 2020
 import logging
-import re
+import threading
+import time
 import phonenumbers
+from psycopg2.extras import execute_values
 from phonenumbers import phonenumberutil
 from odoo import models, fields, api, tools, _
+from .phone_directory import PHONE_SUFFIX_DIGITS, match_rank, phone_digits, \
+    phone_suffix, strip_number
 from .settings import debug
 
 logger = logging.getLogger(__name__)
 
+#: Caller ID lookups by (dbname, number, country): (expire, numbers, result).
+CALLERID_CACHE = {}
+#: Cache keys by (dbname, last digits of the number) to invalidate.
+CALLERID_CACHE_INDEX = {}
+#: Oldest transaction ID running at the last invalidation sync per database.
+CALLERID_CACHE_SEEN = {}
+CALLERID_CACHE_LOCK = threading.Lock()
+CALLERID_CACHE_SIZE = 10000
+CALLERID_CACHE_TTL = 3600
+#: Partner fields that change the caller ID lookup result.
+CALLERID_FIELDS = {'phone', 'mobile', 'country_id', 'name', 'parent_id',
+                   'is_company', 'active'}
+#: Partners re-normalized per committed chunk.
+RENORMALIZE_CHUNK = 5000
+#: Set by the migration to start the re-normalization job.
+RENORMALIZE_PARAM = 'asterisk_plus.renormalize_phones'
+#: asterisk_plus.backfill job of the re-normalization.
+RENORMALIZE_JOB = 'renormalize_phones'
+#: Lookups scan partners not re-normalized yet only below this number.
+RENORMALIZE_SCAN_LIMIT = 20000
+#: Crons processing slices of the re-normalization in parallel.
+RENORMALIZE_CRONS = ['asterisk_plus.renormalize_phones',
+                     'asterisk_plus.renormalize_phones_2',
+                     'asterisk_plus.renormalize_phones_3',
+                     'asterisk_plus.renormalize_phones_4']
+
+
+def _callerid_cache_evict(dbname, number):
+    for key in CALLERID_CACHE_INDEX.pop((dbname, phone_suffix(number)), ()):
+        CALLERID_CACHE.pop(key, None)
+
+
+def _callerid_cache_put(key, numbers, result, seen):
+    dbname = key[0]
+    with CALLERID_CACHE_LOCK:
+        # The lookup transaction could not see newer invalidations.
+        if seen < CALLERID_CACHE_SEEN.get(dbname, 0):
+            return
+        if len(CALLERID_CACHE) >= CALLERID_CACHE_SIZE:
+            old_key = next(iter(CALLERID_CACHE))
+            for number in CALLERID_CACHE.pop(old_key)[1]:
+                CALLERID_CACHE_INDEX.get(
+                    (dbname, phone_suffix(number)), set()).discard(old_key)
+        CALLERID_CACHE[key] = (
+            time.monotonic() + CALLERID_CACHE_TTL, numbers, result)
+        for number in numbers:
+            CALLERID_CACHE_INDEX.setdefault(
+                (dbname, phone_suffix(number)), set()).add(key)
+
+
+def normalize_phone(number, country):
+    """Return the number in E.164 format or as is if it cannot be parsed.
+    """
+    try:
+        phone_nbr = phonenumbers.parse(number, country)
+        if phonenumbers.is_possible_number(phone_nbr) or \
+                phonenumbers.is_valid_number(phone_nbr):
+            number = phonenumbers.format_number(
+                phone_nbr, phonenumbers.PhoneNumberFormat.E164)
+    except phonenumbers.phonenumberutil.NumberParseException:
+        pass
+    except Exception as e:
+        logger.warning('Normalize phone error: %s', e)
+    return number
+
+
+def _normalize_rows(rows):
+    """Normalize numbers of (id, phone, mobile, country) rows.
+    """
+    return [(partner_id,
+             normalize_phone(phone, country) if phone else None,
+             normalize_phone(mobile, country) if mobile else None)
+            for partner_id, phone, mobile, country in rows]
 
-def strip_number(number):
-    """Strip number formating"""
-    pattern = r'[\s()-+]'
-    return re.sub(pattern, '', number).lstrip('0')
 
 def format_number(self, number, country=None, format_type='e164'):
     """Return number in requested format_type
@@ -21,9 +94,9 @@ def format_number(self, number, country=None, format_type='e164'):
     try:
         phone_nbr = phonenumbers.parse(number, country)
         if not phonenumbers.is_possible_number(phone_nbr):
-            debug(self, '{} country {} parse impossible'.format(
+            debug(self, '{} country {} parse impossible',
                 number, country
-            ))
+            )
         # We have a parsed number, let check what format to return.
         elif format_type == 'e164':
             res = phonenumbers.format_number(
@@ -31,19 +104,21 @@ def format_number(self, number, country=None, format_type='e164'):
         else:
             logger.error('WRONG FORMATTING PASSED: %s', format_type)
     except phonenumberutil.NumberParseException:
-        debug(self, '{} {} {} got NumberParseException'.format(
+        debug(self, '{} {} {} got NumberParseException',
             number, country, format_type
-        ))
+        )
     except Exception:
         logger.exception('FORMAT NUMBER ERROR: ')
     finally:
-        debug(self, '{} county {} format {}: {}'.format(
-            number, country, format_type, res))
+        debug(self, '{} county {} format {}: {}',
+            number, country, format_type, res)
         return res or number
 
 
 class Partner(models.Model):
-    _inherit = ['res.partner']
+    _inherit = ['res.partner', 'asterisk_plus.phone_directory.mixin']
+
+    _phone_directory_fields = ['phone_normalized', 'mobile_normalized']
 
     phone_normalized = fields.Char(compute='_get_phone_normalized',
                                    index=True, store=True,
@@ -71,21 +146,123 @@ class Partner(models.Model):
             logger.exception(e)
         res = super(Partner, self).create(vals)
         if res and not self.env.context.get('no_clear_cache'):
-            self.clear_caches()
+            res._invalidate_callerid_cache(res._get_callerid_numbers())
         return res
 
     def write(self, values):
+        if not CALLERID_FIELDS.intersection(values) or \
+                self.env.context.get('no_clear_cache'):
+            return super(Partner, self).write(values)
+        # Names of contacts depend on the parent name.
+        partners = self.with_context(active_test=False).search(
+            [('id', 'child_of', self.ids)])
+        numbers = partners._get_callerid_numbers()
         res = super(Partner, self).write(values)
-        if res and not self.env.context.get('no_clear_cache'):
-            self.clear_caches()
+        if res:
+            partners._invalidate_callerid_cache(
+                numbers | partners._get_callerid_numbers())
         return res
 
     def unlink(self):
+        numbers = self._get_callerid_numbers()
         res = super(Partner, self).unlink()
         if res and not self.env.context.get('no_clear_cache'):
-            self.clear_caches()
+            self._invalidate_callerid_cache(numbers)
         return res
 
+    def _get_callerid_numbers(self):
+        return set(self.mapped('phone_normalized') +
+                   self.mapped('mobile_normalized')) - {False}
+
+    @api.model
+    def _invalidate_callerid_cache(self, numbers):
+        """Invalidate cached caller ID lookups of the normalized numbers.
+
+        Invalidations are saved in the transaction so every Odoo process
+        drops its cached lookups when the change is committed.
+        """
+        if not numbers:
+            return
+        execute_values(self.env.cr, """
+            INSERT INTO asterisk_plus_callerid_invalidation (number)
+            VALUES %s
+        """, [(k,) for k in numbers])
+
+    def _sync_callerid_cache(self):
+        """Drop cached lookups invalidated by committed transactions.
+
+        Invalidations are selected by the ID of their transaction from the
+        oldest transaction running at the last sync, so ones committed out
+        of order are not skipped.
+
+        Returns:
+            The oldest transaction ID running for the current transaction.
+        """
+        dbname = self.env.cr.dbname
+        self.env.cr.execute(
+            'SELECT txid_snapshot_xmin(txid_current_snapshot())')
+        xmin = self.env.cr.fetchone()[0]
+        seen = CALLERID_CACHE_SEEN.get(dbname)
+        if seen is None:
+            # Nothing is cached before the first sync.
+            CALLERID_CACHE_SEEN[dbname] = xmin
+            return xmin
+        self.env.cr.execute("""
+            SELECT DISTINCT number FROM asterisk_plus_callerid_invalidation
+            WHERE txid >= %s
+        """, (min(seen, xmin),))
+        rows = self.env.cr.fetchall()
+        with CALLERID_CACHE_LOCK:
+            for number, in rows:
+                _callerid_cache_evict(dbname, number)
+            CALLERID_CACHE_SEEN[dbname] = max(
+                CALLERID_CACHE_SEEN.get(dbname, 0), xmin)
+        return xmin
+
+    @api.model
+    def vacuum_callerid_cache(self, hours=24):
+        """Cron job to delete old caller ID cache invalidations.
+        """
+        self.env.cr.execute("""
+            DELETE FROM asterisk_plus_callerid_invalidation
+            WHERE create_date < (now() at time zone 'UTC') - %s * interval '1 hour'
+        """, (hours,))
+
+    def init(self):
+        super(Partner, self).init()
+        # Dropped by the uninstall hook.
+        self.env.cr.execute("""
+            CREATE TABLE IF NOT EXISTS asterisk_plus_callerid_invalidation (
+                id bigserial PRIMARY KEY,
+                number varchar NOT NULL,
+                create_date timestamp DEFAULT (now() at time zone 'UTC'));
+            ALTER TABLE asterisk_plus_callerid_invalidation
+                ADD COLUMN IF NOT EXISTS txid bigint NOT NULL
+                DEFAULT txid_current();
+            CREATE INDEX IF NOT EXISTS asterisk_plus_callerid_invalidation_txid_idx
+                ON asterisk_plus_callerid_invalidation (txid);
+        """)
+        self._phone_directory_fill_later()
+
+    @api.model
+    def _phone_directory_fill_later(self):
+        """Start the re-normalization job when the phone directory is new.
+        Its chunks add partner numbers missing in the directory.
+        """
+        cr = self.env.cr
+        if tools.table_exists(cr, 'asterisk_plus_phone_directory'):
+            cr.execute("""
+                SELECT 1 FROM asterisk_plus_phone_directory
+                WHERE model = 'res.partner' LIMIT 1
+            """)
+            if cr.fetchone():
+                return
+        # Started by start_backfill_jobs when the crons are loaded.
+        cr.execute("""
+            INSERT INTO ir_config_parameter (key, value) VALUES (%s, '0')
+            ON CONFLICT (key) DO UPDATE SET value = '0'
+        """, (RENORMALIZE_PARAM,))
+
     @api.model
     def originate_call(self, number, model=None, res_id=None, exten=None):
         """Originate Call to partner.
@@ -118,19 +295,107 @@ class Partner(models.Model):
         """Keep normalized phone numbers in normalized fields.
         """
         self.ensure_one()
-        country = self._get_country()
-        try:
-            phone_nbr = phonenumbers.parse(number, country)
-            if phonenumbers.is_possible_number(phone_nbr) or \
-                    phonenumbers.is_valid_number(phone_nbr):
-                number = phonenumbers.format_number(
-                    phone_nbr, phonenumbers.PhoneNumberFormat.E164)
-        except phonenumbers.phonenumberutil.NumberParseException:
-            pass
-        except Exception as e:
-            logger.warning('Normalize phone error: %s', e)
-        # Strip the number if parse error.
-        return number
+        return normalize_phone(number, self._get_country())
+
+    @api.model
+    def renormalize_phones(self, restart=False, chunk_size=RENORMALIZE_CHUNK,
+                           time_limit=None):
+        """Recompute normalized numbers of all partners in committed chunks.
+
+        Partner IDs are split in slices, one per cron of RENORMALIZE_CRONS
+        so they run in parallel. Changed numbers are written with bulk
+        updates. Progress is kept in asterisk_plus.backfill so an
+        interrupted job is resumed on the next call.
+
+        Args:
+            restart (bool): Start a new job from the first partner.
+            time_limit (int): Stop after this number of seconds.
+
+        Returns:
+            False if stopped by the time limit.
+        """
+        backfill = self.env['asterisk_plus.backfill'].sudo()
+        if restart:
+            backfill.start(RENORMALIZE_JOB, self._table,
+                           len(RENORMALIZE_CRONS))
+        return backfill.run(RENORMALIZE_JOB, self._renormalize_chunk,
+                            chunk_size, time_limit)
+
+    @api.model
+    def _renormalize_chunk(self, last_id, end_id, chunk_size):
+        """Re-normalize partners after last_id up to end_id.
+
+        Returns:
+            The last partner ID done or None if there are none.
+        """
+        default_country = self.env.company.country_id.code or None
+        # Same countries as _get_country.
+        self.env.cr.execute("""
+            SELECT p.id, p.phone, p.mobile,
+                COALESCE(c.code, pc.code, cc.code, %s),
+                p.phone_normalized, p.mobile_normalized
+            FROM res_partner p
+            LEFT JOIN res_country c ON c.id = p.country_id
+            LEFT JOIN res_partner pp ON pp.id = p.parent_id
+            LEFT JOIN res_country pc ON pc.id = pp.country_id
+            LEFT JOIN res_company co ON co.id = p.company_id
+            LEFT JOIN res_partner cp ON cp.id = co.partner_id
+            LEFT JOIN res_country cc ON cc.id = cp.country_id
+            WHERE p.id > %s AND p.id <= %s ORDER BY p.id LIMIT %s
+        """, (default_country, last_id, end_id, chunk_size))
+        rows = self.env.cr.fetchall()
+        if not rows:
+            return None
+        old = {k[0]: k[4:] for k in rows}
+        rows = [k[:4] for k in rows]
+        res = _normalize_rows(rows)
+        changed = [k for k in res if k[1:] != old[k[0]]]
+        if changed:
+            self._write_normalized(changed, old)
+        # Numbers missing in the directory, e.g. a new one.
+        self.env.cr.execute("""
+            INSERT INTO asterisk_plus_phone_directory
+                (number, number_reversed, model, res_id, partner_id)
+            SELECT DISTINCT n.number,
+                reverse(regexp_replace(n.number, '\\D', '', 'g')),
+                'res.partner', p.id, p.id
+            FROM res_partner p,
+                LATERAL (VALUES (p.phone_normalized), (p.mobile_normalized))
+                AS n (number)
+            WHERE p.id > %s AND p.id <= %s AND p.active
+                AND regexp_replace(n.number, '\\D', '', 'g') != ''
+            ON CONFLICT DO NOTHING
+        """, (last_id, rows[-1][0]))
+        return rows[-1][0]
+
+    @api.model
+    def _write_normalized(self, rows, old):
+        """Write (id, phone_normalized, mobile_normalized) rows.
+        """
+        execute_values(self.env.cr, """
+            UPDATE res_partner p
+            SET phone_normalized = v.phone, mobile_normalized = v.mobile
+            FROM (VALUES %s) AS v (id, phone, mobile)
+            WHERE p.id = v.id
+        """, rows)
+        partners = self.with_context(active_test=False).browse(
+            [k[0] for k in rows])
+        partners.invalidate_cache(
+            ['phone_normalized', 'mobile_normalized'], partners.ids)
+        partners._phone_directory_sync()
+        self._invalidate_callerid_cache(
+            {k for row in rows for k in old[row[0]] if k} |
+            partners._get_callerid_numbers())
+
+    @api.model
+    def renormalize_phones_later(self, restart=True):
+        """Run the re-normalization job in its crons.
+        """
+        if restart:
+            self.env['asterisk_plus.backfill'].sudo().start(
+                RENORMALIZE_JOB, self._table, len(RENORMALIZE_CRONS))
+        for cron in RENORMALIZE_CRONS:
+            self.env.ref(cron)._trigger()
 
     def search_by_number(self, number):
         """Search partner by number.
@@ -144,9 +409,14 @@ class Partner(models.Model):
             '|',
             ('phone_normalized', '=', number),
             ('mobile_normalized', '=', number)])
-        debug(self, '{} belongs to partners: {}'.format(
+        return self._select_partner(found, number)
+
+    def _select_partner(self, found, number):
+        """Select the partner from all partners found by the number.
+        """
+        debug(self, '{} belongs to partners: {}',
             number, found.mapped('id')
-        ))
+        )
         parents = found.mapped('parent_id')
         # 1-st case: just one partner, perfect!
         if len(found) == 1:
@@ -170,7 +440,7 @@ class Partner(models.Model):
         # 5-rd case: many partners same parent company
         elif len(parents) == 1 and len(found) > 1 and len(found.filtered(
                 lambda r: r.parent_id in [k for k in parents])) > 1:
-            debug(self, 'MANY PARTNERS SAME PARENT COMPANY {}'.format(number))
+            debug(self, 'MANY PARTNERS SAME PARENT COMPANY {}', number)
             return parents[0]
 
     def _get_country(self):
@@ -189,33 +459,155 @@ class Partner(models.Model):
             return self.env.user.company_id.country_id.code
 
     @api.model
-    @tools.ormcache('number', 'country')
     def get_partner_by_number(self, number, country=None):
-        number = strip_number(number)
-        if (not number or 'unknown' in number or
-            number == 's' or len(number) < 7
-        ):
-            debug(self, '{} skip search'.format(number))
-            return {'name': _('Unknown'), 'id': False}
-        partner = None
-        # Search by stripped number prefixed with '+'
-        number_plus = '+' + number
-        partner = self.search_by_number(number_plus)
-        if partner:
-            return {'id': partner.id, 'name': partner.display_name }
-        # Search by stripped number
-        partner = self.search_by_number(number)
-        if partner:
-            return {'id': partner.id, 'name': partner.display_name }
-        # Search by number in e164 format
-        e164_number = format_number(self,
-            number, country=country, format_type='e164')
-        if e164_number and e164_number not in [number, number_plus]:
-            partner = self.search_by_number(e164_number)
-        if partner:
-            return {'id': partner.id, 'name': partner.display_name }
-        else:
-            return {'name': _('Unknown'), 'id': False}
+        """Get partner ID and name by number, results are cached.
+        """
+        return self.get_partners_by_numbers([number], country)[number]
+
+    @api.model
+    def get_partners_by_numbers(self, numbers, country=None):
+        """Get partners of many numbers at once.
+
+        Returns:
+            A dict of number: {'id': partner_id, 'name': name}
+        """
+        seen = self._sync_callerid_cache()
+        dbname = self.env.cr.dbname
+        now = time.monotonic()
+        results, missing = {}, []
+        for number in numbers:
+            cached = CALLERID_CACHE.get((dbname, number, country))
+            if cached and cached[0] > now:
+                results[number] = dict(cached[2])
+            elif number not in results:
+                results[number] = None
+                missing.append(number)
+        for number, (searched, result) in zip(
+                missing, self._search_partners_by_numbers(missing, country)):
+            if searched is not None:
+                _callerid_cache_put(
+                    (dbname, number, country), searched, result, seen)
+            results[number] = dict(result)
+        return results
+
+    def _search_partners_by_numbers(self, numbers, country=None):
+        """Returns searched numbers and the result for every number.
+        Searched numbers are None if the result must not be cached.
+        """
+        unknown = {'name': _('Unknown'), 'id': False}
+        searched = []
+        for number in numbers:
+            number = strip_number(number)
+            if (not number or 'unknown' in number or
+                number == 's' or len(number) < 7
+            ):
+                debug(self, '{} skip search', number)
+                searched.append([])
+                continue
+            # Search by stripped number prefixed with '+', by stripped
+            # number and by number in e164 format in the phone directory.
+            forms = ['+' + number, number]
+            e164_number = format_number(self,
+                number, country=country, format_type='e164')
+            if e164_number and e164_number not in forms:
+                forms.append(e164_number)
+            searched.append(forms)
+        rows = self.env['asterisk_plus.phone_directory'].match_many(searched)
+        pending = self.env['asterisk_plus.backfill'].sudo().pending_ranges(
+            RENORMALIZE_JOB)
+        not_searched = pending and sum(k[1] - k[0] for k in pending) > \
+            RENORMALIZE_SCAN_LIMIT
+        if not_searched:
+            # Too many to scan on every miss, they are found when done.
+            debug(self, 'Partners not re-normalized yet are not searched.')
+        elif pending:
+            # Partners not done by the re-normalization job are not in the
+            # directory yet.
+            for forms, found in zip(searched, rows):
+                if forms and not found:
+                    found.extend(self._match_not_normalized(forms, pending))
+        # Read all found partners at once.
+        partners = self.browse(
+            {k[0] for found in rows for k in found if k[0]}).exists()
+        res = []
+        for forms, found in zip(searched, rows):
+            ids = {k[0] for k in found}
+            found = partners.filtered(lambda r: r.id in ids)
+            partner = self._select_partner(found, forms[1]) if found else None
+            if partner:
+                res.append((forms, {'id': partner.id,
+                                    'name': partner.display_name}))
+            else:
+                res.append((None if not_searched else forms, unknown))
+        return res
+
+    def _match_not_normalized(self, forms, ranges):
+        """Match partners of (last_id, end_id) ranges normalizing their
+        numbers on the fly.
+
+        Returns:
+            Rows like asterisk_plus.phone_directory match.
+        """
+        suffix = phone_suffix(forms[1])
+        self.env.cr.execute("""
+            SELECT p.id FROM res_partner p
+            JOIN (VALUES {}) AS r (last_id, end_id)
+                ON p.id > r.last_id AND p.id <= r.end_id
+            WHERE p.active AND (
+                right(regexp_replace(p.phone, '\\D', '', 'g'), %s) = %s OR
+                right(regexp_replace(p.mobile, '\\D', '', 'g'), %s) = %s)
+        """.format(','.join(['(%s, %s)'] * len(ranges))),
+            [k for r in ranges for k in r] +
+            [len(suffix), suffix, len(suffix), suffix])
+        digit_forms = {phone_digits(k) for k in forms} - {''}
+        shortest = min(digit_forms, key=len)
+        longest = max(digit_forms, key=len)
+        found, best = [], None
+        for partner in self.browse([k[0] for k in self.env.cr.fetchall()]):
+            for number in (partner.phone, partner.mobile):
+                digits = number and phone_digits(
+                    partner._normalize_phone(number))
+                if not digits or len(digits) < PHONE_SUFFIX_DIGITS or not (
+                        digits.endswith(shortest) or longest.endswith(digits)):
+                    continue
+                rank = match_rank(digits, digit_forms)
+                if best is None or rank < best:
+                    found, best = [], rank
+                if rank == best:
+                    found.append((partner.id, self._name, partner.id))
+        return found
+
+    @api.model
+    def get_caller_profiles(self, numbers, country=None):
+        """Get the partner, the manager and the tags of many numbers.
+
+        Returns:
+            A dict of number: {'id', 'name', 'manager_exten',
+            'manager_channels', 'tags'}, manager channels are joined by &.
+        """
+        found = self.get_partners_by_numbers(numbers, country)
+        partners = self.browse(
+            {k['id'] for k in found.values() if k['id']}).exists()
+        # Prefetch managers and tags of all partners.
+        partners.mapped('user_id.asterisk_users.channels')
+        partners.mapped('category_id.name')
+        res = {}
+        for number, info in found.items():
+            profile = dict(info, manager_exten='', manager_channels='', tags='')
+            partner = partners.filtered(lambda r: r.id == info['id'])
+            if partner:
+                if partner.user_id and partner.user_id.asterisk_users:
+                    asterisk_user = partner.user_id.asterisk_users[0]
+                    profile['manager_exten'] = asterisk_user.exten or ''
+                    profile['manager_channels'] = '&'.join(
+                        k.name for k in asterisk_user.channels
+                        if k.originate_enabled)
+                profile['tags'] = ','.join(partner.category_id.mapped('name'))
+            res[number] = profile
+        return res
+
+    def _phone_directory_partner(self):
+        return self.id
 
     def _get_call_count(self):
         for rec in self:
@@ -1,17 +1,91 @@
+from datetime import datetime, timedelta
 import json
 import logging
-from odoo import fields, models, api
+import time
+from odoo import fields, models, api, registry, SUPERUSER_ID, _
 from .settings import debug
 
 logger = logging.getLogger(__name__)
 
+#: How many times to look for a job registered after the return has come.
+RETURNER_RETRIES = 10
+RETURNER_RETRY_DELAY = 0.2
+#: Job handles are polled with this interval and no longer than the max wait.
+#: The wait is short not to hold an HTTP worker, clients poll again.
+JOB_POLL_INTERVAL = 0.25
+JOB_POLL_MAX_WAIT = 2
+#: Queued jobs not sent after commit are picked by the cron after this delay.
+QUEUE_GRACE = 60
+#: Retry delay doubles on every attempt up to the max delay.
+QUEUE_RETRY_DELAY = 10
+QUEUE_MAX_DELAY = 3600
+QUEUE_MAX_ATTEMPTS = 12
+
+
+def send_salt_jobs(dbname, job_ids):
+    """Send jobs registered by a committed transaction to Salt.
+    """
+    try:
+        with registry(dbname).cursor() as cr:
+            env = api.Environment(cr, SUPERUSER_ID, {})
+            env['asterisk_plus.salt_job'].browse(job_ids).exists()._send()
+    except Exception:
+        logger.exception('Salt jobs send error:')
+
+
+def poll_salt_job(dbname, handle, wait=0):
+    """Get the result of the job by its handle.
+
+    Waits up to wait seconds for the job to complete. Every check is done in
+    a short transaction so no cursor is held while waiting.
+
+    Returns:
+        {'state': 'pending'|'done'|'failed'|'expired', 'return': ...}
+        or None if the handle is not found.
+    """
+    deadline = time.monotonic() + min(float(wait or 0), JOB_POLL_MAX_WAIT)
+    while True:
+        with registry(dbname).cursor() as cr:
+            env = api.Environment(cr, SUPERUSER_ID, {})
+            job = env['asterisk_plus.salt_job'].search(
+                [('handle', '=', handle)])
+            result = job._get_result() if job else None
+        if not result or result['state'] not in ('queued', 'pending') or \
+                time.monotonic() >= deadline:
+            return result
+        time.sleep(JOB_POLL_INTERVAL)
+
 
 class SaltJob(models.Model):
     _name = 'asterisk_plus.salt_job'
     _description = 'Salt job'
+    _order = 'id desc'
 
+    server = fields.Many2one('asterisk_plus.server', ondelete='cascade')
     fun = fields.Char()
-    jid = fields.Char(required=True)
+    #: JSON encoded function arguments kept until the job is sent.
+    arg = fields.Text()
+    kwarg = fields.Text()
+    timeout = fields.Integer()
+    #: Salt job ID, set when the job is sent.
+    jid = fields.Char(index=True)
+    state = fields.Selection([
+        ('queued', 'Queued'),
+        ('pending', 'Pending'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+        ('expired', 'Expired')], default='queued', required=True, index=True)
+    #: Queued jobs are sent not before this time.
+    next_try = fields.Datetime(index=True, readonly=True,
+                               default=lambda self: datetime.utcnow() +
+                               timedelta(seconds=QUEUE_GRACE))
+    attempts = fields.Integer(readonly=True)
+    #: Queued jobs with the same key are merged, the last arguments are sent.
+    merge_key = fields.Char(index=True, readonly=True)
+    sent_date = fields.Datetime(readonly=True)
+    return_date = fields.Datetime(readonly=True)
+    #: Seconds from sending the job to receiving its return.
+    latency = fields.Float(readonly=True, group_operator='avg')
     ret = fields.Text()
     full_ret = fields.Text()
     success = fields.Char()
@@ -19,6 +93,103 @@ class SaltJob(models.Model):
     res_method = fields.Char()
     pass_back = fields.Text()
     res_notify_uid = fields.Integer()
+    #: JSON list of functions sent in one compound job with their callbacks.
+    calls = fields.Text(readonly=True)
+    #: Random job handle to poll the result, the return is kept when set.
+    handle = fields.Char(index=True, readonly=True)
+
+    _sql_constraints = [
+        ('jid_uniq', 'unique (jid)', _('The job is already registered!')),
+    ]
+
+    def _send_after_commit(self):
+        """Send the jobs to Salt when the current transaction is committed.
+        """
+        queue = self.env.cr.postcommit.data.setdefault(
+            'asterisk_plus.salt_job', [])
+        if not queue:
+            dbname = self.env.cr.dbname
+            self.env.cr.postcommit.add(lambda: send_salt_jobs(dbname, queue))
+        queue.extend(self.ids)
+
+    def _send(self):
+        """Send the queued jobs to Salt, every job is committed separately.
+        Sending stops on the first Salt API connection error, the job is
+        retried later.
+        """
+        from .server import SaltApiConnectionError
+        for job in self:
+            # Skip jobs being sent by other transactions or already sent.
+            self.env.cr.execute("""
+                SELECT id FROM asterisk_plus_salt_job
+                WHERE id = %s AND state = 'queued' AND jid IS NULL
+                FOR UPDATE SKIP LOCKED
+            """, (job.id,))
+            if not self.env.cr.fetchone():
+                continue
+            try:
+                ret = job.server._salt_call(
+                    [k['fun'] for k in json.loads(job.calls)]
+                    if job.calls else job.fun,
+                    arg=json.loads(job.arg) if job.arg else None,
+                    kwarg=json.loads(job.kwarg) if job.kwarg else None,
+                    timeout=job.timeout or None)
+                job.write({
+                    'jid': ret['return'][0]['jid'],
+                    'state': 'pending',
+                    'sent_date': fields.Datetime.now(),
+                    'arg': False,
+                    'kwarg': False,
+                })
+            except SaltApiConnectionError as e:
+                job._retry_later(e)
+                self.env.cr.commit()
+                break
+            except Exception as e:
+                job._fail(e)
+            self.env.cr.commit()
+
+    def _retry_later(self, error):
+        self.ensure_one()
+        if self.attempts + 1 >= QUEUE_MAX_ATTEMPTS:
+            return self._fail(error)
+        delay = min(QUEUE_RETRY_DELAY * 2 ** self.attempts, QUEUE_MAX_DELAY)
+        logger.info('Salt job %s send error, retry in %s seconds: %s',
+                    self.fun, delay, error)
+        self.write({
+            'attempts': self.attempts + 1,
+            'next_try': datetime.utcnow() + timedelta(seconds=delay),
+            'ret': str(error),
+        })
+
+    def _fail(self, error):
+        self.ensure_one()
+        logger.warning('Salt job %s send error: %s', self.fun, error)
+        self.write({'state': 'failed', 'ret': str(error)})
+        self.env['res.users'].asterisk_plus_notify(
+            '{}: {}'.format(self.fun, error),
+            uid=self.res_notify_uid or self.create_uid.id,
+            warning=True)
+
+    @api.model
+    def process_queue(self, limit=100):
+        """Cron job to send the queued jobs that are due.
+        """
+        self.env.cr.execute("""
+            SELECT id FROM asterisk_plus_salt_job
+            WHERE state = 'queued' AND jid IS NULL AND next_try <= %s
+            ORDER BY id LIMIT %s
+        """, (datetime.utcnow(), limit))
+        self.browse([k[0] for k in self.env.cr.fetchall()])._send()
+
+    @api.model
+    def get_queue_depth(self, server_id=None):
+        """Returns the number of jobs waiting to be sent.
+        """
+        domain = [('state', '=', 'queued')]
+        if server_id:
+            domain.append(('server', '=', server_id))
+        return self.sudo().search_count(domain)
 
     @api.model
     def returner(self, ret):
@@ -32,32 +203,195 @@ class SaltJob(models.Model):
             'success': True}
         """
         job = self.sudo().search([('jid', '=', ret['jid'])])
+        if not job and not self.env.context.get('returner_retry'):
+            # The job ID is saved right after the job is sent so the return
+            # can come first. Look for it in new transactions.
+            for _ in range(RETURNER_RETRIES):
+                time.sleep(RETURNER_RETRY_DELAY)
+                with self.pool.cursor() as cr:
+                    jobs = self.with_env(self.env(cr=cr)).with_context(
+                        returner_retry=True)
+                    if jobs.sudo().search_count([('jid', '=', ret['jid'])]):
+                        return jobs.returner(ret)
         if not job:
             logger.error('NO JOB FOUND FOR JID: %s', ret['jid'])
             return '{}: NOT FOUND'.format(ret['jid'])
+        return job._handle_return(ret)
+
+    @api.model
+    def returner_batch(self, rets):
+        """Called by Salt returner with a list of returns.
+        Jobs are found by one query and returns are handled in order, every
+        one in a savepoint so a failed return does not affect the others.
+        Returns a dict of jid: result.
+        """
+        jids = [ret['jid'] for ret in rets]
+        jobs = {job.jid: job for job in self.sudo().search(
+            [('jid', 'in', jids)])}
+        if len(jobs) < len(set(jids)) and not self.env.context.get(
+                'returner_retry'):
+            # Job IDs can be saved after the returns have come, this
+            # transaction does not see them so handle the batch in a new one.
+            for attempt in range(RETURNER_RETRIES):
+                time.sleep(RETURNER_RETRY_DELAY)
+                with self.pool.cursor() as cr:
+                    batch = self.with_env(self.env(cr=cr)).with_context(
+                        returner_retry=True)
+                    found = batch.sudo().search_count([('jid', 'in', jids)])
+                    if found == len(set(jids)) or \
+                            attempt == RETURNER_RETRIES - 1:
+                        return batch.returner_batch(rets)
+        results = {}
+        for ret in rets:
+            job = jobs.get(ret['jid'])
+            if not job:
+                logger.error('NO JOB FOUND FOR JID: %s', ret['jid'])
+                results[ret['jid']] = '{}: NOT FOUND'.format(ret['jid'])
+                continue
+            try:
+                with self.env.cr.savepoint():
+                    results[ret['jid']] = job._handle_return(ret)
+            except Exception as e:
+                logger.exception('Salt job %s return error:', ret['jid'])
+                self.invalidate_cache()
+                results[ret['jid']] = '{}: {}'.format(ret['jid'], e)
+        return results
+
+    def _handle_return(self, ret):
+        """Save the return of the job and pass it to the callback in a
+        savepoint. The job is failed with the error if the callback fails.
+        """
+        job = self
         # Suppress file contents logging
         if ret.get('success', False) and job.fun in ['asterisk.get_file',
                 'asterisk.get_config',
                 'asterisk.get_all_configs']:
-            debug(self, '{}: {}'.format(ret['jid'], list(ret['return'].keys())))
+            debug(self, '{}: {}', ret['jid'], list(ret['return'].keys()))
+        else:
+            debug(self, '{}: {}', ret['jid'], ret['return'])
+        now = fields.Datetime.now()
+        job.write({
+            'state': 'done' if ret.get('success', False) else 'failed',
+            'success': ret.get('success', False),
+            'return_date': now,
+            'latency': (now - job.sent_date).total_seconds()
+            if job.sent_date else False,
+        })
+        if job.handle:
+            job.ret = json.dumps(ret['return'], default=str)
+        # The state is kept when the callback fails.
+        try:
+            with self.env.cr.savepoint():
+                if job.calls:
+                    return job._handle_calls_return(ret)
+                res = self._dispatch_return(
+                    ret['fun'], ret['return'], ret.get('success', False),
+                    job.res_model, job.res_method, job.res_notify_uid,
+                    json.loads(job.pass_back) if job.pass_back else None)
+        except Exception as e:
+            logger.exception('Salt job %s callback error:', job.jid)
+            self.invalidate_cache()
+            job.write({'state': 'failed', 'ret': str(e)})
+            return '{}: {}'.format(job.jid, e)
+        if job.res_model and job.res_method:
+            return '{} {}: {}'.format(job.jid, job.res_method, res)
         else:
-            debug(self, '{}: {}'.format(ret['jid'], ret['return']))
+            return '{} return'.format(job.jid)
+
+    def _handle_calls_return(self, ret):
+        """Route the return of a compound job to the callbacks of its calls.
+
+        Minions with multifunc_ordered return a list in the order of calls,
+        otherwise returns are keyed by function name, see local_jobs. The
+        return shape updates multifunc_ordered of the server.
+        """
+        returns = ret['return']
+        calls = json.loads(self.calls)
+        funs = [k['fun'] for k in calls]
+        if isinstance(returns, (list, dict)) and \
+                self.server.multifunc_ordered != isinstance(returns, list):
+            logger.info('Server %s multifunc_ordered: %s.', self.server.name,
+                        isinstance(returns, list))
+            self.server.multifunc_ordered = isinstance(returns, list)
+        results, errors = [], []
+        for pos, call in enumerate(calls):
+            if isinstance(returns, list):
+                value = returns[pos] if pos < len(returns) else None
+            elif isinstance(returns, dict) and funs.count(call['fun']) > 1:
+                # Only the last return of a repeated function is kept.
+                value = 'Ambiguous return, set multifunc_ordered: True in ' \
+                    'the minion config.'
+            elif isinstance(returns, dict):
+                value = returns.get(call['fun'])
+            else:
+                # The job has failed as a whole.
+                value = returns
+            try:
+                with self.env.cr.savepoint():
+                    results.append(self._dispatch_return(
+                        call['fun'], value, ret.get('success', False),
+                        call.get('res_model'), call.get('res_method'),
+                        call.get('res_notify_uid'), call.get('pass_back')))
+            except Exception as e:
+                logger.exception('Salt job %s %s return error:',
+                                 self.jid, call['fun'])
+                self.invalidate_cache()
+                results.append(str(e))
+                errors.append('{}: {}'.format(call['fun'], e))
+        if errors:
+            self.write({'state': 'failed', 'ret': '\n'.join(errors)})
+        return '{} return: {}'.format(self.jid, results)
+
+    @api.model
+    def _dispatch_return(self, fun, value, success, res_model, res_method,
+                         res_notify_uid, pass_back):
         # Check if return shoud be sent in notification box.
-        if job.res_notify_uid:
-            if ret.get('success', False):
+        if res_notify_uid:
+            if success:
                 self.env['res.users'].asterisk_plus_notify(
-                    '{}: {}'.format(ret['fun'], ret['return'] or 'OK'),
-                    uid=job.res_notify_uid)
+                    '{}: {}'.format(fun, value or 'OK'),
+                    uid=res_notify_uid)
             else:
                 self.env.user.asterisk_plus_notify(
-                    '{}: {}'.format(ret['fun'], ret['return'] or 'FAIL'),
-                    uid=job.res_notify_uid,
+                    '{}: {}'.format(fun, value or 'FAIL'),
+                    uid=res_notify_uid,
                     warning=True)
 
         # Check if return is sent to callback method.
-        if job.res_model and job.res_method:
-            method = getattr(self.env[job.res_model], job.res_method)
-            res = method(ret['return'], json.loads(job.pass_back) if job.pass_back else None)
-            return '{} {}: {}'.format(job.jid, job.res_method, res)
-        else:
-            return '{} return'.format(job.jid)
+        if res_model and res_method:
+            method = getattr(self.env[res_model], res_method)
+            return method(value, pass_back)
+
+    def _get_result(self):
+        self.ensure_one()
+        result = {'state': self.state, 'return': None}
+        if self.state not in ('queued', 'pending') and self.ret:
+            try:
+                result['return'] = json.loads(self.ret)
+            except ValueError:
+                # Send errors are saved as text.
+                result['return'] = self.ret
+        return result
+
+    @api.model
+    def vacuum(self, hours, expire_minutes=10):
+        """Cron job to expire jobs without return and to delete old jobs.
+        """
+        now = datetime.utcnow()
+        self.env.cr.execute("""
+            UPDATE asterisk_plus_salt_job SET state = 'expired'
+            WHERE state = 'pending' AND
+                COALESCE(sent_date, create_date) +
+                GREATEST(COALESCE(timeout, 0), %s * 60) * interval '1 second'
+                <= %s
+            RETURNING fun
+        """, (expire_minutes, now))
+        expired = [k[0] for k in self.env.cr.fetchall()]
+        if expired:
+            logger.warning('Expired %s Salt jobs without return: %s',
+                           len(expired), ', '.join(sorted(set(expired))))
+        self.env.cr.execute("""
+            DELETE FROM asterisk_plus_salt_job
+            WHERE state NOT IN ('queued', 'pending') AND create_date <= %s
+        """, (now - timedelta(hours=hours),))
+        self.invalidate_cache()
@@ -77,7 +77,8 @@ class AccessList(models.Model):
             server.local_job(
                 fun='asterisk.update_access_rules',
                 arg=[rules],
-                res_notify_uid=self.env.uid)
+                res_notify_uid=self.env.uid,
+                merge_key='asterisk.update_access_rules')
 
 
 class Ban(models.Model):
@@ -2,21 +2,186 @@
 # -*- coding: utf-8 -*-
 import base64
 from datetime import datetime
+import html
 import json
 import logging
+import threading
 import time
 import urllib
 import uuid
+import requests
 import yaml
-from odoo import api, models, fields, SUPERUSER_ID, registry, release, tools, _
+from odoo import api, models, fields, SUPERUSER_ID, registry, tools, _
 from odoo.exceptions import ValidationError
 import pepper
+from .ami import AMI_DIRECT_ACTIONS, AmiNotSentError, get_ami_pool
 from .settings import debug
+from .view_update import merge_view_delta, schedule_view_update
 from .res_partner import strip_number, format_number
 
 logger = logging.getLogger(__name__)
 
 
+#: Salt API clients of the process by (dbname, url, user, password).
+SALTAPI_CLIENTS = {}
+SALTAPI_CLIENTS_LOCK = threading.Lock()
+#: Seconds before token expiration to login again.
+SALTAPI_TOKEN_RENEW = 60
+#: Salt API connect and read timeouts in seconds.
+SALTAPI_CONNECT_TIMEOUT = 3
+SALTAPI_READ_TIMEOUT = 30
+#: Failures in a row to open the circuit and seconds to keep it open.
+SALTAPI_BREAKER_THRESHOLD = 3
+SALTAPI_BREAKER_RESET = 30
+
+
+class SaltApiUnavailable(pepper.exceptions.PepperException):
+    """Raised without a request while the circuit is open."""
+
+
+class SaltApiConnectionError(ValidationError):
+    """Salt API cannot be reached, the job can be sent later."""
+
+
+class SaltApiClient(pepper.Pepper):
+    """Pepper client keeping HTTP connections alive between requests.
+
+    Every thread gets its own requests session, the login token is shared.
+    Errors are raised the same way as pepper does.
+
+    Requests go through a circuit breaker. After SALTAPI_BREAKER_THRESHOLD
+    connection errors in a row the circuit opens and requests fail at once.
+    After SALTAPI_BREAKER_RESET seconds one request is let through to probe
+    the Salt API (half open) and its result closes or opens the circuit.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(SaltApiClient, self).__init__(*args, **kwargs)
+        self.login_lock = threading.Lock()
+        self.local_data = threading.local()
+        self.breaker_lock = threading.Lock()
+        self.breaker_state = 'closed'
+        self.failures = 0
+        self.opened_at = 0
+        self.last_error = None
+
+    @property
+    def session(self):
+        if not hasattr(self.local_data, 'session'):
+            self.local_data.session = requests.Session()
+        return self.local_data.session
+
+    def token_expired(self):
+        return self.auth.get('expire', 0) - SALTAPI_TOKEN_RENEW < time.time()
+
+    def breaker_enter(self):
+        with self.breaker_lock:
+            if self.breaker_state == 'closed':
+                return
+            if self.breaker_state == 'open' and \
+                    time.monotonic() - self.opened_at >= SALTAPI_BREAKER_RESET:
+                # Let this request probe the Salt API, others still fail.
+                self.breaker_state = 'half_open'
+                return
+            raise SaltApiUnavailable(
+                'Salt API is not available: {}'.format(self.last_error))
+
+    def breaker_success(self):
+        with self.breaker_lock:
+            if self.breaker_state != 'closed':
+                logger.info('Salt API is available again.')
+            self.breaker_state = 'closed'
+            self.failures = 0
+
+    def breaker_failure(self, error):
+        with self.breaker_lock:
+            self.failures += 1
+            self.last_error = str(error)
+            if self.breaker_state == 'half_open' or \
+                    self.failures >= SALTAPI_BREAKER_THRESHOLD:
+                if self.breaker_state != 'open':
+                    logger.warning('Salt API circuit open: %s', error)
+                self.breaker_state = 'open'
+                self.opened_at = time.monotonic()
+
+    def req(self, path, data=None):
+        headers = {
+            'Accept': 'application/json',
+            'Content-Type': 'application/json',
+            'X-Requested-With': 'XMLHttpRequest',
+        }
+        if path != '/run' and self.auth and self.auth.get('token'):
+            headers['X-Auth-Token'] = self.auth['token']
+        url = self._construct_url(path)
+        self.breaker_enter()
+        try:
+            resp = self.session.post(
+                url, headers=headers,
+                data=json.dumps(data) if data is not None else None,
+                verify=self._ssl_verify is True,
+                timeout=(SALTAPI_CONNECT_TIMEOUT, getattr(
+                    self.local_data, 'read_timeout', SALTAPI_READ_TIMEOUT)))
+        except requests.exceptions.RequestException as e:
+            self.breaker_failure(e)
+            raise urllib.error.URLError(e)
+        if resp.status_code >= 500:
+            self.breaker_failure('HTTP {} {}'.format(
+                resp.status_code, resp.reason))
+        else:
+            self.breaker_success()
+        if resp.status_code == 401:
+            raise pepper.exceptions.PepperException('Authentication denied')
+        if resp.status_code == 500:
+            raise pepper.exceptions.PepperException('Server error.')
+        if resp.status_code >= 400:
+            raise urllib.error.HTTPError(
+                url, resp.status_code, resp.reason, resp.headers, None)
+        try:
+            return resp.json()
+        except ValueError:
+            raise pepper.exceptions.PepperException(
+                'Unable to parse the server response.')
+
+
+def send_ami_actions(dbname, server_id, pool, actions):
+    """Send actions over the direct AMI connection after commit.
+    Actions are passed to Salt only when nothing was written to AMI, once
+    written their failures are reported as error responses.
+    """
+    results, failed = [], []
+    try:
+        # Actions are pipelined over one connection.
+        results = list(zip(actions, pool.send_many(
+            [k['action'] for k in actions],
+            timeout=max(k['timeout'] for k in actions))))
+    except AmiNotSentError as e:
+        logger.warning('Direct AMI error, sending %s actions to Salt: %s',
+                       len(actions), e)
+        failed = actions
+    except Exception as e:
+        logger.exception('Direct AMI error:')
+        results = [(k, [{'Response': 'Error', 'Message': str(e),
+                         'content': ''}]) for k in actions]
+    try:
+        with registry(dbname).cursor() as cr:
+            env = api.Environment(cr, SUPERUSER_ID, {})
+            server = env['asterisk_plus.server'].browse(server_id)
+            for item, result in results:
+                try:
+                    with cr.savepoint():
+                        server.with_user(server.user)._ami_action_result(
+                            item, result)
+                except Exception:
+                    logger.exception('Direct AMI action result error:')
+            if failed:
+                server.with_user(failed[0]['uid']).with_context(
+                    ami_direct=False).ami_actions(
+                    [dict(k['kwargs'], action=k['action']) for k in failed],
+                    timeout=max(k['timeout'] for k in failed))
+    except Exception:
+        logger.exception('Direct AMI actions error:')
+
+
 def get_default_server(rec):
     try:
         return rec.env.ref('asterisk_plus.default_server')
@@ -70,6 +235,29 @@ class Server(models.Model):
         help="""OdooPBX agent websocket provided by asterisk_cli.py engine'
                 Must be reachable from your web browser""")
     console_auth_token = fields.Char()
+    #: Salt API circuit breaker state in this Odoo process.
+    saltapi_status = fields.Selection([
+        ('unknown', 'Not connected yet'),
+        ('closed', 'Available'),
+        ('half_open', 'Probing'),
+        ('open', 'Not available')], compute='_get_saltapi_status',
+        string='Salt API')
+    saltapi_error = fields.Char(compute='_get_saltapi_status',
+                                string='Salt API Error')
+    salt_queue_depth = fields.Integer(compute='_get_salt_queue_depth',
+                                      string='Queued Jobs')
+    #: Minion has multifunc_ordered set so compound jobs return a list.
+    multifunc_ordered = fields.Boolean(
+        string='Ordered Compound Jobs',
+        help='Set multifunc_ordered: True in the minion config to send '
+             'repeated functions like AMI actions in one job. Updated from '
+             'compound job returns.')
+    #: Send Originate, Ping and Reload actions directly to AMI.
+    ami_direct = fields.Boolean(string='Direct AMI')
+    ami_host = fields.Char(string='AMI Host')
+    ami_port = fields.Integer(string='AMI Port', default=5038)
+    ami_login = fields.Char(string='AMI Login')
+    ami_password = fields.Char(string='AMI Password')
 
     _sql_constraints = [
         ('user_unique', 'UNIQUE("user")', 'This user is already used for another server!'),
@@ -103,57 +291,66 @@ class Server(models.Model):
                 pass
         return 'set_minion_data done'
 
+    @api.model
+    def _get_saltapi_key(self):
+        get_param = self.env['asterisk_plus.settings'].sudo().get_param
+        return (self.env.cr.dbname, get_param('saltapi_url'),
+                get_param('saltapi_user'), get_param('saltapi_passwd'))
+
+    def _get_saltapi_status(self):
+        saltapi = SALTAPI_CLIENTS.get(self._get_saltapi_key())
+        for rec in self:
+            if not saltapi:
+                rec.saltapi_status = 'unknown'
+                rec.saltapi_error = False
+            else:
+                rec.saltapi_status = saltapi.breaker_state
+                rec.saltapi_error = saltapi.last_error if \
+                    saltapi.breaker_state != 'closed' else False
+
+    def _get_salt_queue_depth(self):
+        for rec in self:
+            rec.salt_queue_depth = self.env[
+                'asterisk_plus.salt_job'].get_queue_depth(rec.id)
+
     @api.model
     def _get_saltapi(self, force_login=False):
         """Get Salt API pepper instance.
-        TODO: Cache auth in ORM cache not ir.config_parameter.
+
+        Clients are kept in the process with the login token in memory.
+        When the token expires only one thread logs in again.
+
         Returns:
             A connected pepper instance. See `libpepper.py <https://github.com/saltstack/pepper/blob/develop/pepper/libpepper.py>`__ for details.
         """
-        get_param = self.env['asterisk_plus.settings'].sudo().get_param
-        saltapi = pepper.Pepper(get_param('saltapi_url'))
-        # Get saltapi auth params
-        auth = self.env[
-            'ir.config_parameter'].sudo().get_param('saltapi_auth')
-        # Check if we already logged in.
-        if not force_login and auth:
-            # Convert into dictionary.
-            try:
-                auth = json.loads(auth)
-            except json.decoder.JSONDecodeError as e:
-                logger.error('Auth token error: %s: %s', auth, e)
-                auth = {'expire': 0}
-            if auth['expire'] - time.time() < 0:
-                # Token is no longer valid so need to login.
-                logger.info('SALT API LOGIN AS TOKEN IS EXPIRED.')
-                saltapi.login(
-                    get_param('saltapi_user'),
-                    get_param('saltapi_passwd'),
-                    'file',
-                )
-                # Update auth data.
-                self.env['ir.config_parameter'].sudo().set_param(
-                    'saltapi_auth', json.dumps(saltapi.auth))
-            else:
-                # Token not expired, take it.
-                saltapi.auth = auth
-        else:
-            # Token is no longer valid so need to login.
-            logger.info('SALT API LOGIN.')
-            saltapi.login(
-                get_param('saltapi_user'),
-                get_param('saltapi_passwd'),
-                'file',
-            )
-            self.env['ir.config_parameter'].set_param(
-                'saltapi_auth', json.dumps(saltapi.auth))
+        key = self._get_saltapi_key()
+        dbname, url, user, passwd = key
+        with SALTAPI_CLIENTS_LOCK:
+            saltapi = SALTAPI_CLIENTS.get(key)
+            if not saltapi:
+                saltapi = SALTAPI_CLIENTS[key] = SaltApiClient(url)
+        if force_login or saltapi.token_expired():
+            token = saltapi.auth.get('token')
+            with saltapi.login_lock:
+                # Other thread could login while we were waiting.
+                if saltapi.token_expired() or (
+                        force_login and saltapi.auth.get('token') == token):
+                    logger.info('SALT API LOGIN.')
+                    saltapi.login(user, passwd, 'file')
         return saltapi
 
     def local_job(self, fun, arg=None, kwarg=None, timeout=None,
                   res_model=None, res_method=None, res_notify_uid=None,
-                  pass_back=None, sync=False):
+                  pass_back=None, sync=False, awaitable=False,
+                  merge_key=None):
         """Execute a function on Salt minion.
 
+        Async jobs are registered in the current transaction and sent to
+        Salt after it is committed, so the caller's transaction is never
+        committed here and the returner always finds the job. Jobs that
+        cannot be sent because Salt API is not reachable stay queued and are
+        retried by the cron.
+
         Args:
             fun (str): function name. Example: test.ping.
             arg (list): positional arguments.
@@ -163,18 +360,151 @@ class Server(models.Model):
             res_method (str): name of the method to receive function result. Function result is passed as the 1-st paramater.
             res_notify_uid (int): User ID that will receive function result in notification message.
             pass_back (dict): json serializable dictionary that is passed to res_method as the 2-nd paramater.
+            sync (bool): wait for the function result. Blocks the worker, use awaitable instead.
+            awaitable (bool): keep the function result to be polled by the job handle.
+            merge_key (str): a queued job with the same key gets the new arguments instead of a new job.
+
+        Returns:
+            Salt API return for sync jobs, asterisk_plus.salt_job record otherwise.
+            The job handle is in its handle field when awaitable is set.
+        """
+        self.ensure_one()
+        if sync:
+            return self._salt_call(fun, arg=arg, kwarg=kwarg, timeout=timeout,
+                                   sync=True)
+        vals = {
+            'fun': fun,
+            'arg': json.dumps(arg) if arg is not None else False,
+            'kwarg': json.dumps(kwarg) if kwarg is not None else False,
+            'timeout': timeout,
+            'res_model': res_model,
+            'res_method': res_method,
+            'res_notify_uid': res_notify_uid,
+            'pass_back': json.dumps(pass_back) if pass_back else False,
+        }
+        job = self._merge_job(merge_key, vals) if merge_key and \
+            not awaitable else None
+        if job:
+            job._send_after_commit()
+            return job
+        job = self.env['asterisk_plus.salt_job'].sudo().create(dict(
+            vals, server=self.id, merge_key=merge_key,
+            handle=uuid.uuid4().hex if awaitable else False))
+        job._send_after_commit()
+        return job
+
+    def local_jobs(self, calls, timeout=None, awaitable=False):
+        """Execute several functions on Salt minion in compound jobs.
+
+        With multifunc_ordered the minion returns a list in the order of
+        calls and all calls go in one job. Otherwise Salt keys the return by
+        function name, so calls are split in order into compound jobs of
+        distinct functions, a call left alone is sent as a plain job.
+
+        Args:
+            calls (list): dicts with fun, arg, kwarg, res_model, res_method, res_notify_uid and pass_back keys as in local_job.
+            timeout (int): job execution timeout in seconds.
+            awaitable (bool): keep the job result to be polled by the job handle.
+
+        Returns:
+            asterisk_plus.salt_job records. Every call result is passed to its res_method.
+        """
+        self.ensure_one()
+        chunks = []
+        for call in calls:
+            if not chunks or not self.multifunc_ordered and \
+                    call['fun'] in {k['fun'] for k in chunks[-1]}:
+                chunks.append([])
+            chunks[-1].append(call)
+        jobs = self.env['asterisk_plus.salt_job']
+        for chunk in chunks:
+            if len(chunk) == 1:
+                call = chunk[0]
+                jobs |= self.local_job(
+                    call['fun'], arg=call.get('arg'), kwarg=call.get('kwarg'),
+                    timeout=timeout, res_model=call.get('res_model'),
+                    res_method=call.get('res_method'),
+                    res_notify_uid=call.get('res_notify_uid'),
+                    pass_back=call.get('pass_back'), awaitable=awaitable)
+            else:
+                jobs |= self._compound_job(chunk, timeout, awaitable)
+        return jobs
+
+    def _compound_job(self, calls, timeout, awaitable):
+        """Register one compound job of calls with distinct functions.
+        """
+        args = []
+        for call in calls:
+            arg = call.get('arg')
+            if arg is None:
+                arg = []
+            elif not isinstance(arg, (list, tuple)):
+                arg = [arg]
+            else:
+                arg = list(arg)
+            # Compound jobs pass named arguments inline.
+            if call.get('kwarg'):
+                arg.append(dict(call['kwarg'], __kwarg__=True))
+            args.append(arg)
+        job = self.env['asterisk_plus.salt_job'].sudo().create({
+            'server': self.id,
+            'fun': ','.join(k['fun'] for k in calls),
+            'arg': json.dumps(args),
+            'timeout': timeout,
+            'calls': json.dumps([{
+                'fun': k['fun'],
+                'res_model': k.get('res_model'),
+                'res_method': k.get('res_method'),
+                'res_notify_uid': k.get('res_notify_uid'),
+                'pass_back': k.get('pass_back'),
+            } for k in calls]),
+            'handle': uuid.uuid4().hex if awaitable else False,
+        })
+        job._send_after_commit()
+        return job
+
+    def _merge_job(self, merge_key, vals):
+        """Update the queued job with the same merge key and return it.
+        """
+        job = self.env['asterisk_plus.salt_job'].sudo().search([
+            ('server', '=', self.id), ('merge_key', '=', merge_key),
+            ('state', '=', 'queued')], order='id desc', limit=1)
+        if not job:
+            return None
+        # The job could be being sent now.
+        self.env.cr.execute("""
+            SELECT id FROM asterisk_plus_salt_job
+            WHERE id = %s AND state = 'queued' FOR UPDATE SKIP LOCKED
+        """, (job.id,))
+        if not self.env.cr.fetchone():
+            return None
+        debug(self, 'Merge {} into job {}', merge_key, job.id)
+        job.write(vals)
+        return job
+
+    def _salt_call(self, fun, arg=None, kwarg=None, timeout=None, sync=False):
+        """Call Salt API and return its response.
+        Async calls return the job ID: {'return': [{'jid': '20210928122846179815', 'minions': ['asterisk']}]}
         """
         try:
             saltapi = self.sudo()._get_saltapi()
+        except SaltApiUnavailable as e:
+            raise SaltApiConnectionError(str(e))
         except urllib.error.URLError:
-            raise ValidationError('Cannot connect to Salt API process.')
+            raise SaltApiConnectionError('Cannot connect to Salt API process.')
         except pepper.exceptions.PepperException as e:
             raise ValidationError('Salt API lib error: {}'.format(e))
         # Wrap calling function to be able to re-login on session expiration.
         def call_fun():
             if sync:
-                ret = saltapi.local(tgt=self.server_id, fun=fun, arg=arg,
-                                    kwarg=kwarg, timeout=timeout)
+                # Wait for the function a bit longer than its timeout.
+                saltapi.local_data.read_timeout = max(
+                    SALTAPI_READ_TIMEOUT, (timeout or 0) + 5)
+                try:
+                    ret = saltapi.local(tgt=self.server_id, fun=fun, arg=arg,
+                                        kwarg=kwarg, timeout=timeout)
+                finally:
+                    del saltapi.local_data.read_timeout
             else:
                 ret = saltapi.local_async(tgt=self.server_id, fun=fun, arg=arg,
                     kwarg=kwarg, timeout=timeout, ret='odoo')
@@ -182,38 +512,26 @@ class Server(models.Model):
                     _ = ret['return'][0]['jid']
                 except:
                     raise ValidationError('Empty return. Check Minion ID! {}'.format(ret))
-                self.env['asterisk_plus.salt_job'].sudo().create({
-                    'fun': fun,
-                    'jid': ret['return'][0]['jid'],
-                    'res_model': res_model,
-                    'res_method': res_method,
-                    'res_notify_uid': res_notify_uid,
-                    'pass_back': json.dumps(pass_back) if pass_back else False,
-                })
-                if not self.env.context.get('no_commit'):
-                    # Commit ASAP so that returner can find the job.
-                    # TODO: Move the above to separate transation not to commit the current one.
-                    self.env.cr.commit()
                 # Debug
                 if fun in ['asterisk.put_config', 'asterisk.put_prompt']:
-                    debug(self, '{} {} jid: {}'.format(
-                          fun, arg[0], ret["return"][0]["jid"]))
+                    debug(self, '{} {} jid: {}',
+                          fun, arg[0], ret["return"][0]["jid"])
                 elif fun == 'asterisk.put_all_configs':
-                    debug(self, '{} {} jid: {}'.format(
-                        fun, list(arg[0].keys()), ret["return"][0]["jid"]))
+                    debug(self, '{} {} jid: {}',
+                        fun, list(arg[0].keys()), ret["return"][0]["jid"])
                 else:
-                    debug(self, '{} {} {} jid: {}'.format(
-                          fun, arg, kwarg, ret["return"][0]["jid"]))
-            # TODO: Add server:
-            # {'return': [{'jid': '20210928122846179815', 'minions': ['asterisk']}]}
+                    debug(self, '{} {} {} jid: {}',
+                          fun, arg, kwarg, ret["return"][0]["jid"])
             # TODO: When minion is not accepted it raises error.
             return ret
         try:
             return call_fun()
         except ConnectionResetError:
-            raise ValidationError('Salt API connection reset! Check HTTP/HTTPS settings.')
+            raise SaltApiConnectionError('Salt API connection reset! Check HTTP/HTTPS settings.')
         except urllib.error.URLError:
-            raise ValidationError('Salt API connection error!')
+            raise SaltApiConnectionError('Salt API connection error!')
+        except SaltApiUnavailable as e:
+            raise SaltApiConnectionError(str(e))
         #except pepper.ServerError ?? TODO: catch when master is done.
         #    raise ValidationError('Salt Master connection error!')
         except pepper.exceptions.PepperException as e:
@@ -224,6 +542,8 @@ class Server(models.Model):
                 except Exception as e:
                     raise ValidationError('Salt API error: {}'.format(e))
                 return call_fun()
+            elif 'Server error.' in str(e):
+                raise SaltApiConnectionError('Salt API server error!')
             else:
                 raise
 
@@ -249,6 +569,9 @@ class Server(models.Model):
             [{'Response': 'Success', 'ActionID': 'action/67cfd99b-8138-4cb5-9473-4e8be6d1cbe9/1/5026', 'Ping': 'Pong', 'Timestamp': '1631707333.341870', 'content': ''}]        
 
         """
+        if self._ami_direct_enabled(action, no_wait, as_list, kwargs):
+            self._ami_direct_after_commit(action, timeout, kwargs)
+            return True
         return self.local_job(
             fun='asterisk.manager_action',
             arg=action,
@@ -258,6 +581,76 @@ class Server(models.Model):
                 'as_list': as_list
             }, **kwargs)
 
+    def ami_actions(self, actions, timeout=5, **kwargs):
+        """Send several AMI actions to the server in one round trip.
+
+        Args:
+            actions (list): dicts with the action in 'action' key and
+                optional res_model, res_method, res_notify_uid and pass_back
+                keys to receive the action result as in local_job.
+            kwargs: default res_model, res_method and res_notify_uid.
+
+        Returns:
+            asterisk_plus.salt_job record or True if sent directly to AMI.
+        """
+        self.ensure_one()
+        items = []
+        for item in actions:
+            item = dict(item)
+            action = item.pop('action')
+            items.append((action, dict(kwargs, **item)))
+        if all(self._ami_direct_enabled(action, False, None, item)
+               for action, item in items):
+            for action, item in items:
+                self._ami_direct_after_commit(action, timeout, item)
+            return True
+        return self.local_jobs([dict(
+            item, fun='asterisk.manager_action', arg=action,
+            kwarg={'timeout': timeout, 'no_wait': False, 'as_list': None})
+            for action, item in items])
+
+    def _ami_direct_enabled(self, action, no_wait, as_list, kwargs):
+        return self.ami_direct and self.ami_host and \
+            self.env.context.get('ami_direct', True) and \
+            action.get('Action') in AMI_DIRECT_ACTIONS and \
+            not (no_wait or as_list or kwargs.get('sync') or
+                 kwargs.get('awaitable'))
+
+    def _ami_direct_after_commit(self, action, timeout, kwargs):
+        """Send the action directly to AMI after the transaction is committed.
+        """
+        self.ensure_one()
+        key = 'asterisk_plus.ami_direct.{}'.format(self.id)
+        queue = self.env.cr.postcommit.data.setdefault(key, [])
+        if not queue:
+            dbname = self.env.cr.dbname
+            pool = get_ami_pool(
+                (dbname, self.id, self.ami_host, self.ami_port,
+                 self.ami_login, self.ami_password),
+                self.ami_host, self.ami_port, self.ami_login,
+                self.ami_password)
+            server_id = self.id
+            self.env.cr.postcommit.add(
+                lambda: send_ami_actions(dbname, server_id, pool, queue))
+        queue.append({'action': action, 'timeout': timeout,
+                      'kwargs': kwargs, 'uid': self.env.uid})
+
+    def _ami_action_result(self, item, result):
+        """Pass the direct AMI action result as the Salt returner does.
+        """
+        kwargs = item['kwargs']
+        debug(self, 'Direct AMI {}: {}', item['action'].get('Action'), result)
+        notify_uid = kwargs.get('res_notify_uid')
+        if notify_uid:
+            self.env['res.users'].asterisk_plus_notify(
+                'asterisk.manager_action: {}'.format(result),
+                uid=notify_uid,
+                warning=result[0].get('Response') == 'Error')
+        if kwargs.get('res_model') and kwargs.get('res_method'):
+            method = getattr(self.env[kwargs['res_model']],
+                             kwargs['res_method'])
+            method(result, kwargs.get('pass_back'))
+
     ##################### UI BUTTONS ==========================================
 
     def asterisk_ping(self):
@@ -285,7 +678,7 @@ class Server(models.Model):
           Args:
             number (str): Number to dial.
         """
-        debug(self, '{} {} {} {}'.format(number, model, res_id, user))
+        debug(self, '{} {} {} {}', number, model, res_id, user)
         if not user:
             user = self.env.user
         if not user.asterisk_users:
@@ -306,6 +699,7 @@ class Server(models.Model):
         originate_timeout = float(self.env[
             'asterisk_plus.settings'].sudo().get_param('originate_timeout'))
 
+        originate_actions = {}
         for asterisk_user in self.env.user.asterisk_users:
             if not asterisk_user.channels:
                 raise ValidationError('SIP channels not defined for user!')
@@ -365,8 +759,6 @@ class Server(models.Model):
                         'linkedid': other_channel_id,
                         'is_active': True,
                 })
-                if not self.env.context.get('no_commit'):
-                    self.env.cr.commit()
                 action = {
                     'Action': 'Originate',
                     'Context': ch.originate_context,
@@ -381,10 +773,14 @@ class Server(models.Model):
                     'OtherChannelId': other_channel_id,
                     'Variable': channel_vars,
                 }
-                ch.server.ami_action(action, res_model='asterisk_plus.server',
-                                     res_method='originate_call_response',
-                                     pass_back={'uid': self.env.user.id,
-                                                'channel_id': channel_id})
+                originate_actions.setdefault(ch.server, []).append({
+                    'action': action,
+                    'pass_back': {'uid': self.env.user.id,
+                                  'channel_id': channel_id}})
+        # Ring all channels of every server in one round trip.
+        for server, actions in originate_actions.items():
+            server.ami_actions(actions, res_model='asterisk_plus.server',
+                               res_method='originate_call_response')
 
     @api.model
     def originate_call_response(self, data, pass_back):
@@ -400,24 +796,35 @@ class Server(models.Model):
                 uid=pass_back['uid'],
                 warning=True)
 
-    @api.onchange('custom_command')
     def send_custom_command(self):
+        self.ensure_one()
         try:
-            cmd_line = self.custom_command.split(' ')
+            cmd_line = (self.custom_command or '').split()
             cmd, params_list = cmd_line[0], cmd_line[1:]
             kwarg = {}
             for param_val in params_list:
                 param, val = param_val.split('=')
                 kwarg[param] = val
-            res = self.local_job(fun=cmd, kwarg=kwarg, sync=True)
-            ret = res['return'][0][self.server_id]
-            if isinstance(ret, str):
-                pass
-            else:
-                ret = yaml.dump(ret, default_flow_style=False)
-            self.custom_command_reply = ret
-        except ValueError:
+        except (IndexError, ValueError):
             raise ValidationError('Command not understood! Example: network.ping host=google.com')
+        # Set before the job is sent after commit so the reply written by
+        # custom_command_response is not overwritten.
+        self.custom_command_reply = 'Waiting for reply...'
+        self.local_job(fun=cmd, kwarg=kwarg,
+                       res_model='asterisk_plus.server',
+                       res_method='custom_command_response',
+                       pass_back={'id': self.id, 'uid': self.env.uid})
+
+    @api.model
+    def custom_command_response(self, data, pass_back):
+        if not isinstance(data, str):
+            data = yaml.dump(data, default_flow_style=False)
+        server = self.browse(pass_back['id']).exists()
+        if server:
+            server.custom_command_reply = data
+        self.env['res.users'].asterisk_plus_notify(
+            '<pre>{}</pre>'.format(html.escape(data)),
+            title='Command reply', uid=pass_back['uid'], sticky=True)
 
     ##################### Work with configs ==========================================
 
@@ -433,10 +840,15 @@ class Server(models.Model):
         changed_configs = self.env['asterisk_plus.conf'].search(
             [('server', '=', self.id), ('is_updated', '=', True)])
         try:
-            for conf in changed_configs:
-                conf.upload_conf()
             if changed_configs:
-                self.reload_action(delay=0.5)
+                # Upload all files and reload Asterisk in one job.
+                self.local_jobs(
+                    [conf._get_upload_call() for conf in changed_configs] +
+                    [{'fun': 'asterisk.manager_action',
+                      'arg': {'Action': 'Reload'},
+                      'kwarg': {'timeout': 0.5, 'no_wait': False,
+                                'as_list': None},
+                      'res_notify_uid': self.env.uid}])
                 return True
             elif not silent:
                 self.env['res.users'].asterisk_plus_notify(
@@ -520,7 +932,8 @@ class Server(models.Model):
             pass_back={
                 'notify_uid': self.env.user.id,
                 'auto_reload': auto_reload
-            })
+            },
+            merge_key='asterisk.put_all_configs')
         self.conf_files.write({'is_updated': False})
         self.write({'sync_date': fields.Datetime.now(),
                     'sync_uid': self.env.uid})
@@ -607,16 +1020,28 @@ class Server(models.Model):
     @api.model
     def reload_view(self, model=None):
         """Reloads view. Sends 'reload_view' action to actions.js
+        after the transaction is committed.
         """
+        return self.update_view(model, {'reload': True})
 
-        if tools.odoo.release.version_info[0] < 15:
-            self.env['bus.bus'].sendone(
-                'asterisk_plus_actions',
-                {'action': 'reload_view', 'model': model})
-        else:
-            self.env['bus.bus']._sendone(
-                'asterisk_plus_actions',
-                'reload_view',
-                {'model': model})
+    @api.model
+    def update_view(self, model, delta):
+        """Send row level changes of model to actions.js after the transaction
+        is committed. Updates of the same model are sent not more often than
+        once per reload_view_interval, see merge_view_delta for the format.
+        """
+        views = self.env.cr.postcommit.data.setdefault(
+            'asterisk_plus.update_view', {})
+        if not views:
+            dbname = self.env.cr.dbname
+            interval = self.env['asterisk_plus.settings'].sudo().get_param(
+                'reload_view_interval') or 0
+
+            def update_views():
+                for view_model, view_delta in views.items():
+                    schedule_view_update(
+                        dbname, view_model, view_delta, interval)
 
+            self.env.cr.postcommit.add(update_views)
+        merge_view_delta(views.setdefault(model, {}), delta)
         return True
@@ -1,26 +1,54 @@
 # ©️ OdooPBX by Odooist, Odoo Proprietary License v1.0, 2020
-import inspect
+import ipaddress
+import json
 import logging
 import sys
 from odoo import fields, models, api, release, _
 from odoo.exceptions import ValidationError
 from odoo.tools import ormcache
+from .callerid_daemon import watch_callerid_daemon
+from .ip_access import compile_ip_networks
 
 logger = logging.getLogger(__name__)
 
 FORMAT_TYPE = 'e164'
 
 
-def debug(rec, message):
-    caller_module = inspect.stack()[1][3]
-    if rec.env['asterisk_plus.settings'].sudo().get_param('debug_mode'):
-        logger.info('++++++ {}: {}'.format(caller_module, message))
-        rec.env['asterisk_plus.debug'].sudo().create({
-            'model': getattr(rec, '_name', str(rec)),
-            'message': caller_module + ': ' + message,
-        })
+#: Debug levels by rank, a message is saved if its level reaches the setting.
+DEBUG_LEVELS = {
+    'debug': logging.DEBUG,
+    'info': logging.INFO,
+    'warning': logging.WARNING,
+    'error': logging.ERROR,
+}
 
 
+def debug(rec, message, *args, level='debug'):
+    """Log a debug message when debug mode is enabled.
+
+    Formatting is lazy: pass arguments for '{}' placeholders in args instead
+    of formatting the message in advance. Non string messages (e.g. AMI
+    events) are dumped as JSON. Nothing is done when debug mode is off or
+    the level is below the debug level setting.
+    """
+    settings = rec.env['asterisk_plus.settings'].sudo()
+    if not settings.get_param('debug_mode'):
+        return
+    if DEBUG_LEVELS[level] < DEBUG_LEVELS.get(
+            settings.get_param('debug_level'), logging.DEBUG):
+        return
+    if not isinstance(message, str):
+        message = json.dumps(message, indent=2, default=str)
+    elif args:
+        message = message.format(*args)
+    caller_module = sys._getframe(1).f_code.co_name
+    # Debug mode messages are shown in the log at INFO level at least.
+    logger.log(max(DEBUG_LEVELS[level], logging.INFO),
+               '++++++ %s: %s', caller_module, message)
+    rec.env['asterisk_plus.debug'].sudo().add_message(
+        getattr(rec, '_name', str(rec)), caller_module + ': ' + message,
+        level=level)
+
 
 class Settings(models.Model):
     """One record model to keep all settings. The record is created on 
@@ -41,13 +69,22 @@ class Settings(models.Model):
                                  default='odoo')
     #: Debug mode
     debug_mode = fields.Boolean(default=True)
+    #: Lowest level of debug messages saved.
+    debug_level = fields.Selection(
+        [('debug', 'Debug'), ('info', 'Info'), ('warning', 'Warning'),
+         ('error', 'Error')], default='debug', required=True)
+    #: Number of debug messages kept, older messages are overwritten.
+    debug_keep_messages = fields.Integer(
+        default=10000, required=True,
+        help=_('Debug messages are kept in a ring buffer of this size.'))
     #: Save all AMI messages on channels
     trace_ami = fields.Boolean(string='Trace AMI',
         help='Save all AMI messages on channels')
     permit_ip_addresses = fields.Char(
         string=_('Permit IP address(es)'),
-        help=_('Comma separated list of IP addresses permitted to query caller'
-               ' ID number, etc. Leave empty to allow all addresses.'))
+        help=_('Comma separated list of IP addresses or networks like '
+               '10.0.0.0/24 or 2001:db8::/32 permitted to query caller ID '
+               'number, etc. Leave empty to allow all addresses.'))
     originate_context = fields.Char(
         string='Default context',
         default='odoo-from-internal', required=True,
@@ -114,10 +151,28 @@ class Settings(models.Model):
     auto_reload_channels = fields.Boolean(
         default=True,
         help=_('Automatically refresh active channels view'))
+    reload_view_interval = fields.Float(
+        default=1.0, required=True,
+        help=_('Minimum interval in seconds between reloads of the active '
+               'calls and channels views.'))
     auto_create_partners = fields.Boolean(
         default=False,
         help=_('Automatically create partner record on calls from uknown numbers.'))
 
+    callerid_daemon_port = fields.Integer(
+        string=_('Caller ID Daemon Port'),
+        help=_('Answer get_caller_name requests on this port from memory '
+               'without Odoo workers. Set 0 to disable. The daemon runs in '
+               'the Odoo process with asterisk_plus_callerid_daemon = True '
+               'in its config.'))
+    callerid_daemon_host = fields.Char(
+        string=_('Caller ID Daemon Address'), default='0.0.0.0',
+        required=True)
+
+    def _register_hook(self):
+        super(Settings, self)._register_hook()
+        watch_callerid_daemon(self.env.cr.dbname)
+
     @api.model
     def _get_name(self):
         for rec in self:
@@ -151,6 +206,13 @@ class Settings(models.Model):
             data = data[0]
         return getattr(data, param, default)
 
+    @api.model
+    @ormcache()
+    def get_permit_ip_networks(self):
+        """Compiled permit_ip_addresses, cached until settings are changed.
+        """
+        return compile_ip_networks(self.get_param('permit_ip_addresses'))
+
     @api.model
     def set_param(self, param, value, keep_existing=False):
         """
@@ -165,7 +227,7 @@ class Settings(models.Model):
             # TODO: How to handle Boolean fields!?
             setattr(data, param, value)
         else:
-            debug(self, "Keeping existing value for param: {}".format(param))
+            debug(self, "Keeping existing value for param: {}", param)
         return True
 
     @api.model
@@ -175,7 +237,33 @@ class Settings(models.Model):
 
     def write(self, vals):
         self.clear_caches()
-        return super(Settings, self).write(vals)
+        res = super(Settings, self).write(vals)
+        if 'debug_keep_messages' in vals:
+            self.env['asterisk_plus.debug'].sudo().truncate_messages(
+                vals['debug_keep_messages'])
+        if 'callerid_daemon_port' in vals:
+            # The daemon process picks up the change in its settings poll.
+            self.env['asterisk_plus.phone_directory']._update_notify_triggers(
+                bool(self[:1].callerid_daemon_port))
+        return res
+
+    @api.constrains('debug_keep_messages')
+    def _check_debug_keep_messages(self):
+        for rec in self:
+            if rec.debug_keep_messages < 1:
+                raise ValidationError(
+                    _('Debug messages to keep must be a positive number.'))
+
+    @api.constrains('permit_ip_addresses')
+    def _check_permit_ip_addresses(self):
+        for rec in self:
+            for item in (rec.permit_ip_addresses or '').split(','):
+                try:
+                    if item.strip():
+                        ipaddress.ip_network(item.strip(), strict=False)
+                except ValueError:
+                    raise ValidationError(
+                        _('Invalid IP address or network: {}').format(item))
 
     @api.constrains('record_calls')
     def record_calls_toggle(self):
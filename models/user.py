@@ -115,8 +115,8 @@ class PbxUser(models.Model):
         # TODO: Is it required?
         astuser = self.search([
             ('exten', '=', exten), ('system_name', '=', system_name)], limit=1)
-        debug(self, 'GET RES USER BY EXTEN {} at {}: {}'.format(
-            exten, system_name, astuser))
+        debug(self, 'GET RES USER BY EXTEN {} at {}: {}',
+            exten, system_name, astuser)
         return astuser.user.id
 
     def _get_call_count(self):
@@ -0,0 +1,188 @@
+# ©️ OdooPBX by Odooist, Odoo Proprietary License v1.0, 2020
+import json
+import logging
+import threading
+from odoo import models, fields, api, registry, release, SUPERUSER_ID, _
+from odoo.tools.date_utils import json_default
+
+logger = logging.getLogger(__name__)
+
+
+def merge_view_delta(delta, other):
+    """Merge other view delta into delta. A full reload supersedes row changes.
+
+    A delta is a dictionary with 'created' and 'closed' sets of record IDs
+    and 'updated' dictionary of changed field values by record ID, or
+    {'reload': True} for a full view reload.
+    """
+    if delta.get('reload') or other.get('reload'):
+        delta.clear()
+        delta['reload'] = True
+        return delta
+    delta.setdefault('created', set()).update(other.get('created', ()))
+    delta.setdefault('closed', set()).update(other.get('closed', ()))
+    updated = delta.setdefault('updated', {})
+    for rec_id, values in other.get('updated', {}).items():
+        updated.setdefault(rec_id, {}).update(values)
+    return delta
+
+
+def dump_view_delta(delta):
+    return json.dumps(delta, default=lambda value: sorted(value) if
+                      isinstance(value, set) else json_default(value))
+
+
+def load_view_delta(value):
+    delta = json.loads(value)
+    if delta.get('reload'):
+        return delta
+    return {
+        'created': set(delta.get('created', ())),
+        'closed': set(delta.get('closed', ())),
+        'updated': {int(k): v for k, v in delta.get('updated', {}).items()},
+    }
+
+
+def schedule_view_update(dbname, model, delta, interval):
+    """Send the view update now or at the end of the interval if the view
+    was updated recently. Updates requested meanwhile are merged.
+    """
+    try:
+        with registry(dbname).cursor() as cr:
+            # Wait for other workers and read what they committed.
+            cr.execute('SET TRANSACTION ISOLATION LEVEL READ COMMITTED')
+            env = api.Environment(cr, SUPERUSER_ID, {})
+            delay = env['asterisk_plus.view_update']._schedule(
+                model, delta, interval)
+    except Exception:
+        logger.exception('View %s update error:', model)
+        return
+    if delay:
+        timer = threading.Timer(delay, flush_view_update, (dbname, model))
+        timer.daemon = True
+        timer.start()
+
+
+def flush_view_update(dbname, model):
+    """Send the pending view update of the model."""
+    try:
+        with registry(dbname).cursor() as cr:
+            cr.execute('SET TRANSACTION ISOLATION LEVEL READ COMMITTED')
+            env = api.Environment(cr, SUPERUSER_ID, {})
+            env['asterisk_plus.view_update']._flush(model)
+    except Exception:
+        logger.exception('View %s update error:', model)
+
+
+class ViewUpdate(models.Model):
+    """Last and pending updates of live views by model.
+
+    They are kept in the database so all workers share the update interval
+    and a pending update is sent even if the worker that scheduled it was
+    recycled. Rows are locked while an update is merged or sent.
+    """
+    _name = 'asterisk_plus.view_update'
+    _description = 'View Update'
+    _rec_name = 'model'
+    _log_access = False
+
+    model = fields.Char(required=True, readonly=True)
+    #: Time of the last update sent.
+    sent = fields.Datetime(readonly=True)
+    #: JSON delta waiting for the end of the interval.
+    pending = fields.Text(readonly=True)
+
+    _sql_constraints = [
+        ('model_uniq', 'unique (model)', _('The model must be unique!')),
+    ]
+
+    @api.model
+    def _schedule(self, model, delta, interval):
+        """Send the delta or merge it into the pending one.
+
+        Returns:
+            Seconds to wait before sending the pending update or None.
+        """
+        pending, elapsed = self._lock_model(model)
+        if pending:
+            delta = merge_view_delta(load_view_delta(pending), delta)
+            if elapsed < interval:
+                # Sent by the worker that scheduled it.
+                self._set_pending(model, delta)
+                return None
+        elif elapsed is not None and elapsed < interval:
+            self._set_pending(model, delta)
+            return interval - elapsed
+        self._send(model, delta)
+        return None
+
+    @api.model
+    def _flush(self, model):
+        pending, _elapsed = self._lock_model(model)
+        if pending:
+            self._send(model, load_view_delta(pending))
+
+    @api.model
+    def _lock_model(self, model):
+        """Returns the pending delta and seconds since the last update.
+        """
+        self.env.cr.execute("""
+            INSERT INTO asterisk_plus_view_update (model) VALUES (%s)
+            ON CONFLICT (model) DO NOTHING
+        """, (model,))
+        self.env.cr.execute("""
+            SELECT pending, extract(epoch FROM
+                (clock_timestamp() AT TIME ZONE 'UTC') - sent)::float
+            FROM asterisk_plus_view_update WHERE model = %s FOR UPDATE
+        """, (model,))
+        return self.env.cr.fetchone()
+
+    @api.model
+    def _set_pending(self, model, delta):
+        self.env.cr.execute("""
+            UPDATE asterisk_plus_view_update SET pending = %s
+            WHERE model = %s
+        """, (dump_view_delta(delta), model))
+
+    @api.model
+    def _send(self, model, delta):
+        """Send 'reload_view' or 'update_view' action to actions.js.
+        Only clients showing the model are subscribed to its channel.
+        """
+        self.env.cr.execute("""
+            UPDATE asterisk_plus_view_update
+            SET pending = NULL, sent = clock_timestamp() AT TIME ZONE 'UTC'
+            WHERE model = %s
+        """, (model,))
+        if not delta:
+            return
+        if delta.get('reload'):
+            action, message = 'reload_view', {'model': model}
+        else:
+            action, message = 'update_view', {
+                'model': model,
+                'created': sorted(delta.get('created', [])),
+                'closed': sorted(delta.get('closed', [])),
+                'updated': [dict(values, id=rec_id) for rec_id, values in
+                            delta.get('updated', {}).items()],
+            }
+        channel = 'asterisk_plus_actions/{}'.format(model)
+        if release.version_info[0] < 15:
+            self.env['bus.bus'].sendone(channel, dict(message, action=action))
+        else:
+            self.env['bus.bus']._sendone(channel, action, message)
+
+    @api.model
+    def flush_overdue(self):
+        """Cron job to send pending updates of recycled workers.
+        """
+        interval = self.env['asterisk_plus.settings'].sudo().get_param(
+            'reload_view_interval') or 0
+        self.env.cr.execute("""
+            SELECT model FROM asterisk_plus_view_update
+            WHERE pending IS NOT NULL AND sent <
+                (clock_timestamp() AT TIME ZONE 'UTC') -
+                %s * interval '1 second'
+        """, (interval,))
+        for model, in self.env.cr.fetchall():
+            flush_view_update(self.env.cr.dbname, model)
@@ -2,9 +2,11 @@
 
 import {registry} from "@web/core/registry";
 import {uid} from "web.session";
+import core from "web.core";
 
 var personal_channel = 'asterisk_plus_actions_' + uid;
-var common_channel = 'asterisk_plus_actions';
+// Model channels are 'asterisk_plus_actions/<model>' of the current view.
+var model_channel_prefix = 'asterisk_plus_actions/';
 
 export const pbxActionService = {
     dependencies: ["action", "notification"],
@@ -15,12 +17,30 @@ export const pbxActionService = {
         this.notification = notification;
 
         const legacyEnv = owl.Component.env;
+        this.bus_service = legacyEnv.services.bus_service;
+        this.model_channel = null;
         legacyEnv.services.bus_service.addChannel(personal_channel);
-        legacyEnv.services.bus_service.addChannel(common_channel);
+        this.bus.on("ACTION_MANAGER:UI-UPDATED", this, this.asterisk_plus_update_model_channel);
         legacyEnv.services.bus_service.onNotification(this, this.on_asterisk_plus_action);
         legacyEnv.services.bus_service.startPolling();
     },
 
+    asterisk_plus_update_model_channel: function () {
+        // Subscribe only to the channel of the model currently shown.
+        const controller = this.action.currentController;
+        const model = controller && controller.action.res_model;
+        let channel = null;
+        if (model && model.startsWith('asterisk_plus.'))
+            channel = model_channel_prefix + model;
+        if (channel == this.model_channel)
+            return
+        if (this.model_channel)
+            this.bus_service.deleteChannel(this.model_channel);
+        if (channel)
+            this.bus_service.addChannel(channel);
+        this.model_channel = channel;
+    },
+
     on_asterisk_plus_action: function (action) {
         for (var i = 0; i < action.length; i++) {
             try {
@@ -33,6 +53,8 @@ export const pbxActionService = {
                     this.asterisk_plus_handle_open_record(payload)
                 else if (type == 'reload_view')
                     this.asterisk_plus_handle_reload_view(payload)
+                else if (type == 'update_view')
+                    this.asterisk_plus_handle_update_view(payload)
             } catch (e) {
                 console.log(e)
             }
@@ -65,6 +87,11 @@ export const pbxActionService = {
         this.bus.trigger("ROUTE_CHANGE");
     },
 
+    asterisk_plus_handle_update_view: function (message) {
+        // Row changes are applied by list controllers, see live_view.js
+        core.bus.trigger('asterisk_plus_update_view', message);
+    },
+
     asterisk_plus_handle_notify: function ({title, message, sticky, warning}) {
         if (warning == true)
             this.notification.add(message, {title, sticky, type: 'danger', messageIsHtml: true})
@@ -0,0 +1,68 @@
+odoo.define('asterisk_plus.live_view', function (require) {
+  "use strict";
+
+  var core = require('web.core');
+  var ListController = require('web.ListController');
+
+  // Field types patched in place, other fields are re-read from the server.
+  var PATCH_FIELD_TYPES = ['char', 'text', 'integer', 'float', 'boolean', 'selection'];
+
+  ListController.include({
+
+    on_attach_callback: function () {
+      this._super.apply(this, arguments);
+      core.bus.on('asterisk_plus_update_view', this, this._onAsteriskPlusUpdateView);
+    },
+
+    on_detach_callback: function () {
+      core.bus.off('asterisk_plus_update_view', this, this._onAsteriskPlusUpdateView);
+      this._super.apply(this, arguments);
+    },
+
+    /**
+     * Apply row level changes sent by the server to the list.
+     * Created and closed rows change the list so it is reloaded, updated
+     * rows are patched in place.
+     */
+    _onAsteriskPlusUpdateView: async function (message) {
+      if (message.model != this.modelName) {
+        return;
+      }
+      var list = this.model.get(this.handle, {raw: true});
+      if (message.created.length || message.closed.length || list.groupedBy.length) {
+        return this.reload();
+      }
+      var self = this;
+      var patched = false;
+      var reloads = [];
+      message.updated.forEach(function (values) {
+        var row = list.data.find(function (r) { return r.res_id == values.id; });
+        if (!row) {
+          return;
+        }
+        var record = self.model.localData[row.id];
+        var fieldsInfo = record.fieldsInfo[record.viewType];
+        var needReload = false;
+        Object.keys(values).forEach(function (name) {
+          if (name == 'id' || !(name in fieldsInfo)) {
+            return;
+          }
+          if (PATCH_FIELD_TYPES.includes(record.fields[name].type)) {
+            record.data[name] = values[name];
+            patched = true;
+          } else {
+            needReload = true;
+          }
+        });
+        if (needReload) {
+          reloads.push(self.model.reload(row.id));
+        }
+      });
+      await Promise.all(reloads);
+      if (patched || reloads.length) {
+        return this.update({}, {reload: false});
+      }
+    },
+
+  });
+});
@@ -0,0 +1,130 @@
+# ©️ OdooPBX by Odooist, Odoo Proprietary License v1.0, 2020
+import socket
+import socketserver
+import threading
+import time
+from odoo.tests.common import TransactionCase
+from odoo.addons.asterisk_plus.models.ami import AmiPool, AmiError
+
+
+class AmiStandIn(socketserver.ThreadingTCPServer):
+    """Local AMI speaking the manager TCP protocol."""
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self):
+        super(AmiStandIn, self).__init__(('127.0.0.1', 0), AmiHandler)
+        self.connections = 0
+        self.actions = []
+        self.sockets = []
+
+
+class AmiHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        self.server.connections += 1
+        self.server.sockets.append(self.request)
+        self.wfile.write(b'Asterisk Call Manager/5.0.1\r\n')
+        message = []
+        for line in self.rfile:
+            line = line.decode().rstrip('\r\n')
+            if line:
+                message.append(line.split(': ', 1))
+                continue
+            self.server.actions.append(message)
+            action = dict(message)
+            message = []
+            reply = {'Response': 'Success', 'ActionID': action['ActionID']}
+            if action['Action'] == 'Login':
+                if action['Secret'] != 'secret':
+                    reply = dict(reply, Response='Error',
+                                 Message='Authentication failed')
+                else:
+                    # Events sent before the response are skipped.
+                    self.wfile.write(b'Event: FullyBooted\r\n\r\n')
+            elif action['Action'] == 'Ping':
+                reply['Ping'] = 'Pong'
+            elif action.get('Channel') == 'PJSIP/slow':
+                # No response before the timeout.
+                continue
+            self.wfile.write(''.join(
+                '{}: {}\r\n'.format(k, v) for k, v in reply.items()
+            ).encode() + b'\r\n')
+
+
+class TestAmi(TransactionCase):
+
+    def setUp(self):
+        super(TestAmi, self).setUp()
+        self.ami = AmiStandIn()
+        threading.Thread(target=self.ami.serve_forever, daemon=True).start()
+        self.addCleanup(self.ami.server_close)
+        self.addCleanup(self.ami.shutdown)
+        self.port = self.ami.server_address[1]
+
+    def test_pool(self):
+        pool = AmiPool('127.0.0.1', self.port, 'odoo', 'secret')
+        self.addCleanup(pool.close)
+        res = pool.send({'Action': 'Ping'})
+        self.assertEqual(res[0]['Ping'], 'Pong')
+        pool.send({'Action': 'Originate', 'Channel': 'PJSIP/1001',
+                   'Variable': ['A=1', 'B=2']})
+        # The connection is reused.
+        self.assertEqual(self.ami.connections, 1)
+        self.assertIn(['Variable', 'B=2'], self.ami.actions[-1])
+
+    def test_login_error(self):
+        pool = AmiPool('127.0.0.1', self.port, 'odoo', 'wrong')
+        with self.assertRaises(AmiError):
+            pool.send({'Action': 'Ping'})
+
+    def test_ami_action_direct(self):
+        server = self.env.ref('asterisk_plus.default_server')
+        server.write({'ami_direct': True, 'ami_host': '127.0.0.1',
+                      'ami_port': self.port, 'ami_login': 'odoo',
+                      'ami_password': 'secret'})
+        jobs = self.env['asterisk_plus.salt_job'].search_count([])
+        self.assertTrue(server.ami_action({'Action': 'Ping'}))
+        # Not sent to Salt.
+        self.assertEqual(
+            self.env['asterisk_plus.salt_job'].search_count([]), jobs)
+        queue = self.env.cr.postcommit.data[
+            'asterisk_plus.ami_direct.{}'.format(server.id)]
+        self.assertEqual(queue[0]['action'], {'Action': 'Ping'})
+        queue.clear()
+
+    def test_pipelined_actions(self):
+        pool = AmiPool('127.0.0.1', self.port, 'odoo', 'secret')
+        self.addCleanup(pool.close)
+        res = pool.send_many([
+            {'Action': 'Originate', 'Channel': 'PJSIP/1001'},
+            {'Action': 'Originate', 'Channel': 'PJSIP/1002'},
+            {'Action': 'Ping'}])
+        self.assertEqual([k[0]['Response'] for k in res], ['Success'] * 3)
+        self.assertEqual(res[2][0]['Ping'], 'Pong')
+        self.assertEqual(self.ami.connections, 1)
+
+    def test_closed_idle_connection(self):
+        pool = AmiPool('127.0.0.1', self.port, 'odoo', 'secret')
+        self.addCleanup(pool.close)
+        pool.send({'Action': 'Ping'})
+        self.ami.sockets[0].shutdown(socket.SHUT_RDWR)
+        time.sleep(0.1)
+        res = pool.send({'Action': 'Ping'})
+        self.assertEqual(res[0]['Ping'], 'Pong')
+        # The closed connection is not written to.
+        self.assertEqual(self.ami.connections, 2)
+        self.assertEqual(
+            [dict(k)['Action'] for k in self.ami.actions],
+            ['Login', 'Ping', 'Login', 'Ping'])
+
+    def test_timeout_not_resent(self):
+        pool = AmiPool('127.0.0.1', self.port, 'odoo', 'secret')
+        self.addCleanup(pool.close)
+        res = pool.send({'Action': 'Originate', 'Channel': 'PJSIP/slow'},
+                        timeout=0.2)
+        self.assertEqual(res[0]['Response'], 'Error')
+        self.assertEqual(self.ami.connections, 1)
+        self.assertEqual(
+            [dict(k)['Action'] for k in self.ami.actions],
+            ['Login', 'Originate'])
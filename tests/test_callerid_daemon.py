@@ -0,0 +1,69 @@
+# ©️ OdooPBX by Odooist, Odoo Proprietary License v1.0, 2020
+import threading
+import urllib.error
+import urllib.request
+from odoo.tests.common import TransactionCase
+from odoo.addons.asterisk_plus.models.callerid_daemon import CallerIdDaemon
+from odoo.addons.asterisk_plus.models.ip_access import compile_ip_networks
+
+
+class TestCallerIdDaemon(TransactionCase):
+
+    def setUp(self):
+        super(TestCallerIdDaemon, self).setUp()
+        self.daemon = CallerIdDaemon(self.env.cr.dbname, '127.0.0.1', 0)
+        self.addCleanup(self.daemon.httpd.server_close)
+        self.daemon.map.add([
+            ('442083661171', 1, None),
+            # Two contacts of one company.
+            ('442083661172', 2, 10),
+            ('442083661172', 3, 10),
+            # A contact and its company.
+            ('442083661173', 4, 11),
+            ('442083661173', 11, None),
+        ], {1: 'Test User', 2: 'Company, One', 3: 'Company, Two',
+            4: 'Other, Contact', 10: 'Company', 11: 'Other'})
+
+    def test_lookup(self):
+        self.assertEqual(self.daemon.lookup('+442083661171'), 'Test User')
+        # Found by the last digits.
+        self.assertEqual(self.daemon.lookup('02083661171'), 'Test User')
+        self.assertEqual(self.daemon.lookup('+442083661172'), 'Company')
+        self.assertEqual(self.daemon.lookup('+442083661173'), 'Other, Contact')
+        self.assertIsNone(self.daemon.lookup('+442083661174'))
+        self.assertIsNone(self.daemon.lookup('unknown'))
+        # Numbers of changed partners are replaced.
+        self.daemon.map.remove([1])
+        self.daemon.map.add([('442083661174', 1, None)], {1: 'Test User'})
+        self.assertIsNone(self.daemon.lookup('+442083661171'))
+        self.assertEqual(self.daemon.lookup('+442083661174'), 'Test User')
+
+    def test_http(self):
+        threading.Thread(target=self.daemon.httpd.serve_forever,
+                         daemon=True).start()
+        self.addCleanup(self.daemon.httpd.shutdown)
+        url = 'http://127.0.0.1:{}/asterisk_plus/get_caller_name?number={}'
+        port = self.daemon.httpd.server_address[1]
+        with urllib.request.urlopen(url.format(port, '442083661171')) as res:
+            self.assertEqual(res.read().decode(), 'Test User')
+        self.daemon.networks = compile_ip_networks('10.0.0.0/8, ::1')
+        with self.assertRaises(urllib.error.HTTPError):
+            urllib.request.urlopen(url.format(port, '442083661171'))
+
+    def test_notify_triggers(self):
+        settings = self.env['asterisk_plus.settings']
+
+        def triggers():
+            self.env.cr.execute("""
+                SELECT tgname FROM pg_trigger
+                WHERE tgname LIKE 'asterisk\\_plus\\_callerid\\_%%'
+                ORDER BY tgname
+            """)
+            return [k[0] for k in self.env.cr.fetchall()]
+
+        settings.set_param('callerid_daemon_port', 0)
+        self.assertEqual(triggers(), [])
+        settings.set_param('callerid_daemon_port', 8089)
+        self.assertEqual(triggers(), ['asterisk_plus_callerid_delete',
+                                      'asterisk_plus_callerid_insert',
+                                      'asterisk_plus_callerid_update'])
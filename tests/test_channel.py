@@ -0,0 +1,144 @@
+# ©️ OdooPBX by Odooist, Odoo Proprietary License v1.0, 2020
+from datetime import timedelta
+from odoo import fields
+from odoo.tests.common import TransactionCase
+
+
+class TestChannel(TransactionCase):
+
+    def setUp(self):
+        super(TestChannel, self).setUp()
+        server = self.env.ref('asterisk_plus.default_server')
+        self.channels = self.env['asterisk_plus.channel'].with_user(
+            server.user).sudo()
+        self.new_channel = {
+            'Event': 'Newchannel',
+            'Channel': 'SIP/1001-00000001',
+            'ChannelState': '0',
+            'ChannelStateDesc': 'Down',
+            'CallerIDNum': '1001',
+            'CallerIDName': 'Test',
+            'ConnectedLineNum': '',
+            'ConnectedLineName': '',
+            'Language': 'en',
+            'AccountCode': '',
+            'Priority': '1',
+            'Context': 'default',
+            'Exten': '1002',
+            'Uniqueid': 'asterisk-1.1',
+            'Linkedid': 'asterisk-1.1',
+            'SystemName': 'asterisk',
+        }
+        self.hangup = dict(self.new_channel, **{
+            'Event': 'Hangup',
+            'Cause': '16',
+            'Cause-txt': 'Normal Clearing',
+        })
+
+    def test_process_events(self):
+        acks = self.channels.process_events([self.new_channel, self.hangup])
+        self.assertEqual([k[0] for k in acks], [True, True])
+        channel = self.channels.search([('uniqueid', '=', 'asterisk-1.1')])
+        self.assertEqual(len(channel), 1)
+        self.assertFalse(channel.is_active)
+        self.assertFalse(channel.call.is_active)
+
+    def test_process_events_failure(self):
+        broken = dict(self.new_channel)
+        del broken['ChannelState']
+        other = dict(self.new_channel, Uniqueid='asterisk-2.1',
+                     Linkedid='asterisk-2.1')
+        acks = self.channels.process_events(
+            [broken, self.hangup, {'Event': 'Unknown'}, other])
+        self.assertEqual([k[0] for k in acks], [False, False, False, True])
+        self.assertIn('skipped', acks[1][1])
+        self.assertTrue(self.channels.search(
+            [('uniqueid', '=', 'asterisk-2.1'), ('is_active', '=', True)]))
+
+    def test_channel_message_truncate(self):
+        self.env['asterisk_plus.settings'].set_param('trace_ami', True)
+        name = 'Very Long Caller Name Longer Than The Field'
+        self.channels.process_events([dict(self.new_channel,
+                                           CallerIDName=name)])
+        messages = self.env['asterisk_plus.channel_message']
+        messages._flush_events()
+        message = messages.search([('uniqueid', '=', 'asterisk-1.1')])
+        self.assertEqual(message.callerid_name, name[:32])
+        self.assertIn(name, message.message)
+
+    def test_get_active_channel(self):
+        self.channels.process_events([self.new_channel])
+        channel = self.channels._get_active_channel('asterisk-1.1')
+        self.assertEqual(len(channel), 1)
+        self.assertEqual(
+            self.channels._get_active_call('asterisk-1.1'), channel.call)
+        secondary = dict(self.new_channel, Channel='SIP/1002-00000002',
+                         Uniqueid='asterisk-1.2')
+        self.channels.process_events([secondary])
+        self.assertEqual(
+            self.channels._get_active_channel('asterisk-1.2').parent_channel,
+            channel)
+        self.channels.process_events([self.hangup])
+        self.assertFalse(self.channels._get_active_channel('asterisk-1.1'))
+        self.assertFalse(self.channels._get_active_call('asterisk-1.1'))
+
+    def test_live_channel(self):
+        live_channels = self.env['asterisk_plus.live_channel']
+        new_state = dict(self.new_channel, Event='Newstate', ChannelState='6',
+                         ChannelStateDesc='Up')
+        self.channels.process_events([self.new_channel, new_state])
+        channel = self.channels._get_active_channel('asterisk-1.1')
+        live = live_channels.search([('uniqueid', '=', 'asterisk-1.1')])
+        self.assertEqual(live.state_desc, 'Up')
+        self.assertEqual(live.channel_id, channel)
+        self.assertEqual(channel.live_state_desc, 'Up')
+        self.assertEqual(channel.call.live_state, 'Up')
+        self.channels.process_events([self.hangup])
+        self.assertFalse(live.exists())
+
+    def test_live_channel_other_server(self):
+        live_channels = self.env['asterisk_plus.live_channel']
+        other = self.env['asterisk_plus.server'].create({
+            'name': 'Other', 'server_id': 'other'})
+        # Same uniqueid on another Asterisk.
+        other_live = live_channels.create({
+            'server': other.id,
+            'channel': 'SIP/1001-00000001',
+            'uniqueid': 'asterisk-1.1',
+        })
+        self.channels.process_events([self.new_channel, self.hangup])
+        self.assertTrue(other_live.exists())
+        # Server users see live channels of their server only.
+        server_user = self.env.ref('asterisk_plus.default_server').user
+        self.assertNotIn(
+            other_live, live_channels.with_user(server_user).search([]))
+
+    def test_live_state_view_update(self):
+        self.env['asterisk_plus.settings'].set_param('auto_reload_calls', True)
+        new_state = dict(self.new_channel, Event='Newstate', ChannelState='6',
+                         ChannelStateDesc='Up')
+        self.channels.process_events([self.new_channel, new_state])
+        call = self.channels._get_active_channel('asterisk-1.1').call
+        changes = self.env.cr.precommit.data['asterisk_plus.live_view'][
+            'asterisk_plus.call']
+        self.assertIn('live_state', changes['updated'][call.id])
+        self.assertEqual(call._live_view_fields(['live_state']),
+                         ['live_state'])
+
+    def test_live_channel_rebuild(self):
+        live_channels = self.env['asterisk_plus.live_channel']
+        server = self.env.ref('asterisk_plus.default_server')
+        self.channels.process_events([self.new_channel])
+        sent = fields.Datetime.to_string(
+            fields.Datetime.now() + timedelta(seconds=1))
+        # The channel is gone in Asterisk and another one is up.
+        live_channels.rebuild([
+            {'Response': 'Success'},
+            dict(self.new_channel, Event='CoreShowChannel',
+                 Uniqueid='asterisk-2.1', Linkedid='asterisk-2.1',
+                 Application='Dial'),
+            {'Event': 'CoreShowChannelsComplete'},
+        ], {'server_id': server.id, 'sent': sent})
+        live = live_channels.search([('server', '=', server.id)])
+        self.assertEqual(live.mapped('uniqueid'), ['asterisk-2.1'])
+        self.assertEqual(live.app, 'Dial')
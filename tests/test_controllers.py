@@ -1,5 +1,6 @@
 from odoo.tests.common import HttpCase, new_test_user
 import urllib
+from odoo.exceptions import ValidationError
 
 
 class TestController(HttpCase):
@@ -43,6 +44,22 @@ class TestController(HttpCase):
             res = self.send_request(self.caller_name_url, {'number': '10101'})
             self.assertEqual(res.status_code, 200)
 
+    def test_permit_networks(self):
+        settings = self.env['asterisk_plus.settings']
+        with self.subTest(test_name='Permitted network'):
+            settings.set_param('permit_ip_addresses', '10.0.0.0/8, 127.0.0.0/8')
+            res = self.send_request(self.caller_name_url, {'number': '10101'})
+            self.assertEqual(res.status_code, 200)
+
+        with self.subTest(test_name='Forbidden network'):
+            settings.set_param('permit_ip_addresses', '10.0.0.0/8, 2001:db8::/32')
+            res = self.send_request(self.caller_name_url, {'number': '10101'})
+            self.assertEqual(res.status_code, 400)
+
+        with self.subTest(test_name='Invalid network'):
+            with self.assertRaises(ValidationError):
+                settings.set_param('permit_ip_addresses', '10.0.0.0/33')
+
     def test_get_caller_name(self):
         with self.subTest(test_name='Right number passed'):
             res = self.send_request(self.caller_name_url, {'number': '10101'})
@@ -92,3 +109,28 @@ class TestController(HttpCase):
         with self.subTest(test_name='Tags not found'):
             res = self.send_request(self.partner_manager_url, {'number': '10101999'})
             self.assertEqual(res.text, '')
+
+    def test_caller_profile(self):
+        self.test_partner.phone = '+442083661171'
+        url = '/asterisk_plus/caller_profile?'
+        res = self.send_request(url, {'number': '+442083661171'})
+        self.assertEqual(res.text, '{}|Test partner|textext||tag1,tag2'.format(
+            self.test_partner.id))
+        self.assertIn('max-age', res.headers['Cache-Control'])
+        # Same answer is not sent again.
+        res = self.url_open(url + urllib.parse.urlencode(
+            {'number': '+442083661171'}), timeout=2,
+            headers={'If-None-Match': res.headers['ETag']})
+        self.assertEqual(res.status_code, 304)
+        res = self.send_request(url, {'number': '+442083661179'})
+        self.assertEqual(res.text, '||||')
+
+    def test_caller_profiles(self):
+        self.test_partner.phone = '+442083661171'
+        res = self.opener.post(
+            self.base_url() + '/asterisk_plus/caller_profiles', timeout=2,
+            json={'params': {'numbers': ['+442083661171', '+442083661179']}})
+        profiles = res.json()['result']['profiles']
+        self.assertEqual(profiles['+442083661171']['id'], self.test_partner.id)
+        self.assertEqual(profiles['+442083661171']['tags'], 'tag1,tag2')
+        self.assertEqual(profiles['+442083661179']['id'], False)
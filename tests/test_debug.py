@@ -0,0 +1,31 @@
+# ©️ OdooPBX by Odooist, Odoo Proprietary License v1.0, 2020
+from odoo.tests.common import TransactionCase
+from odoo.addons.asterisk_plus.models.settings import debug
+
+
+class TestDebug(TransactionCase):
+
+    def setUp(self):
+        super(TestDebug, self).setUp()
+        self.settings = self.env['asterisk_plus.settings']
+        self.messages = self.env['asterisk_plus.debug']
+        self.settings.set_param('debug_mode', True)
+
+    def _last_message(self):
+        return self.messages.search([], limit=1)
+
+    def test_debug_levels(self):
+        self.settings.set_param('debug_level', 'warning')
+        debug(self.messages, 'Skipped {}', 1)
+        self.assertFalse(self.messages.search(
+            [('message', 'like', 'Skipped 1')]))
+        debug(self.messages, 'Saved {}', 2, level='error')
+        message = self._last_message()
+        self.assertEqual(message.level, 'error')
+        self.assertIn('Saved 2', message.message)
+
+    def test_debug_mode_off(self):
+        self.settings.set_param('debug_mode', False)
+        debug(self.messages, 'Skipped {}', 3, level='error')
+        self.assertFalse(self.messages.search(
+            [('message', 'like', 'Skipped 3')]))
@@ -1,6 +1,8 @@
 from odoo.tests.common import SavepointCase, TransactionCase
 from odoo.tests import new_test_user, Form, tagged
 from odoo import tools, _
+from unittest.mock import patch
+from odoo.addons.asterisk_plus.models import res_partner
 
 @tagged('res_partner_test')
 class TestResPartner(SavepointCase):
@@ -61,6 +63,155 @@ class TestResPartner(SavepointCase):
             'phone': "+442083661171",
         })
         self.assertEqual(partner.get_partner_by_number('+442083661171'), {'name': _('Unknown'), 'id': False})
-        partner.clear_caches()
+        partner._invalidate_callerid_cache({'+442083661171'})
         self.assertEqual(partner.get_partner_by_number('+442083661171').get('name'), 'Test User')
-        
\ No newline at end of file
+
+    def test_callerid_cache_invalidation(self):
+        partner = self.env['res.partner'].create({
+            'name': "Test User",
+            'phone': "+442083661171",
+        })
+        self.assertEqual(partner.get_partner_by_number('+442083661171').get('name'), 'Test User')
+        # Invalidations carry their transaction ID.
+        self.env.cr.execute("""
+            SELECT id, txid = txid_current()
+            FROM asterisk_plus_callerid_invalidation ORDER BY id DESC LIMIT 1""")
+        last_id, own_txid = self.env.cr.fetchone()
+        self.assertTrue(own_txid)
+        # Unrelated changes keep the cache.
+        partner.write({'website': 'https://example.com'})
+        self.env.cr.execute('SELECT max(id) FROM asterisk_plus_callerid_invalidation')
+        self.assertEqual(self.env.cr.fetchone()[0], last_id)
+        # Both the old and the new numbers are invalidated.
+        partner.write({'phone': '+442083661172'})
+        self.env.cr.execute(
+            'SELECT number FROM asterisk_plus_callerid_invalidation WHERE id > %s',
+            (last_id,))
+        self.assertEqual({k[0] for k in self.env.cr.fetchall()},
+                         {'+442083661171', '+442083661172'})
+        self.assertEqual(partner.get_partner_by_number('+442083661171').get('id'), False)
+        self.assertEqual(partner.get_partner_by_number('+442083661172').get('id'), partner.id)
+
+    def test_phone_directory(self):
+        partner = self.env['res.partner'].create({
+            'name': "Test User",
+            'phone': "+442083661171",
+            'mobile': "+442083661179",
+        })
+        directory = self.env['asterisk_plus.phone_directory']
+        self.assertEqual(
+            sorted(directory.search([('partner_id', '=', partner.id)]).mapped('number')),
+            ['+442083661171', '+442083661179'])
+        # Found by the last digits.
+        self.assertEqual(partner.get_partner_by_number('2083661171').get('id'), partner.id)
+        # Archived partners are removed from the directory.
+        partner.active = False
+        self.assertFalse(directory.search([('partner_id', '=', partner.id)]))
+        self.assertEqual(partner.get_partner_by_number('+442083661179').get('id'), False)
+
+    def test_phone_directory_match_many(self):
+        partner = self.env['res.partner'].create({
+            'name': "Test User",
+            'phone': "+442083661171",
+        })
+        other = self.env['res.partner'].create({
+            'name': "Other User",
+            'phone': "+442083661172",
+        })
+        found = self.env['asterisk_plus.phone_directory'].match_many([
+            ('+442083661171',), ('2083661171',), ('2083661172',),
+            ('+442083661173',), ('',)])
+        self.assertEqual([[k[0] for k in rows] for rows in found],
+                         [[partner.id], [partner.id], [other.id], [], []])
+
+    def test_phone_directory_fill(self):
+        partner = self.env['res.partner'].create({
+            'name': "Test User",
+            'phone': "+442083661171",
+        })
+        directory = self.env['asterisk_plus.phone_directory']
+        partner._phone_directory_delete()
+        # The re-normalization job adds missing numbers.
+        self.assertEqual(partner._renormalize_chunk(
+            partner.id - 1, partner.id, 10), partner.id)
+        self.assertEqual(
+            directory.search([('partner_id', '=', partner.id)]).mapped('number'),
+            ['+442083661171'])
+
+    def test_get_caller_profiles(self):
+        category = self.env['res.partner.category'].create({'name': 'VIP'})
+        partner = self.env['res.partner'].create({
+            'name': "Test User",
+            'phone': "+442083661171",
+            'category_id': [(6, 0, category.ids)],
+        })
+        other = self.env['res.partner'].create({
+            'name': "Other User",
+            'phone': "+442083661172",
+        })
+        profiles = self.env['res.partner'].get_caller_profiles(
+            ['+442083661171', '442083661172', '+442083661173', 'unknown'])
+        self.assertEqual(profiles['+442083661171']['id'], partner.id)
+        self.assertEqual(profiles['+442083661171']['tags'], 'VIP')
+        self.assertEqual(profiles['442083661172']['id'], other.id)
+        self.assertEqual(profiles['+442083661173']['id'], False)
+        self.assertEqual(profiles['unknown']['manager_exten'], '')
+
+    def test_renormalize_phones(self):
+        partner = self.env['res.partner'].create({
+            'name': "Test User",
+            'phone': "+442083661171",
+        })
+        # Numbers were normalized with other rules.
+        self.env.cr.execute("""
+            UPDATE res_partner SET phone_normalized = '442083661171'
+            WHERE id = %s""", (partner.id,))
+        partner.invalidate_cache()
+        backfill = self.env['asterisk_plus.backfill']
+        backfill.start('renormalize_phones', 'res_partner', 4)
+        # One slice per cron up to the last partner.
+        slices = backfill.search([('job', '=', 'renormalize_phones')])
+        self.assertEqual(len(slices), 4)
+        self.assertEqual(slices[0].last_id, 0)
+        self.assertEqual(slices[-1].end_id, partner.id)
+        with patch.object(self.env.cr, 'commit'):
+            self.assertTrue(self.env['res.partner'].renormalize_phones(
+                chunk_size=10))
+        self.assertEqual(partner.phone_normalized, '+442083661171')
+        self.assertEqual(partner.get_partner_by_number('+442083661171').get('id'), partner.id)
+        # No job is pending.
+        self.assertFalse(backfill.pending_ranges('renormalize_phones'))
+
+    def test_lookup_during_backfill(self):
+        partner = self.env['res.partner'].create({
+            'name': "Test User",
+            'phone': "+44 20 8366 1171",
+        })
+        # Columns added empty by the migration, not backfilled yet.
+        self.env.cr.execute("""
+            UPDATE res_partner SET phone_normalized = NULL WHERE id = %s""",
+            (partner.id,))
+        partner._phone_directory_delete()
+        self.env['asterisk_plus.backfill'].create({
+            'job': 'renormalize_phones',
+            'last_id': partner.id - 1,
+            'end_id': partner.id,
+        })
+        self.assertEqual(partner.get_partner_by_number('+442083661171').get('id'), partner.id)
+
+    def test_lookup_during_large_backfill(self):
+        partner = self.env['res.partner'].create({
+            'name': "Test User",
+            'phone': "+44 20 8366 1175",
+        })
+        self.env.cr.execute("""
+            UPDATE res_partner SET phone_normalized = NULL WHERE id = %s""",
+            (partner.id,))
+        partner._phone_directory_delete()
+        # Too many partners left to scan on a lookup miss.
+        self.env['asterisk_plus.backfill'].create({
+            'job': 'renormalize_phones',
+            'last_id': 0,
+            'end_id': partner.id + res_partner.RENORMALIZE_SCAN_LIMIT,
+        })
+        self.assertFalse(partner.get_partner_by_number('+442083661175').get('id'))
@@ -0,0 +1,199 @@
+# ©️ OdooPBX by Odooist, Odoo Proprietary License v1.0, 2020
+from datetime import datetime, timedelta
+import json
+from odoo.tests.common import TransactionCase
+from odoo.addons.asterisk_plus.models import salt_job
+
+
+class TestSaltJob(TransactionCase):
+
+    def setUp(self):
+        super(TestSaltJob, self).setUp()
+        self.server = self.env.ref('asterisk_plus.default_server')
+        self.jobs = self.env['asterisk_plus.salt_job']
+
+    def test_returner(self):
+        job = self.jobs.create({
+            'server': self.server.id,
+            'fun': 'test.ping',
+            'jid': '20210916150939079024',
+            'state': 'pending',
+            'sent_date': datetime.utcnow() - timedelta(seconds=2),
+        })
+        self.jobs.returner({
+            'jid': '20210916150939079024',
+            'return': True,
+            'fun': 'test.ping',
+            'success': True})
+        self.assertEqual(job.state, 'done')
+        self.assertGreaterEqual(job.latency, 2)
+
+    def test_vacuum(self):
+        job = self.jobs.create({
+            'server': self.server.id,
+            'fun': 'test.ping',
+            'jid': '20210916150939079025',
+            'state': 'pending',
+            'sent_date': datetime.utcnow() - timedelta(minutes=20),
+        })
+        self.jobs.vacuum(hours=24, expire_minutes=10)
+        self.assertEqual(job.state, 'expired')
+
+    def test_returner_batch(self):
+        jids = ['20210916150939079026', '20210916150939079027']
+        for jid in jids:
+            self.jobs.create({
+                'server': self.server.id,
+                'fun': 'test.ping',
+                'jid': jid,
+                'state': 'pending',
+                'res_model': 'asterisk_plus.server',
+                'res_method': 'no_such_method' if jid == jids[0] else False,
+            })
+        res = self.jobs.with_context(returner_retry=True).returner_batch([
+            {'jid': jid, 'return': True, 'fun': 'test.ping', 'success': True}
+            for jid in jids])
+        self.assertIn('no_such_method', res[jids[0]])
+        self.assertEqual(res[jids[1]], '{} return'.format(jids[1]))
+        # The failed callback fails its job only.
+        job = self.jobs.search([('jid', '=', jids[0])])
+        self.assertEqual(job.state, 'failed')
+        self.assertIn('no_such_method', job.ret)
+        self.assertTrue(job.return_date)
+        self.assertEqual(
+            self.jobs.search([('jid', '=', jids[1])]).state, 'done')
+
+    def test_awaitable_job(self):
+        job = self.jobs.create({
+            'server': self.server.id,
+            'fun': 'test.ping',
+            'jid': '20210916150939079028',
+            'state': 'pending',
+            'handle': 'test-handle',
+        })
+        self.assertEqual(job._get_result(),
+                         {'state': 'pending', 'return': None})
+        self.jobs.returner({
+            'jid': '20210916150939079028',
+            'return': True,
+            'fun': 'test.ping',
+            'success': True})
+        self.assertEqual(job._get_result(),
+                         {'state': 'done', 'return': True})
+
+    def test_retry_later(self):
+        job = self.jobs.create({
+            'server': self.server.id,
+            'fun': 'test.ping',
+        })
+        self.assertEqual(job.state, 'queued')
+        job._retry_later('Salt API connection error!')
+        job._retry_later('Salt API connection error!')
+        self.assertEqual(job.attempts, 2)
+        self.assertGreater(job.next_try, datetime.utcnow() + timedelta(
+            seconds=salt_job.QUEUE_RETRY_DELAY * 3))
+        job.attempts = salt_job.QUEUE_MAX_ATTEMPTS
+        job._retry_later('Salt API connection error!')
+        self.assertEqual(job.state, 'failed')
+
+    def test_sent_job_not_resent(self):
+        job = self.jobs.create({
+            'server': self.server.id,
+            'fun': 'test.ping',
+            'jid': '20210916150939079030',
+            'next_try': datetime.utcnow() - timedelta(seconds=1),
+        })
+        self.assertEqual(job.state, 'queued')
+        # The job has a jid so it is not sent to Salt again.
+        job._send()
+        self.jobs.process_queue()
+        self.assertEqual(job.state, 'queued')
+        self.assertFalse(job.attempts)
+
+    def test_merge_queued_jobs(self):
+        job1 = self.jobs.create({
+            'server': self.server.id,
+            'fun': 'asterisk.update_access_rules',
+            'arg': '[[1]]',
+            'merge_key': 'asterisk.update_access_rules',
+        })
+        job2 = self.server._merge_job(
+            'asterisk.update_access_rules', {'arg': '[[1, 2]]'})
+        self.assertEqual(job1, job2)
+        self.assertEqual(job1.arg, '[[1, 2]]')
+        self.assertEqual(self.jobs.get_queue_depth(self.server.id), 1)
+
+    def test_calls_return(self):
+        job = self.jobs.create({
+            'server': self.server.id,
+            'fun': 'test.echo,test.ping',
+            'jid': '20210916150939079029',
+            'state': 'pending',
+            'calls': json.dumps([{
+                'fun': 'test.echo',
+                'res_model': 'asterisk_plus.server',
+                'res_method': 'custom_command_response',
+                'pass_back': {'id': self.server.id, 'uid': self.env.uid},
+            }, {
+                'fun': 'test.ping',
+            }]),
+        })
+        # Minion with multifunc_ordered returns a list.
+        self.jobs.returner({
+            'jid': '20210916150939079029',
+            'return': ['echo', True],
+            'fun': ['test.echo', 'test.ping'],
+            'success': True})
+        self.assertEqual(job.state, 'done')
+        self.assertEqual(self.server.custom_command_reply, 'echo')
+        self.assertTrue(self.server.multifunc_ordered)
+
+    def test_calls_return_by_fun(self):
+        job = self.jobs.create({
+            'server': self.server.id,
+            'fun': 'test.echo,test.ping',
+            'jid': '20210916150939079031',
+            'state': 'pending',
+            'calls': json.dumps([{
+                'fun': 'test.echo',
+                'res_model': 'asterisk_plus.server',
+                'res_method': 'custom_command_response',
+                'pass_back': {'id': self.server.id, 'uid': self.env.uid},
+            }, {
+                'fun': 'test.ping',
+            }]),
+        })
+        # Minion without multifunc_ordered returns a dict.
+        self.jobs.returner({
+            'jid': '20210916150939079031',
+            'return': {'test.ping': True, 'test.echo': 'echo'},
+            'fun': ['test.echo', 'test.ping'],
+            'success': True})
+        self.assertEqual(job.state, 'done')
+        self.assertEqual(self.server.custom_command_reply, 'echo')
+
+    def test_calls_return_repeated_fun(self):
+        self.server.multifunc_ordered = True
+        job = self.jobs.create({
+            'server': self.server.id,
+            'fun': 'test.echo,test.echo',
+            'jid': '20210916150939079032',
+            'state': 'pending',
+            'calls': json.dumps([{
+                'fun': 'test.echo',
+                'res_model': 'asterisk_plus.server',
+                'res_method': 'custom_command_response',
+                'pass_back': {'id': self.server.id, 'uid': self.env.uid},
+            }, {
+                'fun': 'test.echo',
+            }]),
+        })
+        # The minion has no multifunc_ordered, the first return is lost.
+        self.jobs.returner({
+            'jid': '20210916150939079032',
+            'return': {'test.echo': 'second'},
+            'fun': ['test.echo', 'test.echo'],
+            'success': True})
+        self.assertEqual(job.state, 'done')
+        self.assertIn('multifunc_ordered', self.server.custom_command_reply)
+        self.assertFalse(self.server.multifunc_ordered)
@@ -1,10 +1,12 @@
 # ©️ OdooPBX by Odooist, Odoo Proprietary License v1.0, 2020
+import json
 from odoo.tests import tagged
 from  odoo.addons.asterisk_plus.models.server import Server
 from odoo.tests.common import TransactionCase
 from unittest.mock import patch, call
 from unittest.mock import MagicMock
 from odoo.tests import new_test_user
+from odoo.exceptions import ValidationError
 
 
 class ServerTest(TransactionCase):
@@ -12,7 +14,10 @@ class ServerTest(TransactionCase):
     def setUp(self):
         res = super(ServerTest, self).setUp()
         # Mock local_job to emulate Salt API success response.
-        Server.local_job = MagicMock()
+        for name in ('local_job', 'local_jobs'):
+            patcher = patch.object(Server, name)
+            patcher.start()
+            self.addCleanup(patcher.stop)
         # Create a test server.
         self.server = self.env['asterisk_plus.server'].create({
             'name': 'Test',
@@ -35,6 +40,22 @@ class ServerTest(TransactionCase):
         self.server.local_job.return_value = [{'Response': 'Success'}]
         self.assertEqual(self.server.asterisk_ping(), [{'Response': 'Success'}])
 
+    def test_send_custom_command(self):
+        self.server.local_job.reset_mock()
+        self.server.custom_command = 'network.ping host=google.com'
+        self.server.send_custom_command()
+        self.assertEqual(self.server.custom_command_reply,
+                         'Waiting for reply...')
+        self.assertEqual(self.server.local_job.call_args[1]['kwarg'],
+                         {'host': 'google.com'})
+        # The reply is not overwritten.
+        self.server.custom_command_response(
+            'pong', {'id': self.server.id, 'uid': self.env.uid})
+        self.assertEqual(self.server.custom_command_reply, 'pong')
+        self.server.custom_command = 'network.ping google.com'
+        with self.assertRaises(ValidationError):
+            self.server.send_custom_command()
+
     def test_originate_call(self):
         self.server.local_job.reset_mock()
         test_res_user = new_test_user(
@@ -65,15 +86,12 @@ class ServerTest(TransactionCase):
             "originate_enabled": False,
         })
         self.server.with_user(test_res_user).with_context(no_commit=True).originate_call('0000000')
-        self.assertEqual(self.server.local_job.call_count, 2)
-        call1 = self.server.local_job.mock_calls[0]
-        call2 = self.server.local_job.mock_calls[1]
-        _, _, kwargs1 = call1
-        _, _, kwargs2 = call2
-        action1 = kwargs1['arg'][0]
-        action2 = kwargs2['arg'][0]
-        self.assertEqual(action1['Channel'], 'SIP/0001')
-        self.assertEqual(action2['Channel'], 'SIP/0002')
+        # Both channels are originated in one job.
+        self.assertEqual(self.server.local_jobs.call_count, 1)
+        calls = self.server.local_jobs.mock_calls[0][1][0]
+        self.assertEqual([k['arg']['Channel'] for k in calls],
+                         ['SIP/0001', 'SIP/0002'])
+        self.assertEqual(calls[0]['res_method'], 'originate_call_response')
 
     def test_originate_call_response(self):
         # Test Extension does not exist.
@@ -88,3 +106,81 @@ class ServerTest(TransactionCase):
             self.env['bus.bus'].search([], order='id desc', limit=1).message,
             '{"message":"Extension does not exist.","title":"PBX","sticky":false,"warning":true}'
         )
+
+
+class LocalJobsTest(TransactionCase):
+
+    def setUp(self):
+        super(LocalJobsTest, self).setUp()
+        self.server = self.env['asterisk_plus.server'].create({
+            'name': 'Test',
+            'server_id': 'test'
+        })
+        self.calls = [
+            {'fun': 'asterisk.put_config', 'arg': ['sip.conf', '']},
+            {'fun': 'asterisk.put_config', 'arg': ['pjsip.conf', '']},
+            {'fun': 'asterisk.manager_action', 'arg': {'Action': 'Reload'}}]
+
+    def _job_funs(self):
+        return self.env['asterisk_plus.salt_job'].search(
+            [('server', '=', self.server.id)], order='id').mapped('fun')
+
+    def test_local_jobs_ordered(self):
+        self.server.multifunc_ordered = True
+        self.server.local_jobs(self.calls)
+        self.assertEqual(self._job_funs(), [
+            'asterisk.put_config,asterisk.put_config,asterisk.manager_action'])
+
+    def test_local_jobs_not_ordered(self):
+        # A compound job does not get the same function twice.
+        self.server.local_jobs(self.calls)
+        self.assertEqual(self._job_funs(), [
+            'asterisk.put_config',
+            'asterisk.put_config,asterisk.manager_action'])
+
+
+class SaltApiBreakerTest(TransactionCase):
+
+    def test_circuit_breaker(self):
+        import requests
+        from odoo.addons.asterisk_plus.models import server
+        saltapi = server.SaltApiClient('http://localhost:1')
+        saltapi.session.post = MagicMock(
+            side_effect=requests.exceptions.ConnectionError('refused'))
+        for _ in range(server.SALTAPI_BREAKER_THRESHOLD):
+            with self.assertRaises(server.urllib.error.URLError):
+                saltapi.req('/')
+        self.assertEqual(saltapi.breaker_state, 'open')
+        # Open circuit fails without a request.
+        with self.assertRaises(server.SaltApiUnavailable):
+            saltapi.req('/')
+        self.assertEqual(saltapi.session.post.call_count,
+                         server.SALTAPI_BREAKER_THRESHOLD)
+        # After the reset time one probe closes the circuit.
+        saltapi.opened_at -= server.SALTAPI_BREAKER_RESET
+        saltapi.session.post = MagicMock(return_value=MagicMock(
+            status_code=200, json=lambda: {'return': []}))
+        self.assertEqual(saltapi.req('/'), {'return': []})
+        self.assertEqual(saltapi.breaker_state, 'closed')
+
+
+class ViewUpdateTest(TransactionCase):
+
+    def test_throttle(self):
+        updates = self.env['asterisk_plus.view_update']
+        model = 'asterisk_plus.call'
+        self.assertIsNone(updates._schedule(model, {'created': {1}}, 60))
+        # Updates within the interval wait for one timer.
+        self.assertGreater(
+            updates._schedule(model, {'updated': {1: {'status': 'up'}}}, 60),
+            0)
+        self.assertIsNone(updates._schedule(model, {'closed': {2}}, 60))
+        row = updates.search([('model', '=', model)])
+        self.assertEqual(json.loads(row.pending), {
+            'created': [], 'closed': [2], 'updated': {'1': {'status': 'up'}}})
+        updates._flush(model)
+        row.invalidate_cache()
+        self.assertFalse(row.pending)
+        # Nothing pending to send.
+        updates._flush(model)
+        updates._send(model, {})
@@ -14,7 +14,9 @@ class TestUser(TransactionCase):
     def setUp(self):
         super(TestUser, self).setUp()
         # Mock local_job to emulate Salt API success response.
-        Server.local_job = MagicMock()
+        patcher = patch.object(Server, 'local_job')
+        patcher.start()
+        self.addCleanup(patcher.stop)
         # Create a test server.
         self.server = self.env['asterisk_plus.server'].create({
             'name': 'Test server',